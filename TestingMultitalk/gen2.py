@@ -1,16 +1,13 @@
 import click
 import soundfile as sf
-import langid
-import jieba
 import os # need
+import sys
 import re
 import copy
 import torchaudio
 import tqdm
 # import yaml
-from openai import OpenAI #need
 import os #need
-import base64 #need
 import shutil
 import wave
 import json
@@ -26,11 +23,17 @@ from dataclasses import asdict
 import torch
 
 CURR_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(CURR_DIR, "..", "backend"))
+from boson import get_client
+from reference_audio import encoded_reference, reference_voice
+from audio_cache import render_cached
+from normalizer import normalize_transcript
+from profiling import profile_option
 
 AUDIO_PLACEHOLDER_TOKEN = "<|__AUDIO_PLACEHOLDER__|>"
 
 BOSON_API_KEY = os.getenv("BOSON_API_KEY")
-client = OpenAI(api_key=BOSON_API_KEY, base_url="https://hackathon.boson.ai/v1")
+client = get_client()
 
 MULTISPEAKER_DEFAULT_SYSTEM_MESSAGE = """You are an AI assistant designed to convert text into speech.
 If the user's message includes a [SPEAKER*] tag, do not read out the tag and generate speech for the following text, using the specified voice.
@@ -66,29 +69,16 @@ def _build_system_message_with_audio_prompt(system_message):
 # We don't need the class HiggsAudioModelClient, it is only for local inference
 
 
-def generate_reference_audio_from_description(client, character_name, voice_description, output_path):
-    prompt = f"[{character_name}] {voice_description}"
-    messages = [{"role": "user", "content": prompt}]
-    
-    response = client.chat.completions.create(
-        model="higgs-audio-generation-Hackathon",
-        messages=messages,
-        modalities=["text", "audio"],
-        max_completion_tokens=1024,
-        temperature=0.8,
-        top_p=0.95,
-        stream=False,
-        stop=["<|eot_id|>", "<|end_of_text|>", "<|audio_eos|>"],
-        extra_body={"top_k": 50},
-    )
-
-    audio_b64 = response.choices[0].message.audio.data
-    with open(output_path, "wb") as f:
-        f.write(base64.b64decode(audio_b64))
+def generate_reference_audio_from_description(client, character_name, voice_description, voice_dir):
+    """ Path of a reference clip for the description, generating it only the first time.
+    Concurrent callers asking for the same voice share one generation.
+    """
+    return reference_voice(client, character_name, voice_description, voice_dir, temperature=0.8)
 
 
 def b64(path):
-    return base64.b64encode(open(path, "rb").read()).decode("utf-8")
+    # Encoded once per file version, not once per request
+    return encoded_reference(path)
 
 def prepare_generation_context_api(
     client,
@@ -151,9 +141,9 @@ def prepare_generation_context_api(
 
         # If audio is missing, generate it from voice description
         if not audio_path:
-            audio_path = os.path.join(ref_audio_dir, f"{speaker}.wav")
-            if not os.path.exists(audio_path):
-                generate_reference_audio_from_description(client, speaker, ref["voice_description"], audio_path)
+            audio_path = generate_reference_audio_from_description(
+                client, speaker, ref["voice_description"], os.path.join(ref_audio_dir, "voices")
+            )
         else:
             # If audio_path is provided but not named as speaker.wav, copy it
             target_path = os.path.join(ref_audio_dir, f"{speaker}.wav")
@@ -197,6 +187,7 @@ def prepare_generation_context_api(
     return messages
 
 @click.command()
+@profile_option
 @click.option(
     "--transcript",
     type=str,
@@ -235,40 +226,14 @@ def prepare_generation_context_api(
 
 def main(transcript, scene_prompt, ref_audio_dir = "./ref_audio"):
     # Load Boson API client
-    BOSON_API_KEY = os.getenv("BOSON_API_KEY")
-    client = OpenAI(api_key=BOSON_API_KEY, base_url="https://hackathon.boson.ai/v1")
+    client = get_client()
 
     # Load dialogue text
     if os.path.exists(r"TestingMultitalk\tomorrow.txt"):
         with open(r"TestingMultitalk\tomorrow.txt", "r", encoding="utf-8") as f:
             transcript = f.read().strip()
 
-    transcript = transcript.replace("(", " ")
-    transcript = transcript.replace(")", " ")
-    transcript = transcript.replace("°F", " degrees Fahrenheit")
-    transcript = transcript.replace("°C", " degrees Celsius")
-
-    for tag, replacement in [
-        ("[laugh]", "<SE>[Laughter]</SE>"),
-        ("[humming start]", "<SE_s>[Humming]</SE_s>"),
-        ("[humming end]", "<SE_e>[Humming]</SE_e>"),
-        ("[music start]", "<SE_s>[Music]</SE_s>"),
-        ("[music end]", "<SE_e>[Music]</SE_e>"),
-        ("[music]", "<SE>[Music]</SE>"),
-        ("[sing start]", "<SE_s>[Singing]</SE_s>"),
-        ("[sing end]", "<SE_e>[Singing]</SE_e>"),
-        ("[applause]", "<SE>[Applause]</SE>"),
-        ("[cheering]", "<SE>[Cheering]</SE>"),
-        ("[cough]", "<SE>[Cough]</SE>"),
-    ]:
-        transcript = transcript.replace(tag, replacement)
-
-    transcript = transcript.replace("[", "<|speaker_id_start|>")
-    transcript = transcript.replace("]", "<|speaker_id_end|>")
-    lines = transcript.split("\n")
-
-    transcript = "\n".join([" ".join(line.split()) for line in lines if line.strip()])
-    transcript = transcript.strip()
+    transcript = normalize_transcript(transcript)
 
     # Load scene prompt
     if scene_prompt.lower() == "":
@@ -298,8 +263,8 @@ Oh, Wow, that was really scary. And if you don't mind me saying, if that don't w
         ref_audio_dir=ref_audio_dir
     )
 
-    # Call Boson API
-    response = client.chat.completions.create(
+    # Call Boson API, unless this exact request was rendered before
+    audio_bytes = render_cached(client, dict(
         model="higgs-audio-generation-Hackathon",
         messages=messages,
         modalities=["text", "audio"],
@@ -309,13 +274,12 @@ Oh, Wow, that was really scary. And if you don't mind me saying, if that don't w
         stream=False,
         stop=["<|eot_id|>", "<|end_of_text|>", "<|audio_eos|>"],
         extra_body={"top_k": 50},
-    )
+    ))
 
     # print(json.dumps(messages, indent=2))
     
     # Save audio
-    audio_b64 = response.choices[0].message.audio.data
-    open("gen2_out.wav", "wb").write(base64.b64decode(audio_b64))
+    open("gen2_out.wav", "wb").write(audio_bytes)
 
     print("Audio saved")
 
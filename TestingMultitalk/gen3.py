@@ -1,30 +1,22 @@
 import os
-import base64
+import sys
 import torch
 import torchaudio
-from openai import OpenAI
+
+CURR_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(CURR_DIR, "..", "backend"))
+from boson import get_client
+from reference_audio import encoded_reference, reference_voice
+from audio_cache import render_cached
+from script_parser import parse_turns
 
 # Setup
 BOSON_API_KEY = os.getenv("BOSON_API_KEY")
-client = OpenAI(api_key=BOSON_API_KEY, base_url="https://hackathon.boson.ai/v1")
+client = get_client()
 
-def generate_reference_audio_from_description(client, speaker, voice_description, output_path):
-    prompt = f"[{speaker}] {voice_description}"
-    messages = [{"role": "user", "content": prompt}]
-    response = client.chat.completions.create(
-        model="higgs-audio-generation-Hackathon",
-        messages=messages,
-        modalities=["text", "audio"],
-        max_completion_tokens=1024,
-        temperature=1.0,
-        top_p=0.95,
-        stream=False,
-        stop=["<|eot_id|>", "<|end_of_text|>", "<|audio_eos|>"],
-        extra_body={"top_k": 50},
-    )
-    audio_b64 = response.choices[0].message.audio.data
-    with open(output_path, "wb") as f:
-        f.write(base64.b64decode(audio_b64))
+def generate_reference_audio_from_description(client, speaker, voice_description, voice_dir):
+    # Generated once per description and settings, see reference_audio.reference_voice
+    return reference_voice(client, speaker, voice_description, voice_dir, temperature=1.0)
 
 def generate_audio(text, speaker_tag, reference_audio_path, transcript, output_path):
     messages = [
@@ -32,13 +24,13 @@ def generate_audio(text, speaker_tag, reference_audio_path, transcript, output_p
         {"role": "assistant", "content": [{
             "type": "input_audio",
             "input_audio": {
-                "data": base64.b64encode(open(reference_audio_path, "rb").read()).decode("utf-8"),
+                "data": encoded_reference(reference_audio_path),
                 "format": "wav"
             }
         }]},
         {"role": "user", "content": text}
     ]
-    response = client.chat.completions.create(
+    audio_bytes = render_cached(client, dict(
         model="higgs-audio-generation-Hackathon",
         messages=messages,
         modalities=["text", "audio"],
@@ -48,31 +40,14 @@ def generate_audio(text, speaker_tag, reference_audio_path, transcript, output_p
         stream=False,
         stop=["<|eot_id|>", "<|end_of_text|>", "<|audio_eos|>", "[SPEAKER1]", "[SPEAKER2]"],
         extra_body={"top_k": 50},
-    )
-    audio_b64 = response.choices[0].message.audio.data
+    ))
     with open(output_path, "wb") as f:
-        f.write(base64.b64decode(audio_b64))
+        f.write(audio_bytes)
 
 def parse_dialogue(dialogue_path):
     with open(dialogue_path, "r", encoding="utf-8") as f:
-        lines = f.readlines()
-    turns = []
-    current_speaker = None
-    buffer = []
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-        if line.startswith("[") and line.endswith("]"):
-            if current_speaker and buffer:
-                turns.append((current_speaker, " ".join(buffer)))
-                buffer = []
-            current_speaker = line.strip("[]")
-        else:
-            buffer.append(line)
-    if current_speaker and buffer:
-        turns.append((current_speaker, " ".join(buffer)))
-    return turns
+        script = f.read()
+    return [(turn.speaker, " ".join(turn.lines(script))) for turn in parse_turns(script)]
 
 def split_waveform(waveform, num_chunks):
     total_frames = waveform.shape[1]
@@ -88,14 +63,11 @@ def main():
     speaker1_txt = "speaker1.txt"
     speaker2_txt = "speaker2.txt"
     dialogue_txt = "fight.txt"
-    speaker1_ref = os.path.join(ref_audio_dir, "speaker1.wav")
-    speaker2_ref = os.path.join(ref_audio_dir, "speaker2.wav")
+    voice_dir = os.path.join(ref_audio_dir, "voices")
 
     # Generate reference audio if missing
-    if not os.path.exists(speaker1_ref):
-        generate_reference_audio_from_description(client, "SPEAKER1", "A warm, thoughtful woman with a soft British accent.", speaker1_ref)
-    if not os.path.exists(speaker2_ref):
-        generate_reference_audio_from_description(client, "SPEAKER2", "A confident, energetic man with a New York accent.", speaker2_ref)
+    speaker1_ref = generate_reference_audio_from_description(client, "SPEAKER1", "A warm, thoughtful woman with a soft British accent.", voice_dir)
+    speaker2_ref = generate_reference_audio_from_description(client, "SPEAKER2", "A confident, energetic man with a New York accent.", voice_dir)
 
     # Load speaker texts
     speaker1_lines = open(speaker1_txt, "r", encoding="utf-8").read().strip()
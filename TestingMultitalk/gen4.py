@@ -2,23 +2,27 @@
 
 import click
 # import soundfile as sf
-import langid
-import jieba
 import os
+import sys
 import re
 import yaml
-from openai import OpenAI
 import os
 import wave
 from data_types import AudioContent, TextContent, Message, ChatMLSample
 
 from typing import List
-from typing import Optional
 from dataclasses import asdict
 import torch
-import base64
 
 CURR_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(CURR_DIR, "..", "backend"))
+from boson import get_client
+from normalizer import normalize_transcript
+from chunking import prepare_chunk_text
+from audio import concat_wav
+from fanout import render_chunks
+from audio_cache import render_cached
+from profiling import profile_option
 
 
 AUDIO_PLACEHOLDER_TOKEN = "<|__AUDIO_PLACEHOLDER__|>"
@@ -29,84 +33,7 @@ If the user's message includes a [SPEAKER*] tag, do not read out the tag and gen
 If no speaker tag is present, select a suitable voice on your own."""
 
 BOSON_API_KEY = os.getenv("BOSON_API_KEY")
-client = OpenAI(api_key=BOSON_API_KEY, base_url="https://hackathon.boson.ai/v1")
-
-
-def prepare_chunk_text(
-    text, chunk_method: Optional[str] = None, chunk_max_word_num: int = 100, chunk_max_num_turns: int = 1
-):
-    """Chunk the text into smaller pieces. We will later feed the chunks one by one to the model.
-
-    Parameters
-    ----------
-    text : str
-        The text to be chunked.
-    chunk_method : str, optional
-        The method to use for chunking. Options are "speaker", "word", or None. By default, we won't use any chunking and
-        will feed the whole text to the model.
-    replace_speaker_tag_with_special_tags : bool, optional
-        Whether to replace speaker tags with special tokens, by default False
-        If the flag is set to True, we will replace [SPEAKER0] with <|speaker_id_start|>SPEAKER0<|speaker_id_end|>
-    chunk_max_word_num : int, optional
-        The maximum number of words for each chunk when "word" chunking method is used, by default 100
-    chunk_max_num_turns : int, optional
-        The maximum number of turns for each chunk when "speaker" chunking method is used,
-
-    Returns
-    -------
-    List[str]
-        The list of text chunks.
-
-    """
-    if chunk_method is None:
-        return [text]
-    elif chunk_method == "speaker":
-        lines = text.split("\n")
-        speaker_chunks = []
-        speaker_utterance = ""
-        for line in lines:
-            line = line.strip()
-            if line.startswith("[SPEAKER") or line.startswith("<|speaker_id_start|>"):
-                if speaker_utterance:
-                    speaker_chunks.append(speaker_utterance.strip())
-                speaker_utterance = line
-            else:
-                if speaker_utterance:
-                    speaker_utterance += "\n" + line
-                else:
-                    speaker_utterance = line
-        if speaker_utterance:
-            speaker_chunks.append(speaker_utterance.strip())
-        if chunk_max_num_turns > 1:
-            merged_chunks = []
-            for i in range(0, len(speaker_chunks), chunk_max_num_turns):
-                merged_chunk = "\n".join(speaker_chunks[i : i + chunk_max_num_turns])
-                merged_chunks.append(merged_chunk)
-            return merged_chunks
-        return speaker_chunks
-    elif chunk_method == "word":
-        # TODO: We may improve the logic in the future
-        # For long-form generation, we will first divide the text into multiple paragraphs by splitting with "\n\n"
-        # After that, we will chunk each paragraph based on word count
-        language = langid.classify(text)[0]
-        paragraphs = text.split("\n\n")
-        chunks = []
-        for idx, paragraph in enumerate(paragraphs):
-            if language == "zh":
-                # For Chinese, we will chunk based on character count
-                words = list(jieba.cut(paragraph, cut_all=False))
-                for i in range(0, len(words), chunk_max_word_num):
-                    chunk = "".join(words[i : i + chunk_max_word_num])
-                    chunks.append(chunk)
-            else:
-                words = paragraph.split(" ")
-                for i in range(0, len(words), chunk_max_word_num):
-                    chunk = " ".join(words[i : i + chunk_max_word_num])
-                    chunks.append(chunk)
-            chunks[-1] += "\n\n"
-        return chunks
-    else:
-        raise ValueError(f"Unknown chunk method: {chunk_method}")
+client = get_client()
 
 
 def _build_system_message_with_audio_prompt(system_message):
@@ -237,6 +164,7 @@ def prepare_generation_context(scene_prompt, ref_audio, ref_audio_in_system_mess
 
 
 @click.command()
+@profile_option
 @click.option(
     "--audio_tokenizer",
     type=str,
@@ -308,8 +236,8 @@ def prepare_generation_context(scene_prompt, ref_audio, ref_audio_in_system_mess
 @click.option(
     "--chunk_method",
     default=None,
-    type=click.Choice([None, "speaker", "word"]),
-    help="The method to use for chunking the prompt text. Options are 'speaker', 'word', or None. By default, we won't use any chunking and will feed the whole text to the model.",
+    type=click.Choice([None, "speaker", "word", "budget"]),
+    help="The method to use for chunking the prompt text. Options are 'speaker', 'word', 'budget', or None. By default, we won't use any chunking and will feed the whole text to the model. 'budget' packs whole speaker turns into as few chunks as fit the completion token limit.",
 )
 @click.option(
     "--chunk_max_word_num",
@@ -376,28 +304,7 @@ def main(
 
     speaker_tags = sorted(set(pattern.findall(transcript)))
     # Other normalizations (e.g., parentheses and other symbols. Will be improved in the future)
-    transcript = transcript.replace("(", " ")
-    transcript = transcript.replace(")", " ")
-    transcript = transcript.replace("°F", " degrees Fahrenheit")
-    transcript = transcript.replace("°C", " degrees Celsius")
-
-    for tag, replacement in [
-        ("[laugh]", "<SE>[Laughter]</SE>"),
-        ("[humming start]", "<SE_s>[Humming]</SE_s>"),
-        ("[humming end]", "<SE_e>[Humming]</SE_e>"),
-        ("[music start]", "<SE_s>[Music]</SE_s>"),
-        ("[music end]", "<SE_e>[Music]</SE_e>"),
-        ("[music]", "<SE>[Music]</SE>"),
-        ("[sing start]", "<SE_s>[Singing]</SE_s>"),
-        ("[sing end]", "<SE_e>[Singing]</SE_e>"),
-        ("[applause]", "<SE>[Applause]</SE>"),
-        ("[cheering]", "<SE>[Cheering]</SE>"),
-        ("[cough]", "<SE>[Cough]</SE>"),
-    ]:
-        transcript = transcript.replace(tag, replacement)
-    lines = transcript.split("\n")
-    transcript = "\n".join([" ".join(line.split()) for line in lines if line.strip()])
-    transcript = transcript.strip()
+    transcript = normalize_transcript(transcript, speaker_id_tags=False)
 
     if not any([transcript.endswith(c) for c in [".", "!", "?", ",", ";", '"', "'", "</SE_e>", "</SE>"]]):
         transcript += "."
@@ -414,22 +321,25 @@ def main(
         chunk_method=chunk_method,
         chunk_max_word_num=chunk_max_word_num,
         chunk_max_num_turns=chunk_max_num_turns,
-    )
-
-    # Call Boson model to generate audio
-    resp = client.chat.completions.create(
-        model="higgs-audio-generation-Hackathon",
-        messages=messages,
-        modalities=["text", "audio"],
         max_completion_tokens=4096,
-        temperature=1.0,
-        top_p=0.95,
-        stream=False  # non-streaming, full audio output
     )
 
-    # Extract audio from the response
-    audio_base64 = resp.choices[0].message["audio"]["data"]
-    audio_bytes = base64.b64decode(audio_base64)
+    # Call Boson model to generate audio, one request per chunk. Every chunk is conditioned
+    # on the same context messages rather than the previous chunk's audio, so the chunks
+    # can be rendered concurrently and put back in order afterwards.
+    # Chunks rendered before with the same context come from the audio cache.
+    def render_chunk(chunk_text):
+        return render_cached(client, dict(
+            model="higgs-audio-generation-Hackathon",
+            messages=messages + [{"role": "user", "content": chunk_text}],
+            modalities=["text", "audio"],
+            max_completion_tokens=4096,
+            temperature=1.0,
+            top_p=0.95,
+            stream=False  # non-streaming, full audio output
+        ))
+
+    audio_bytes = concat_wav(render_chunks(chunked_text, render_chunk))
 
     # Save audio to WAV file
     with open("output.wav", "wb") as f:
@@ -2,17 +2,21 @@
 
 import click
 import os
+import sys
 import re
 import yaml
-import jieba
-import langid
-import base64
 from typing import List, Optional
 from dataclasses import asdict
-from openai import OpenAI
 from data_types import AudioContent, TextContent, Message
 
 CURR_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(CURR_DIR, "..", "backend"))
+from boson import get_client
+from audio_cache import render_cached
+from normalizer import normalize_transcript
+from chunking import prepare_chunk_text
+from profiling import profile_option
+
 AUDIO_PLACEHOLDER_TOKEN = "<|__AUDIO_PLACEHOLDER__|>"
 
 MULTISPEAKER_DEFAULT_SYSTEM_MESSAGE = """You are an AI assistant designed to convert text into speech.
@@ -20,62 +24,7 @@ If the user's message includes a [SPEAKER*] tag, do not read out the tag and gen
 If no speaker tag is present, select a suitable voice on your own."""
 
 BOSON_API_KEY = os.getenv("BOSON_API_KEY")
-client = OpenAI(api_key=BOSON_API_KEY, base_url="https://hackathon.boson.ai/v1")
-
-
-def prepare_chunk_text(
-    text: str,
-    chunk_method: Optional[str] = None,
-    chunk_max_word_num: int = 100,
-    chunk_max_num_turns: int = 1,
-) -> List[str]:
-    """Chunk text by speaker or word count."""
-    if chunk_method is None:
-        return [text]
-
-    elif chunk_method == "speaker":
-        lines = text.split("\n")
-        speaker_chunks = []
-        speaker_utterance = ""
-        for line in lines:
-            line = line.strip()
-            if line.startswith("[SPEAKER") or line.startswith("<|speaker_id_start|>"):
-                if speaker_utterance:
-                    speaker_chunks.append(speaker_utterance.strip())
-                speaker_utterance = line
-            else:
-                speaker_utterance += ("\n" + line) if speaker_utterance else line
-        if speaker_utterance:
-            speaker_chunks.append(speaker_utterance.strip())
-
-        if chunk_max_num_turns > 1:
-            merged_chunks = []
-            for i in range(0, len(speaker_chunks), chunk_max_num_turns):
-                merged_chunks.append("\n".join(speaker_chunks[i : i + chunk_max_num_turns]))
-            return merged_chunks
-
-        return speaker_chunks
-
-    elif chunk_method == "word":
-        language = langid.classify(text)[0]
-        paragraphs = text.split("\n\n")
-        chunks = []
-
-        for paragraph in paragraphs:
-            if language == "zh":
-                words = list(jieba.cut(paragraph, cut_all=False))
-                for i in range(0, len(words), chunk_max_word_num):
-                    chunks.append("".join(words[i:i + chunk_max_word_num]))
-            else:
-                words = paragraph.split(" ")
-                for i in range(0, len(words), chunk_max_word_num):
-                    chunks.append(" ".join(words[i:i + chunk_max_word_num]))
-
-            chunks[-1] += "\n\n"
-        return chunks
-
-    else:
-        raise ValueError(f"Unknown chunk method: {chunk_method}")
+client = get_client()
 
 
 def _build_system_message_with_audio_prompt(system_message: str) -> Message:
@@ -168,11 +117,12 @@ def prepare_generation_context(
 
 
 @click.command()
+@profile_option
 @click.option("--transcript", type=str, default=r"TestingMultitalk\en_argument.txt")
 @click.option("--scene_prompt", type=str, default=f"{CURR_DIR}/scene_prompts/quiet_indoor.txt")
 @click.option("--ref_audio", type=str, default=None)
 @click.option("--ref_audio_in_system_message", is_flag=True, default=False)
-@click.option("--chunk_method", default=None, type=click.Choice([None, "speaker", "word"]))
+@click.option("--chunk_method", default=None, type=click.Choice([None, "speaker", "word", "budget"]))
 @click.option("--chunk_max_word_num", default=200, type=int)
 @click.option("--chunk_max_num_turns", default=1, type=int)
 @click.option("--out_path", type=str, default="generation.wav")
@@ -205,22 +155,7 @@ def main(
     speaker_tags = sorted(set(pattern.findall(transcript)))
 
     # Clean transcript
-    transcript = transcript.replace("(", " ").replace(")", " ").replace("°F", " degrees Fahrenheit").replace("°C", " degrees Celsius")
-    for tag, replacement in [
-        ("[laugh]", "<SE>[Laughter]</SE>"),
-        ("[humming start]", "<SE_s>[Humming]</SE_s>"),
-        ("[humming end]", "<SE_e>[Humming]</SE_e>"),
-        ("[music start]", "<SE_s>[Music]</SE_s>"),
-        ("[music end]", "<SE_e>[Music]</SE_e>"),
-        ("[music]", "<SE>[Music]</SE>"),
-        ("[sing start]", "<SE_s>[Singing]</SE_s>"),
-        ("[sing end]", "<SE_e>[Singing]</SE_e>"),
-        ("[applause]", "<SE>[Applause]</SE>"),
-        ("[cheering]", "<SE>[Cheering]</SE>"),
-        ("[cough]", "<SE>[Cough]</SE>"),
-    ]:
-        transcript = transcript.replace(tag, replacement)
-    transcript = "\n".join([" ".join(line.split()) for line in transcript.split("\n") if line.strip()]).strip()
+    transcript = normalize_transcript(transcript, speaker_id_tags=False)
     if not any(transcript.endswith(c) for c in [".", "!", "?", ",", ";", '"', "'", "</SE_e>", "</SE>"]):
         transcript += "."
 
@@ -240,10 +175,11 @@ def main(
         chunk_method=chunk_method,
         chunk_max_word_num=chunk_max_word_num,
         chunk_max_num_turns=chunk_max_num_turns,
+        max_completion_tokens=4096,
     )
 
-    # Generate audio
-    resp = client.chat.completions.create(
+    # Generate audio, unless this exact request was rendered before
+    audio_bytes = render_cached(client, dict(
         model="higgs-audio-generation-Hackathon",
         messages=messages,
         modalities=["text", "audio"],
@@ -251,10 +187,8 @@ def main(
         temperature=1.0,
         top_p=0.95,
         stream=False
-    )
+    ))
 
-    audio_base64 = resp.choices[0].message["audio"]["data"]
-    audio_bytes = base64.b64decode(audio_base64)
 
     # Save audio
     with open(out_path, "wb") as f:
@@ -1,10 +1,18 @@
-from openai import OpenAI
-import base64
 import os
+import sys
 import wave
 import click
 import re
 
+CURR_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(CURR_DIR, "..", "backend"))
+from boson import get_client
+from reference_audio import encoded_reference
+from audio_cache import render_cached
+from normalizer import iter_file_blocks, normalize_lines, normalize_transcript
+from script_parser import ScriptIndex
+from cast import assign_speakers, discover_cast
+
 BOSON_API_KEY = os.getenv("BOSON_API_KEY")
 
 AUDIO_PLACEHOLDER_TOKEN = "<|__AUDIO_PLACEHOLDER__|>"
@@ -27,7 +35,8 @@ If no speaker tag is present, select a suitable voice on your own."""
 #     help="The scene description prompt to use for generation. If not set, or set to `empty`, we will leave it to empty.",
 # )
 def b64(path):
-    return base64.b64encode(open(path, "rb").read()).decode("utf-8")
+    # Encoded once per file version, not once per request
+    return encoded_reference(path)
 
 def generate_prompt_scene_description(scene_prompt, scene_prompt_given):
     """ Generate scene description block for system message.
@@ -49,26 +58,7 @@ def extract_scene_description(full_transcript):
         scene_prompt_given (bool): Whether a scene description was found.
         remaining_transcript (str): The transcript without the scene description.
     """
-    lines = full_transcript.split("\n")
-
-    setting_index = lines.index("SETTING:") if "SETTING:" in lines else -1
-    
-    # if no "SETTING:" found
-    if setting_index == -1:
-        return "", False, full_transcript
-    
-    # if "SETTING:" found, find the end of the setting block (can be multiple lines)
-    for i in range(setting_index + 1, len(lines)):
-        if lines[i] == "":
-            setting_end_index = i
-            break
-    else:
-        setting_end_index = len(lines)
-
-    # Extract the scene description and remaining transcript
-    scene_prompt = "\n".join(lines[setting_index + 1:setting_end_index]).strip()
-    remaining_transcript = "\n".join(lines[setting_end_index:]).strip()
-    return scene_prompt, True, remaining_transcript
+    return ScriptIndex(full_transcript).scene_description()
 
 
 """
@@ -81,33 +71,7 @@ process:
 """
 
 def formated_script(script):
-    script = script.replace("(", " ")
-    script = script.replace(")", " ")
-    script = script.replace("°F", " degrees Fahrenheit")
-    script = script.replace("°C", " degrees Celsius")
-
-    for tag, replacement in [
-        ("[laugh]", "<SE>[Laughter]</SE>"),
-        ("[humming start]", "<SE_s>[Humming]</SE_s>"),
-        ("[humming end]", "<SE_e>[Humming]</SE_e>"),
-        ("[music start]", "<SE_s>[Music]</SE_s>"),
-        ("[music end]", "<SE_e>[Music]</SE_e>"),
-        ("[music]", "<SE>[Music]</SE>"),
-        ("[sing start]", "<SE_s>[Singing]</SE_s>"),
-        ("[sing end]", "<SE_e>[Singing]</SE_e>"),
-        ("[applause]", "<SE>[Applause]</SE>"),
-        ("[cheering]", "<SE>[Cheering]</SE>"),
-        ("[cough]", "<SE>[Cough]</SE>"),
-    ]:
-        script = script.replace(tag, replacement)
-
-    script = script.replace("[", "<|speaker_id_start|>")
-    script = script.replace("]", "<|speaker_id_end|>")
-    lines = script.split("\n")
-
-    script = "\n".join([" ".join(line.split()) for line in lines if line.strip()])
-    script = script.strip()
-    return script
+    return normalize_transcript(script)
 
 def extract_dialogue(script, actor_speaker):
     """ Extract dialogue turns from the script.
@@ -115,54 +79,30 @@ def extract_dialogue(script, actor_speaker):
         script (str): The full script text. (excluding scene description)
         actor_speaker (dictionary): A dictionary mapping actor names to their speaker tags. """
     
-    lines = script.split("\n")
-
-    dialogue = []
-
-    for i in range(len(lines)):
-        if lines[i] in actor_speaker.keys():
-            for j in range(i+1, len(lines)):
-                if lines[j] in actor_speaker.keys() or lines[j] == "":
-                    break
-                cur_tag = actor_speaker[lines[i]]
-                cur_speech = f"[{cur_tag}]{lines[j]}"
-                dialogue.append(cur_speech)
-    
-    return "\n".join(dialogue)
+    return ScriptIndex(script, actor_speaker).dialogue()
             
 
-# do a dictionary mapping actor name to voice description
-# and another mapping speaker tag to actor name (opposite)
-
-def actor_speaker_mapping(actor_voice_desc):
-    actor_speaker = {}
-    for actor in actor_voice_desc.keys():
-        speaker_tag = f"SPEAKER{len(actor_speaker)+1}"
-        actor_speaker[actor] = speaker_tag
-    return actor_speaker
-
-
-
 def main():
     if os.path.exists(r"sample_ft.txt"):
-        with open(r"sample_ft.txt", "r", encoding="utf-8") as f:
-            transcript = f.read().strip()
+        transcript = "\n".join(normalize_lines(iter_file_blocks(r"sample_ft.txt")))
 
-    transcript = formated_script(transcript)
+    # Find the characters in the script instead of hard-coding them
+    actor_speaker_tags = assign_speakers(discover_cast(transcript))
 
-    scene_prompt, scene_prompt_given, remaining_transcript = extract_scene_description(transcript)
+    # One index serves both the scene description and the dialogue after it
+    index = ScriptIndex(transcript, actor_speaker_tags)
 
-    final_scene_prompt = generate_prompt_scene_description(scene_prompt, scene_prompt_given)
+    scene_prompt, scene_prompt_given, _ = index.scene_description()
 
-    actor_speaker_tags = actor_speaker_mapping({"Macbeth": "masculine voice", "Lady Macbeth": "feminine voice"})
+    final_scene_prompt = generate_prompt_scene_description(scene_prompt, scene_prompt_given)
 
-    dialogue = extract_dialogue(remaining_transcript, actor_speaker_tags)
+    dialogue = index.dialogue(start=index.body_start)
 
-    client = OpenAI(api_key=BOSON_API_KEY, base_url="https://hackathon.boson.ai/v1")
+    client = get_client()
 
     final_content = "Generate realistic multi-speaker audio." + final_scene_prompt + "\n" + dialogue
 
-    resp = client.chat.completions.create(
+    audio_bytes = render_cached(client, dict(
         model="higgs-audio-generation-Hackathon",
         messages=[
             
@@ -177,10 +117,9 @@ def main():
         stream=False,
         stop=["<|eot_id|>", "<|end_of_text|>", "<|audio_eos|>"],
         extra_body={"top_k": 50},
-    )
+    ))
 
-    audio_b64 = resp.choices[0].message.audio.data
-    open("gen6.wav", "wb").write(base64.b64decode(audio_b64))
+    open("gen6.wav", "wb").write(audio_bytes)
 
 if __name__ == "__main__":
     main()
@@ -2,9 +2,8 @@
 
 import click
 import soundfile as sf
-import langid
-import jieba
 import os
+import sys
 import re
 import copy
 import torchaudio
@@ -35,6 +34,11 @@ from dataclasses import asdict
 import torch
 
 CURR_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(CURR_DIR, "..", "backend"))
+from normalizer import normalize_transcript
+from chunking import prepare_chunk_text
+from tracing import span, start_span
+from profiling import profile_option
 
 
 AUDIO_PLACEHOLDER_TOKEN = "<|__AUDIO_PLACEHOLDER__|>"
@@ -45,83 +49,6 @@ If the user's message includes a [SPEAKER*] tag, do not read out the tag and gen
 If no speaker tag is present, select a suitable voice on your own."""
 
 
-def prepare_chunk_text(
-    text, chunk_method: Optional[str] = None, chunk_max_word_num: int = 100, chunk_max_num_turns: int = 1
-):
-    """Chunk the text into smaller pieces. We will later feed the chunks one by one to the model.
-
-    Parameters
-    ----------
-    text : str
-        The text to be chunked.
-    chunk_method : str, optional
-        The method to use for chunking. Options are "speaker", "word", or None. By default, we won't use any chunking and
-        will feed the whole text to the model.
-    replace_speaker_tag_with_special_tags : bool, optional
-        Whether to replace speaker tags with special tokens, by default False
-        If the flag is set to True, we will replace [SPEAKER0] with <|speaker_id_start|>SPEAKER0<|speaker_id_end|>
-    chunk_max_word_num : int, optional
-        The maximum number of words for each chunk when "word" chunking method is used, by default 100
-    chunk_max_num_turns : int, optional
-        The maximum number of turns for each chunk when "speaker" chunking method is used,
-
-    Returns
-    -------
-    List[str]
-        The list of text chunks.
-
-    """
-    if chunk_method is None:
-        return [text]
-    elif chunk_method == "speaker":
-        lines = text.split("\n")
-        speaker_chunks = []
-        speaker_utterance = ""
-        for line in lines:
-            line = line.strip()
-            if line.startswith("[SPEAKER") or line.startswith("<|speaker_id_start|>"):
-                if speaker_utterance:
-                    speaker_chunks.append(speaker_utterance.strip())
-                speaker_utterance = line
-            else:
-                if speaker_utterance:
-                    speaker_utterance += "\n" + line
-                else:
-                    speaker_utterance = line
-        if speaker_utterance:
-            speaker_chunks.append(speaker_utterance.strip())
-        if chunk_max_num_turns > 1:
-            merged_chunks = []
-            for i in range(0, len(speaker_chunks), chunk_max_num_turns):
-                merged_chunk = "\n".join(speaker_chunks[i : i + chunk_max_num_turns])
-                merged_chunks.append(merged_chunk)
-            return merged_chunks
-        return speaker_chunks
-    elif chunk_method == "word":
-        # TODO: We may improve the logic in the future
-        # For long-form generation, we will first divide the text into multiple paragraphs by splitting with "\n\n"
-        # After that, we will chunk each paragraph based on word count
-        language = langid.classify(text)[0]
-        paragraphs = text.split("\n\n")
-        chunks = []
-        for idx, paragraph in enumerate(paragraphs):
-            if language == "zh":
-                # For Chinese, we will chunk based on character count
-                words = list(jieba.cut(paragraph, cut_all=False))
-                for i in range(0, len(words), chunk_max_word_num):
-                    chunk = "".join(words[i : i + chunk_max_word_num])
-                    chunks.append(chunk)
-            else:
-                words = paragraph.split(" ")
-                for i in range(0, len(words), chunk_max_word_num):
-                    chunk = " ".join(words[i : i + chunk_max_word_num])
-                    chunks.append(chunk)
-            chunks[-1] += "\n\n"
-        return chunks
-    else:
-        raise ValueError(f"Unknown chunk method: {chunk_method}")
-
-
 def _build_system_message_with_audio_prompt(system_message):
     contents = []
 
@@ -151,79 +78,79 @@ class HiggsAudioModelClient:
         kv_cache_lengths: List[int] = [1024, 4096, 8192],  # Multiple KV cache sizes,
         use_static_kv_cache=False,
     ):
-        # # Use explicit device if provided, otherwise try CUDA/MPS/CPU
-        # if device_id is not None:
-        #     device = f"cuda:{device_id}"
-        #     self._device = device
-        # else:
-        #     if device is not None:
-        #         self._device = device
-        #     else:  # We get to choose the device
-        #         # Prefer CUDA over MPS (Apple Silicon GPU) over CPU if available
-        #         if torch.cuda.is_available():
-        #             self._device = "cuda:0"
-        #         elif torch.backends.mps.is_available():
-        #             self._device = "mps"
-        #         else:
-        #             self._device = "cpu"
-
-        # logger.info(f"Using device: {self._device}")
-    #     if isinstance(audio_tokenizer, str):
-    #         # For MPS, use CPU due to embedding operation limitations in quantization layers
-    #         audio_tokenizer_device = "cpu" if self._device == "mps" else self._device
-    #         self._audio_tokenizer = load_higgs_audio_tokenizer(audio_tokenizer, device=audio_tokenizer_device)
-    #     else:
-    #         self._audio_tokenizer = audio_tokenizer
-
-    #     self._model = HiggsAudioModel.from_pretrained(
-    #         model_path,
-    #         device_map=self._device,
-    #         torch_dtype=torch.bfloat16,
-    #     )
-    #     self._model.eval()
-    #     self._kv_cache_lengths = kv_cache_lengths
-    #     self._use_static_kv_cache = use_static_kv_cache
-
-    #     self._tokenizer = AutoTokenizer.from_pretrained(model_path)
-    #     self._config = AutoConfig.from_pretrained(model_path)
-    #     self._max_new_tokens = max_new_tokens
-    #     self._collator = HiggsAudioSampleCollator(
-    #         whisper_processor=None,
-    #         audio_in_token_id=self._config.audio_in_token_idx,
-    #         audio_out_token_id=self._config.audio_out_token_idx,
-    #         audio_stream_bos_id=self._config.audio_stream_bos_id,
-    #         audio_stream_eos_id=self._config.audio_stream_eos_id,
-    #         encode_whisper_embed=self._config.encode_whisper_embed,
-    #         pad_token_id=self._config.pad_token_id,
-    #         return_audio_in_tokens=self._config.encode_audio_in_tokens,
-    #         use_delay_pattern=self._config.use_delay_pattern,
-    #         round_to=1,
-    #         audio_num_codebooks=self._config.audio_num_codebooks,
-    #     )
-    #     self.kv_caches = None
-    #     if use_static_kv_cache:
-    #         self._init_static_kv_cache()
-
-    # def _init_static_kv_cache(self):
-    #     cache_config = copy.deepcopy(self._model.config.text_config)
-    #     cache_config.num_hidden_layers = self._model.config.text_config.num_hidden_layers
-    #     if self._model.config.audio_dual_ffn_layers:
-    #         cache_config.num_hidden_layers += len(self._model.config.audio_dual_ffn_layers)
-    #     # A list of KV caches for different lengths
-    #     self.kv_caches = {
-    #         length: StaticCache(
-    #             config=cache_config,
-    #             max_batch_size=1,
-    #             max_cache_len=length,
-    #             device=self._model.device,
-    #             dtype=self._model.dtype,
-    #         )
-    #         for length in sorted(self._kv_cache_lengths)
-    #     }
-    #     # Capture CUDA graphs for each KV cache length
-    #     if "cuda" in self._device:
-    #         logger.info(f"Capturing CUDA graphs for each KV cache length")
-    #         self._model.capture_model(self.kv_caches.values())
+        # Use explicit device if provided, otherwise try CUDA/MPS/CPU
+        if device_id is not None:
+            device = f"cuda:{device_id}"
+            self._device = device
+        else:
+            if device is not None:
+                self._device = device
+            else:  # We get to choose the device
+                # Prefer CUDA over MPS (Apple Silicon GPU) over CPU if available
+                if torch.cuda.is_available():
+                    self._device = "cuda:0"
+                elif torch.backends.mps.is_available():
+                    self._device = "mps"
+                else:
+                    self._device = "cpu"
+
+        logger.info(f"Using device: {self._device}")
+        if isinstance(audio_tokenizer, str):
+            # For MPS, use CPU due to embedding operation limitations in quantization layers
+            audio_tokenizer_device = "cpu" if self._device == "mps" else self._device
+            self._audio_tokenizer = load_higgs_audio_tokenizer(audio_tokenizer, device=audio_tokenizer_device)
+        else:
+            self._audio_tokenizer = audio_tokenizer
+
+        self._model = HiggsAudioModel.from_pretrained(
+            model_path,
+            device_map=self._device,
+            torch_dtype=torch.bfloat16,
+        )
+        self._model.eval()
+        self._kv_cache_lengths = kv_cache_lengths
+        self._use_static_kv_cache = use_static_kv_cache
+
+        self._tokenizer = AutoTokenizer.from_pretrained(model_path)
+        self._config = AutoConfig.from_pretrained(model_path)
+        self._max_new_tokens = max_new_tokens
+        self._collator = HiggsAudioSampleCollator(
+            whisper_processor=None,
+            audio_in_token_id=self._config.audio_in_token_idx,
+            audio_out_token_id=self._config.audio_out_token_idx,
+            audio_stream_bos_id=self._config.audio_stream_bos_id,
+            audio_stream_eos_id=self._config.audio_stream_eos_id,
+            encode_whisper_embed=self._config.encode_whisper_embed,
+            pad_token_id=self._config.pad_token_id,
+            return_audio_in_tokens=self._config.encode_audio_in_tokens,
+            use_delay_pattern=self._config.use_delay_pattern,
+            round_to=1,
+            audio_num_codebooks=self._config.audio_num_codebooks,
+        )
+        self.kv_caches = None
+        if use_static_kv_cache:
+            self._init_static_kv_cache()
+
+    def _init_static_kv_cache(self):
+        cache_config = copy.deepcopy(self._model.config.text_config)
+        cache_config.num_hidden_layers = self._model.config.text_config.num_hidden_layers
+        if self._model.config.audio_dual_ffn_layers:
+            cache_config.num_hidden_layers += len(self._model.config.audio_dual_ffn_layers)
+        # A list of KV caches for different lengths
+        self.kv_caches = {
+            length: StaticCache(
+                config=cache_config,
+                max_batch_size=1,
+                max_cache_len=length,
+                device=self._model.device,
+                dtype=self._model.dtype,
+            )
+            for length in sorted(self._kv_cache_lengths)
+        }
+        # Capture CUDA graphs for each KV cache length
+        if "cuda" in self._device:
+            logger.info(f"Capturing CUDA graphs for each KV cache length")
+            self._model.capture_model(self.kv_caches.values())
 
     def _prepare_kv_caches(self):
         for kv_cache in self.kv_caches.values():
@@ -251,21 +178,25 @@ class HiggsAudioModelClient:
         audio_out_ids_l = []
         generated_audio_ids = []
         generation_messages = []
+        # Spans go to TRACE_FILE when it is set, see backend/tracing.py
+        trace = start_span("generate", chunks=len(chunked_text))
         for idx, chunk_text in tqdm.tqdm(
             enumerate(chunked_text), desc="Generating audio chunks", total=len(chunked_text)
         ):
+            chunk_span = start_span("chunk", parent=trace, index=idx)
             generation_messages.append(
                 Message(
                     role="user",
                     content=chunk_text,
                 )
             )
-            chatml_sample = ChatMLSample(messages=messages + generation_messages)
-            input_tokens, _, _, _ = prepare_chatml_sample(chatml_sample, self._tokenizer)
-            postfix = self._tokenizer.encode(
-                "<|start_header_id|>assistant<|end_header_id|>\n\n", add_special_tokens=False
-            )
-            input_tokens.extend(postfix)
+            with span("parse", parent=chunk_span):
+                chatml_sample = ChatMLSample(messages=messages + generation_messages)
+                input_tokens, _, _, _ = prepare_chatml_sample(chatml_sample, self._tokenizer)
+                postfix = self._tokenizer.encode(
+                    "<|start_header_id|>assistant<|end_header_id|>\n\n", add_special_tokens=False
+                )
+                input_tokens.extend(postfix)
 
             logger.info(f"========= Chunk {idx} Input =========")
             logger.info(self._tokenizer.decode(input_tokens))
@@ -298,21 +229,22 @@ class HiggsAudioModelClient:
                 self._prepare_kv_caches()
 
             # Generate audio
-            outputs = self._model.generate(
-                **batch,
-                max_new_tokens=self._max_new_tokens,
-                use_cache=True,
-                do_sample=True,
-                temperature=temperature,
-                top_k=top_k,
-                top_p=top_p,
-                past_key_values_buckets=self.kv_caches,
-                ras_win_len=ras_win_len,
-                ras_win_max_num_repeat=ras_win_max_num_repeat,
-                stop_strings=["<|end_of_text|>", "<|eot_id|>"],
-                tokenizer=self._tokenizer,
-                seed=seed,
-            )
+            with span("model_generate", parent=chunk_span):
+                outputs = self._model.generate(
+                    **batch,
+                    max_new_tokens=self._max_new_tokens,
+                    use_cache=True,
+                    do_sample=True,
+                    temperature=temperature,
+                    top_k=top_k,
+                    top_p=top_p,
+                    past_key_values_buckets=self.kv_caches,
+                    ras_win_len=ras_win_len,
+                    ras_win_max_num_repeat=ras_win_max_num_repeat,
+                    stop_strings=["<|end_of_text|>", "<|eot_id|>"],
+                    tokenizer=self._tokenizer,
+                    seed=seed,
+                )
 
             step_audio_out_ids_l = []
             for ele in outputs[1]:
@@ -323,6 +255,7 @@ class HiggsAudioModelClient:
             audio_out_ids = torch.concat(step_audio_out_ids_l, dim=1)
             audio_out_ids_l.append(audio_out_ids)
             generated_audio_ids.append(audio_out_ids)
+            chunk_span.end(prompt_tokens=len(input_tokens), completion_tokens=audio_out_ids.shape[1])
 
             generation_messages.append(
                 Message(
@@ -336,7 +269,8 @@ class HiggsAudioModelClient:
 
         logger.info(f"========= Final Text output =========")
         logger.info(self._tokenizer.decode(outputs[0][0]))
-        concat_audio_out_ids = torch.concat(audio_out_ids_l, dim=1)
+        with span("stitch", parent=trace):
+            concat_audio_out_ids = torch.concat(audio_out_ids_l, dim=1)
 
         # Fix MPS compatibility: detach and move to CPU before decoding
         if concat_audio_out_ids.device.type == "mps":
@@ -344,8 +278,10 @@ class HiggsAudioModelClient:
         else:
             concat_audio_out_ids_cpu = concat_audio_out_ids
 
-        concat_wv = self._audio_tokenizer.decode(concat_audio_out_ids_cpu.unsqueeze(0))[0, 0]
+        with span("decode", parent=trace):
+            concat_wv = self._audio_tokenizer.decode(concat_audio_out_ids_cpu.unsqueeze(0))[0, 0]
         text_result = self._tokenizer.decode(outputs[0][0])
+        trace.end()
         return concat_wv, sr, text_result
 
 
@@ -460,6 +396,7 @@ def prepare_generation_context(scene_prompt, ref_audio, ref_audio_in_system_mess
 
 
 @click.command()
+@profile_option
 @click.option(
     "--model_path",
     type=str,
@@ -537,8 +474,8 @@ def prepare_generation_context(scene_prompt, ref_audio, ref_audio_in_system_mess
 @click.option(
     "--chunk_method",
     default=None,
-    type=click.Choice([None, "speaker", "word"]),
-    help="The method to use for chunking the prompt text. Options are 'speaker', 'word', or None. By default, we won't use any chunking and will feed the whole text to the model.",
+    type=click.Choice([None, "speaker", "word", "budget"]),
+    help="The method to use for chunking the prompt text. Options are 'speaker', 'word', 'budget', or None. By default, we won't use any chunking and will feed the whole text to the model. 'budget' packs whole speaker turns into as few chunks as fit the completion token limit.",
 )
 @click.option(
     "--chunk_max_word_num",
@@ -664,28 +601,7 @@ def main(
 
     speaker_tags = sorted(set(pattern.findall(transcript)))
     # Other normalizations (e.g., parentheses and other symbols. Will be improved in the future)
-    transcript = transcript.replace("(", " ")
-    transcript = transcript.replace(")", " ")
-    transcript = transcript.replace("°F", " degrees Fahrenheit")
-    transcript = transcript.replace("°C", " degrees Celsius")
-
-    for tag, replacement in [
-        ("[laugh]", "<SE>[Laughter]</SE>"),
-        ("[humming start]", "<SE_s>[Humming]</SE_s>"),
-        ("[humming end]", "<SE_e>[Humming]</SE_e>"),
-        ("[music start]", "<SE_s>[Music]</SE_s>"),
-        ("[music end]", "<SE_e>[Music]</SE_e>"),
-        ("[music]", "<SE>[Music]</SE>"),
-        ("[sing start]", "<SE_s>[Singing]</SE_s>"),
-        ("[sing end]", "<SE_e>[Singing]</SE_e>"),
-        ("[applause]", "<SE>[Applause]</SE>"),
-        ("[cheering]", "<SE>[Cheering]</SE>"),
-        ("[cough]", "<SE>[Cough]</SE>"),
-    ]:
-        transcript = transcript.replace(tag, replacement)
-    lines = transcript.split("\n")
-    transcript = "\n".join([" ".join(line.split()) for line in lines if line.strip()])
-    transcript = transcript.strip()
+    transcript = normalize_transcript(transcript, speaker_id_tags=False)
 
     if not any([transcript.endswith(c) for c in [".", "!", "?", ",", ";", '"', "'", "</SE_e>", "</SE>"]]):
         transcript += "."
@@ -702,6 +618,7 @@ def main(
         chunk_method=chunk_method,
         chunk_max_word_num=chunk_max_word_num,
         chunk_max_num_turns=chunk_max_num_turns,
+        max_completion_tokens=max_new_tokens,
     )
 
 
@@ -99,7 +99,7 @@ def main():
 
 
     BOSON_API_KEY = os.getenv("BOSON_API_KEY")
-    client = OpenAI(api_key=BOSON_API_KEY, base_url="https://hackathon.boson.ai/v1")
+    client = OpenAI(api_key=BOSON_API_KEY, base_url=os.getenv("BOSON_BASE_URL", "https://hackathon.boson.ai/v1"))
 
     resp = client.chat.completions.create(
         model="higgs-audio-generation-Hackathon",
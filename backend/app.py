@@ -1,16 +1,31 @@
-from openai import OpenAI
-import base64
 import os
+import time
 import wave
 import click
 import re
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, g, request, jsonify, send_file, stream_with_context, url_for
 from flask_cors import CORS
-import tempfile
+
+from audio import stream_wav, wav_duration
+from audio_cache import render_cached
+from boson import BOSON_MODEL, get_client
+from coalesce import IdempotencyConflict, RenderRegistry, render_fingerprint
+from chunking import estimate_audio_tokens
+from fanout import render_chunks
+from jobs import DONE, JobQueue, QueueFull
+from metrics import (AUDIO_SECONDS, CONTENT_TYPE, REQUEST_BYTES, REQUEST_SECONDS, REQUESTS, REQUESTS_IN_FLIGHT,
+                     RESPONSE_BYTES, exposition)
+from pipeline import MAX_COMPLETION_TOKENS, RENDER_WORKERS, generation_request, prepare_scenes, scene_chunks
+from reference_audio import cast_references
+import profiling
+import tracing
 
 app = Flask(__name__)
 CORS(app)
 
+# Renders shared by identical and retried requests
+renders = RenderRegistry()
+
 BOSON_API_KEY = os.getenv("BOSON_API_KEY")
 
 AUDIO_PLACEHOLDER_TOKEN = "<|__AUDIO_PLACEHOLDER__|>"
@@ -19,76 +34,261 @@ MULTISPEAKER_DEFAULT_SYSTEM_MESSAGE = """You are an AI assistant designed to con
 If the user's message includes a [SPEAKER*] tag, do not read out the tag and generate speech for the following text, using the specified voice.
 If no speaker tag is present, select a suitable voice on your own."""
 
+def render_scene(client, scene_prompt, transcript, speaker_desc="", references=()):
+    """ Render one scene, or one chunk of it, with the Boson endpoint.
+    Args:
+        client (OpenAI): The shared Boson client, see boson.get_client.
+        scene_prompt (str): The scene description, or "" if the scene has none.
+        transcript (str): The normalized transcript of the scene.
+        speaker_desc (str): "SPEAKERn: description" lines, or "" to let the model pick voices.
+        references (list of dict): The cast's reference voices, see reference_audio.cast_references.
+
+    Returns:
+        audio_bytes (bytes): The scene as a WAV file.
+    """
+    # A chunk rendered before with the same voices and settings comes from the cache
+    audio_bytes = render_cached(client, generation_request(scene_prompt, transcript, speaker_desc, references))
+    AUDIO_SECONDS.inc(wav_duration(audio_bytes))
+    return audio_bytes
+
+def traced_render(client, chunks, speaker_desc, trace, profiler=None):
+    """ render_chunks over the chunks of one upload, traced as a "render" span under trace
+    with a "chunk" span per chunk, see tracing.py. The threads rendering the chunks are
+    sampled by profiler, if the request is being profiled.
+    """
+    render_span = tracing.start_span("render", parent=trace, chunks=len(chunks))
+
+    def render(item):
+        i, chunk = item
+        with tracing.span("chunk", parent=render_span, index=i, estimated_tokens=estimate_audio_tokens(chunk[1])) as s:
+            # Every chunk is dispatched when the render starts; the rest is waiting for a worker
+            s.set(queue_seconds=s.start - render_span.start)
+            return render_scene(client, *chunk, speaker_desc, references)
+
+    error = None
+    try:
+        # Every chunk gets the same reference voice per character, so voices do not drift
+        # between chunks rendered independently
+        with tracing.span("voices", parent=render_span):
+            references = cast_references(client, speaker_desc)
+        yield from render_chunks(
+            list(enumerate(chunks)),
+            profiling.follow(render, profiler),
+            max_workers=RENDER_WORKERS,
+            key=lambda item: estimate_audio_tokens(item[1][1]),
+            head_first=True,
+        )
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        render_span.end(error)
+
+def count_bytes(stream, endpoint, trace):
+    """ Pass a streamed response through, counting the bytes it sends. """
+    stitch = tracing.start_span("stitch", parent=trace)
+    sent, error = 0, None
+    try:
+        for data in stream:
+            RESPONSE_BYTES.inc(len(data), endpoint=endpoint)
+            sent += len(data)
+            yield data
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        stitch.end(error, bytes=sent)
+
+@app.before_request
+def start_request_metrics():
+    g.started_at = time.perf_counter()
+    g.endpoint = request.endpoint or "unknown"
+    REQUESTS_IN_FLIGHT.inc(endpoint=g.endpoint)
+    if request.content_length:
+        REQUEST_BYTES.observe(request.content_length, endpoint=g.endpoint)
+
+@app.after_request
+def count_response(response):
+    if "started_at" not in g:
+        return response
+    endpoint, started_at, trace, profiler = g.endpoint, g.started_at, g.get("trace"), g.get("profiler")
+    REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    if response.content_length is not None:
+        RESPONSE_BYTES.inc(response.content_length, endpoint=endpoint)
+    if trace is not None:
+        response.headers["X-Trace-Id"] = trace.trace_id
+    if profiler is not None:
+        response.headers["X-Profile-Id"] = profiler.id
+
+    def finish():
+        REQUESTS_IN_FLIGHT.dec(endpoint=endpoint)
+        REQUEST_SECONDS.observe(time.perf_counter() - started_at, endpoint=endpoint)
+        if trace is not None:
+            trace.end(status=response.status_code)
+        if profiler is not None:
+            profiling.save_profile(profiler.stop())
+
+    if response.direct_passthrough:
+        # send_file hands the file to the server, which never calls the close callbacks
+        finish()
+    else:
+        # Closed once the last byte is sent, so a streamed response counts until it ends
+        response.call_on_close(finish)
+    return response
+
+@app.route("/metrics")
+def metrics():
+    """ Stage timings, sizes and counts in the Prometheus text format, see metrics.py. """
+    return Response(exposition(), content_type=CONTENT_TYPE)
+
+@app.route("/traces")
+def traces():
+    """ Root spans of the latest traces, or with ?slowest=1 the slowest; ?limit=n. """
+    return jsonify(tracing.get_collector().traces(
+        limit=request.args.get("limit", 50, type=int),
+        slowest=request.args.get("slowest", "") not in ("", "0", "false"),
+    ))
+
+@app.route("/traces/<trace_id>")
+def trace_spans(trace_id):
+    """ Every span of one trace, e.g. from a response's X-Trace-Id header. """
+    spans = tracing.get_collector().trace(trace_id)
+    if not spans:
+        return jsonify({"error": "No such trace"}), 404
+    return jsonify(spans)
+
+@app.route("/profiles")
+def profiles():
+    """ Saved request profiles, newest first. Needs the X-Profile token, see profiling.py. """
+    if not profiling.authorized(request.headers):
+        return jsonify({"error": "Not found"}), 404
+    return jsonify([
+        {"profile_id": profile_id, "saved_at": saved_at, "url": url_for("profile", profile_id=profile_id)}
+        for profile_id, saved_at in profiling.saved_profiles()
+    ])
+
+@app.route("/profiles/<profile_id>")
+def profile(profile_id):
+    """ One saved profile as its call tree, or with ?format=folded as collapsed stacks. """
+    if not profiling.authorized(request.headers):
+        return jsonify({"error": "Not found"}), 404
+    folded = request.args.get("format") == "folded"
+    path = profiling.profile_path(profile_id, ".folded" if folded else ".json")
+    if path is None or not os.path.exists(path):
+        return jsonify({"error": "No such profile"}), 404
+    return send_file(path, mimetype="text/plain" if folded else "application/json")
+
 @app.route("/generate_audio", methods=["POST"])
 def main():
     if 'file' not in request.files:
         return jsonify({'error': 'No file uploaded'}), 400
     
     uploaded_file = request.files['file']
+    # Ended once the response is sent, see count_response
+    g.trace = trace = tracing.start_span("generate_audio", upload_bytes=request.content_length)
+    # Only with the X-Profile header and token; stopped and saved once the response is sent
+    g.profiler = profiler = profiling.start_for_request(request.headers, label="/generate_audio")
+
+    with tracing.span("parse", parent=trace) as parse:
+        scenes, speaker_desc = prepare_scenes(uploaded_file.stream, request.form)
+        if not scenes:
+            return jsonify({"error": "No text provided"}), 400
+
+        # Scenes are cut into chunks that fit one request each. Chunks do not depend on each
+        # other, so they are rendered concurrently and streamed out in script order: the
+        # browser starts playing the first chunk while the rest are still being generated.
+        chunks = scene_chunks(scenes)
+        parse.set(scenes=len(scenes), chunks=len(chunks))
+    client = get_client()
+
+    joined = True
+
+    def start_render():
+        nonlocal joined
+        joined = False
+        return traced_render(client, chunks, speaker_desc, trace, profiler)
+
+    # An identical upload that is still rendering is joined instead of rendered again, and
+    # a retry with the same Idempotency-Key from the same client reads the render it started
+    try:
+        render = renders.render(
+            render_fingerprint(chunks, speaker_desc, BOSON_MODEL, MAX_COMPLETION_TOKENS),
+            start_render,
+            request.headers.get("Idempotency-Key"),
+            request.remote_addr or "",
+        )
+    except IdempotencyConflict as e:
+        return jsonify({"error": str(e)}), 422
+    if joined:
+        # Its chunks are traced under the request that started it
+        trace.set(joined=True)
+
+    return Response(stream_with_context(count_bytes(stream_wav(render), g.endpoint, trace)), mimetype="audio/wav")
+
+def render_job(job, i):
+    """ Render chunk i of a background job, see jobs.JobQueue. """
+    scene_prompt, chunk = job.chunks[i]
+    # A job's chunks share a trace, named after the job
+    with tracing.span("chunk", trace_id=job.id, index=i, estimated_tokens=estimate_audio_tokens(chunk),
+                      queue_seconds=job.queue_seconds[i]):
+        client = get_client()
+        # Generated with the job's first chunk, then read from disk
+        references = cast_references(client, job.speaker_desc)
+        return render_scene(client, scene_prompt, chunk, job.speaker_desc, references)
+
+jobs = JobQueue(render_job)
+
+@app.before_request
+def start_jobs():
+    # Started on the first request rather than at import, so the debug reloader's
+    # watcher process never renders anything
+    jobs.start()
+
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    """ Queue an upload for rendering in the background; poll /jobs/<id> for progress. """
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file uploaded'}), 400
+
+    scenes, speaker_desc = prepare_scenes(request.files['file'].stream, request.form)
+    if not scenes:
+        return jsonify({"error": "No text provided"}), 400
+
+    # Workers are shared fairly between client addresses, see scheduler.py. A client could
+    # name itself anything in a header, so only the address counts.
+    try:
+        job = jobs.submit(scene_chunks(scenes), speaker_desc, request.remote_addr or "")
+    except QueueFull as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "30"}
+
+    return jsonify({
+        **job.progress(),
+        "status_url": url_for("job_status", job_id=job.id),
+        "audio_url": url_for("job_audio", job_id=job.id),
+    }), 202
+
+@app.route("/jobs/stats")
+def job_stats():
+    """ Queue wait and makespan of recent jobs, to see what the scheduler does. """
+    return jsonify({**jobs.scheduler.stats(), "queue_depth": jobs.depth, "workers": jobs.workers})
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "No such job"}), 404
+    return jsonify({**job.progress(), "queue_depth": jobs.depth})
 
-    transcript = uploaded_file.read().decode('utf-8')
-
-    if not transcript:
-        return jsonify({"error": "No text provided"}), 400   
-
-    transcript = transcript.replace("(", " ")
-    transcript = transcript.replace(")", " ")
-    transcript = transcript.replace("°F", " degrees Fahrenheit")
-    transcript = transcript.replace("°C", " degrees Celsius")
-
-    for tag, replacement in [
-        ("[laugh]", "<SE>[Laughter]</SE>"),
-        ("[humming start]", "<SE_s>[Humming]</SE_s>"),
-        ("[humming end]", "<SE_e>[Humming]</SE_e>"),
-        ("[music start]", "<SE_s>[Music]</SE_s>"),
-        ("[music end]", "<SE_e>[Music]</SE_e>"),
-        ("[music]", "<SE>[Music]</SE>"),
-        ("[sing start]", "<SE_s>[Singing]</SE_s>"),
-        ("[sing end]", "<SE_e>[Singing]</SE_e>"),
-        ("[applause]", "<SE>[Applause]</SE>"),
-        ("[cheering]", "<SE>[Cheering]</SE>"),
-        ("[cough]", "<SE>[Cough]</SE>"),
-    ]:
-        transcript = transcript.replace(tag, replacement)
-
-    transcript = transcript.replace("[", "<|speaker_id_start|>")
-    transcript = transcript.replace("]", "<|speaker_id_end|>")
-    lines = transcript.split("\n")
-
-    transcript = "\n".join([" ".join(line.split()) for line in lines if line.strip()])
-    transcript = transcript.strip()
-
-
-    BOSON_API_KEY = os.getenv("BOSON_API_KEY")
-    client = OpenAI(api_key=BOSON_API_KEY, base_url="https://hackathon.boson.ai/v1")
-
-    resp = client.chat.completions.create(
-        model="higgs-audio-generation-Hackathon",
-        messages=[
-            
-            {"role": "system", "content": "You are an AI assistant designed to convert text into speech. If the user's message includes a [SPEAKER*] tag, do not read out the tag and generate speech for the following text, using the specified voice. If no speaker tag is present, select a suitable voice on your own."},
-            {"role": "user", "content": transcript},
-            {"role": "system", "content": f"Generate realistic multi-speaker audio. "}
-        ],
-        modalities=["text", "audio"],
-        max_completion_tokens=4096,
-        temperature=1.0,
-        top_p=0.95,
-        stream=False,
-        stop=["<|eot_id|>", "<|end_of_text|>", "<|audio_eos|>"],
-        extra_body={"top_k": 50},
-    )
-
-    print(transcript)
-
-    audio_b64 = resp.choices[0].message.audio.data
-
-    audio_bytes = base64.b64decode(audio_b64)
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp:
-        tmp.write(audio_bytes)
-        tmp_path = tmp.name
-
-    return send_file(tmp_path, mimetype="audio/wav")
+@app.route("/jobs/<job_id>/audio")
+def job_audio(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "No such job"}), 404
+    if job.status != DONE:
+        return jsonify(job.progress()), 409
+    return send_file(jobs.result_path(job), mimetype="audio/wav")
 
 if __name__ == "__main__":
+    # Open the connection pool before the first upload arrives
+    get_client()
     app.run(host="0.0.0.0", port=5000, debug=True)
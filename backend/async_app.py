@@ -0,0 +1,136 @@
+import asyncio
+
+from quart import Quart, Response, jsonify, request
+from quart_cors import cors
+
+from audio import streaming_wav_header, wav_duration, wav_frames
+from audio_cache import render_cached_async
+from boson import get_async_client, get_client
+from chunking import estimate_audio_tokens
+from fanout import iter_chunks_async
+from metrics import AUDIO_SECONDS, CONTENT_TYPE, exposition
+from pipeline import RENDER_WORKERS, generation_request, prepare_scenes, scene_chunks
+from reference_audio import cast_references
+import tracing
+
+# ASGI version of app.py. A generation waits on the Boson endpoint for tens of seconds;
+# here that wait is an await instead of a blocked worker thread, so one process can hold
+# many generations in flight and still answer /health straight away. Serve it with
+#
+#     hypercorn async_app:app --bind 0.0.0.0:5000
+
+app = cors(Quart(__name__))
+
+
+async def render_scene(client, scene_prompt, transcript, speaker_desc="", references=()):
+    """ Render one scene, or one chunk of it, with the Boson endpoint.
+    Args:
+        client (AsyncOpenAI): The shared async Boson client, see boson.get_async_client.
+        scene_prompt (str): The scene description, or "" if the scene has none.
+        transcript (str): The normalized transcript of the scene.
+        speaker_desc (str): "SPEAKERn: description" lines, or "" to let the model pick voices.
+        references (list of dict): The cast's reference voices, see reference_audio.cast_references.
+
+    Returns:
+        audio_bytes (bytes): The scene as a WAV file.
+    """
+    # Same cache as app.py
+    audio_bytes = await render_cached_async(client, generation_request(scene_prompt, transcript, speaker_desc, references))
+    AUDIO_SECONDS.inc(wav_duration(audio_bytes))
+    return audio_bytes
+
+
+@app.route("/health")
+async def health():
+    return jsonify({"status": "ok"})
+
+
+@app.route("/metrics")
+async def metrics():
+    return Response(exposition(), content_type=CONTENT_TYPE)
+
+
+@app.route("/traces")
+async def traces():
+    """ See app.py. """
+    return jsonify(tracing.get_collector().traces(
+        limit=request.args.get("limit", 50, type=int),
+        slowest=request.args.get("slowest", "") not in ("", "0", "false"),
+    ))
+
+
+@app.route("/traces/<trace_id>")
+async def trace_spans(trace_id):
+    spans = tracing.get_collector().trace(trace_id)
+    if not spans:
+        return jsonify({"error": "No such trace"}), 404
+    return jsonify(spans)
+
+
+@app.route("/generate_audio", methods=["POST"])
+async def generate_audio():
+    files = await request.files
+    if "file" not in files:
+        return jsonify({"error": "No file uploaded"}), 400
+    form = await request.form
+    trace = tracing.start_span("generate_audio", upload_bytes=request.content_length)
+
+    # Normalizing and parsing is CPU work; keep it off the event loop
+    with tracing.span("parse", parent=trace) as parse:
+        scenes, speaker_desc = await asyncio.to_thread(prepare_scenes, files["file"].stream, form)
+        if not scenes:
+            trace.end(status=400)
+            return jsonify({"error": "No text provided"}), 400
+
+        chunks = await asyncio.to_thread(scene_chunks, scenes)
+        parse.set(scenes=len(scenes), chunks=len(chunks))
+    client = get_async_client()
+
+    async def stream():
+        # Traced like app.py: a render span with a span per chunk, and the stitching
+        render_span = tracing.start_span("render", parent=trace, chunks=len(chunks))
+        stitch = tracing.start_span("stitch", parent=trace)
+
+        async def render(item):
+            i, chunk = item
+            with tracing.span("chunk", parent=render_span, index=i, estimated_tokens=estimate_audio_tokens(chunk[1])) as s:
+                s.set(queue_seconds=s.start - render_span.start)
+                return await render_scene(client, *chunk, speaker_desc, references)
+
+        # Stream the chunks in script order as they finish, see app.py
+        chunk_audio = iter_chunks_async(
+            list(enumerate(chunks)),
+            render,
+            max_concurrency=RENDER_WORKERS,
+            key=lambda item: estimate_audio_tokens(item[1][1]),
+            head_first=True,
+        )
+        header_sent = False
+        sent, error = 0, None
+        try:
+            # One reference voice per character for every chunk, see app.py. The clips are
+            # generated with the blocking client, off the event loop.
+            with tracing.span("voices", parent=render_span):
+                references = await asyncio.to_thread(cast_references, get_client(), speaker_desc)
+            async for audio_bytes in chunk_audio:
+                params, frames = wav_frames(audio_bytes)
+                if not header_sent:
+                    header = streaming_wav_header(params.nchannels, params.sampwidth, params.framerate)
+                    sent += len(header)
+                    yield header
+                    header_sent = True
+                sent += len(frames)
+                yield frames
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            render_span.end(error)
+            stitch.end(error, bytes=sent)
+            trace.end(error, status=200)
+
+    return Response(stream(), mimetype="audio/wav", headers={"X-Trace-Id": trace.trace_id})
+
+
+if __name__ == "__main__":
+    app.run(host="0.0.0.0", port=5000)
@@ -0,0 +1,75 @@
+import io
+import struct
+import wave
+
+# RIFF and data sizes written in a streamed WAV header, where the length is not known yet.
+# Players read until the stream ends.
+STREAMING_DATA_SIZE = 0xFFFFFFFF - 36
+
+
+def concat_wav(wav_blobs):
+    """ Join WAV files end to end.
+    Args:
+        wav_blobs (iterable of bytes): Complete WAV files sharing one sample format.
+
+    Returns:
+        wav (bytes): One WAV file holding all the frames, in order.
+    """
+    out = io.BytesIO()
+    writer = None
+    for blob in wav_blobs:
+        with wave.open(io.BytesIO(blob), "rb") as reader:
+            if writer is None:
+                writer = wave.open(out, "wb")
+                writer.setparams(reader.getparams())
+            writer.writeframes(reader.readframes(reader.getnframes()))
+    if writer is None:
+        return b""
+    writer.close()
+    return out.getvalue()
+
+
+def wav_frames(blob):
+    """ Split a WAV file into its format and its raw frames.
+    Returns:
+        params (wave._wave_params): Channels, sample width, frame rate, ...
+        frames (bytes): The PCM frames.
+    """
+    with wave.open(io.BytesIO(blob), "rb") as reader:
+        return reader.getparams(), reader.readframes(reader.getnframes())
+
+
+def wav_duration(blob):
+    """ Seconds of audio in a WAV file. """
+    with wave.open(io.BytesIO(blob), "rb") as reader:
+        return reader.getnframes() / reader.getframerate()
+
+
+def streaming_wav_header(nchannels, sampwidth, framerate):
+    """ A 44-byte PCM WAV header for a stream whose length is not known up front. """
+    block_align = nchannels * sampwidth
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", STREAMING_DATA_SIZE + 36, b"WAVE",
+        b"fmt ", 16, 1, nchannels, framerate, framerate * block_align, block_align, sampwidth * 8,
+        b"data", STREAMING_DATA_SIZE,
+    )
+
+
+def stream_wav(wav_blobs):
+    """ Turn WAV files arriving one by one into one streamed WAV.
+    The header goes out with the first file, followed by every file's frames as it
+    arrives, so a player can start before the last file exists.
+    Args:
+        wav_blobs (iterable of bytes): Complete WAV files sharing one sample format.
+
+    Yields:
+        bytes: The header, then the frames of each file.
+    """
+    header_sent = False
+    for blob in wav_blobs:
+        params, frames = wav_frames(blob)
+        if not header_sent:
+            yield streaming_wav_header(params.nchannels, params.sampwidth, params.framerate)
+            header_sent = True
+        yield frames
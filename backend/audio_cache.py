@@ -0,0 +1,198 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from dispatch import get_dispatcher
+from metrics import CACHE_LOOKUPS, MODEL_AUDIO_BYTES, STAGE_SECONDS
+from pipeline import response_audio, response_tokens
+from tracing import annotate, span
+
+# Rendered audio on disk, keyed by a hash of everything that decides what the model is
+# asked for: the messages (chunk text, scene prompt, speaker descriptions, reference
+# audio), the model and the sampling settings. Rendering the same script with the same
+# voices and settings again is then a file read instead of a generation.
+
+AUDIO_CACHE_DIR = os.getenv("AUDIO_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".audio_cache"))
+AUDIO_CACHE_MAX_BYTES = int(os.getenv("AUDIO_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+
+# The parts of a chat.completions.create request that change the audio it returns
+_KEYED_FIELDS = ("model", "messages", "modalities", "max_completion_tokens", "temperature", "top_p", "stop", "seed")
+_KEYED_EXTRA_FIELDS = ("top_k", "seed")
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def request_key(request):
+    """ Hash of a generation request.
+    Args:
+        request (dictionary): Keyword arguments of chat.completions.create, such as
+            pipeline.generation_request returns.
+
+    Returns:
+        key (str): A hex digest; equal requests get equal keys.
+    """
+    extra_body = request.get("extra_body") or {}
+    keyed = {
+        **{field: request.get(field) for field in _KEYED_FIELDS},
+        "extra_body": {field: extra_body.get(field) for field in _KEYED_EXTRA_FIELDS},
+    }
+    canonical = json.dumps(keyed, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=20).hexdigest()
+
+
+class AudioCache:
+    """ WAV files on disk, dropped least recently used first once they pass a byte budget.
+    Safe to share between threads. Several processes may share a directory; each one
+    only enforces the budget on the files it knows about.
+    """
+
+    def __init__(self, directory=AUDIO_CACHE_DIR, max_bytes=AUDIO_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._sizes = OrderedDict()
+        self._total = 0
+        os.makedirs(directory, exist_ok=True)
+
+        # Pick up what earlier runs left, oldest use first
+        entries = []
+        for name in os.listdir(directory):
+            if name.endswith(".wav"):
+                stat = os.stat(os.path.join(directory, name))
+                entries.append((stat.st_mtime, name[:-len(".wav")], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._sizes[key] = size
+            self._total += size
+        with self._lock:
+            self._evict()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.wav")
+
+    def get(self, key):
+        """ The cached audio for key, or None. """
+        try:
+            with open(self._path(key), "rb") as f:
+                audio_bytes = f.read()
+            # The modification time doubles as the last use, so the order survives restarts
+            os.utime(self._path(key))
+        except FileNotFoundError:
+            with self._lock:
+                self._forget(key)
+            return None
+        with self._lock:
+            if key not in self._sizes:
+                self._sizes[key] = len(audio_bytes)
+                self._total += len(audio_bytes)
+            self._sizes.move_to_end(key)
+            self._evict()
+        return audio_bytes
+
+    def put(self, key, audio_bytes):
+        """ Store audio under key, then evict down to the byte budget. """
+        if len(audio_bytes) > self.max_bytes:
+            return
+        # Write then rename, so no reader ever sees half a file
+        tmp_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(audio_bytes)
+        os.replace(tmp_path, self._path(key))
+        with self._lock:
+            self._forget(key)
+            self._sizes[key] = len(audio_bytes)
+            self._total += len(audio_bytes)
+            self._evict()
+
+    def _forget(self, key):
+        self._total -= self._sizes.pop(key, 0)
+
+    def _evict(self):
+        while self._total > self.max_bytes and self._sizes:
+            key, size = self._sizes.popitem(last=False)
+            self._total -= size
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    @property
+    def total_bytes(self):
+        return self._total
+
+    def __len__(self):
+        return len(self._sizes)
+
+
+def get_audio_cache():
+    """ The process-wide audio cache, created on first use. """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = AudioCache()
+    return _cache
+
+
+def _read_cached(cache, key):
+    with STAGE_SECONDS.time(stage="cache_read"):
+        audio_bytes = cache.get(key)
+    CACHE_LOOKUPS.inc(result="miss" if audio_bytes is None else "hit")
+    annotate(cache="miss" if audio_bytes is None else "hit")
+    return audio_bytes
+
+
+def _store_response(cache, key, response):
+    annotate(**response_tokens(response))
+    with STAGE_SECONDS.time(stage="base64_decode"), span("decode"):
+        audio_bytes = response_audio(response)
+    MODEL_AUDIO_BYTES.inc(len(audio_bytes))
+    with STAGE_SECONDS.time(stage="cache_write"):
+        cache.put(key, audio_bytes)
+    return audio_bytes
+
+
+def render_cached(client, request, cache=None):
+    """ The audio for a generation request, from the cache if it was rendered before.
+    Args:
+        client (OpenAI): The Boson client, see boson.get_client.
+        request (dictionary): Keyword arguments of chat.completions.create.
+        cache (AudioCache): Defaults to the process-wide cache.
+
+    Returns:
+        audio_bytes (bytes): The WAV file.
+    """
+    if cache is None:
+        cache = get_audio_cache()
+    key = request_key(request)
+    audio_bytes = _read_cached(cache, key)
+    if audio_bytes is None:
+        with STAGE_SECONDS.time(stage="model_call"):
+            response = get_dispatcher().call(client.chat.completions.create, **request)
+        audio_bytes = _store_response(cache, key, response)
+    return audio_bytes
+
+
+async def render_cached_async(client, request, cache=None):
+    """ Like render_cached, for the async client. The cache's file I/O and the decoding
+    run on a thread, off the event loop.
+    Args:
+        client (AsyncOpenAI): The async Boson client, see boson.get_async_client.
+        request (dictionary): Keyword arguments of chat.completions.create.
+        cache (AudioCache): Defaults to the process-wide cache.
+
+    Returns:
+        audio_bytes (bytes): The WAV file.
+    """
+    if cache is None:
+        cache = get_audio_cache()
+    key = request_key(request)
+    audio_bytes = await asyncio.to_thread(_read_cached, cache, key)
+    if audio_bytes is None:
+        with STAGE_SECONDS.time(stage="model_call"):
+            response = await get_dispatcher().call_async(client.chat.completions.create, **request)
+        audio_bytes = await asyncio.to_thread(_store_response, cache, key, response)
+    return audio_bytes
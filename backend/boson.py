@@ -0,0 +1,87 @@
+import importlib.util
+import os
+import threading
+
+import httpx
+from openai import AsyncOpenAI, OpenAI
+
+BOSON_BASE_URL = os.getenv("BOSON_BASE_URL", "https://hackathon.boson.ai/v1")
+BOSON_MODEL = "higgs-audio-generation-Hackathon"
+
+# One keep-alive pool for the whole process. A generation can take tens of seconds, so
+# the read timeout is long while connecting is expected to be quick.
+BOSON_MAX_CONNECTIONS = int(os.getenv("BOSON_MAX_CONNECTIONS", "32"))
+BOSON_KEEPALIVE_EXPIRY = 120.0
+BOSON_CONNECT_TIMEOUT = 10.0
+BOSON_READ_TIMEOUT = 300.0
+
+_client = None
+_async_client = None
+_client_lock = threading.Lock()
+
+
+def http2_available():
+    """ httpx only speaks HTTP/2 when the optional h2 package is installed. """
+    return importlib.util.find_spec("h2") is not None
+
+
+def _pool_settings(max_connections):
+    return dict(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=BOSON_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(BOSON_READ_TIMEOUT, connect=BOSON_CONNECT_TIMEOUT),
+        http2=http2_available(),
+    )
+
+
+def create_client(api_key=None, base_url=None, max_connections=BOSON_MAX_CONNECTIONS):
+    """ Build a Boson client with its own connection pool.
+    Args:
+        api_key (str): Defaults to the BOSON_API_KEY environment variable.
+        base_url (str): Defaults to BOSON_BASE_URL.
+        max_connections (int): Size of the keep-alive connection pool.
+    """
+    return OpenAI(
+        api_key=api_key or os.getenv("BOSON_API_KEY"),
+        base_url=base_url or BOSON_BASE_URL,
+        http_client=httpx.Client(**_pool_settings(max_connections)),
+        # Retries are up to dispatch.Dispatcher, which also backs off the other requests
+        max_retries=0,
+    )
+
+
+def create_async_client(api_key=None, base_url=None, max_connections=BOSON_MAX_CONNECTIONS):
+    """ Like create_client, for AsyncOpenAI. """
+    return AsyncOpenAI(
+        api_key=api_key or os.getenv("BOSON_API_KEY"),
+        base_url=base_url or BOSON_BASE_URL,
+        http_client=httpx.AsyncClient(**_pool_settings(max_connections)),
+        max_retries=0,
+    )
+
+
+def get_client():
+    """ The process-wide Boson client, created on first use.
+    OpenAI clients are safe to share between threads, so every request and every worker
+    thread reuses the same pooled connections instead of paying for a new TLS handshake.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = create_client()
+    return _client
+
+
+def get_async_client():
+    """ The process-wide AsyncOpenAI client, created on first use.
+    Only use it from the server's event loop: the connections of an httpx.AsyncClient
+    belong to the loop that opened them.
+    """
+    global _async_client
+    if _async_client is None:
+        _async_client = create_async_client()
+    return _async_client
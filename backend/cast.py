@@ -0,0 +1,169 @@
+import re
+from typing import NamedTuple
+
+from normalizer import SPEAKER_ID_END, SPEAKER_ID_START
+from script_parser import SETTING_HEADER
+
+# Up to four capitalized words, e.g. "Macbeth", "Lady Macbeth", "FIRST WITCH", "Actor 1"
+_NAME = r"[A-Z][\w'\-]*(?: [A-Z0-9][\w'\-]*){0,3}"
+
+# A name alone on its line; ALL-CAPS cues may end in a period, e.g. "MACBETH."
+_STANDALONE_CUE = re.compile(rf"(?P<name>{_NAME})(?P<dot>\.?)")
+# A name in front of the speech, e.g. "Macbeth: Is this a dagger"
+_PREFIX_CUE = re.compile(rf"(?P<name>{_NAME}):\s*(?P<speech>.*)")
+
+# First words of headings and stage directions that look like cues, e.g. "Scene 2",
+# "Note: ..." or "Enter Macbeth"
+_HEADING_WORDS = frozenset((
+    "act", "scene", "note", "notes", "enter", "enters", "exit", "exits", "exeunt", "setting",
+    "prologue", "epilogue", "chapter", "part", "title", "author", "cast", "characters",
+    "dramatis", "curtain", "end", "fade", "cut", "int", "ext", "page",
+))
+
+
+class CastMember(NamedTuple):
+    """ A character found by discover_cast.
+    Args:
+        name (str): The name as first spelled in the script.
+        headers (tuple of str): Every spelling the name was cued with, e.g. ("Macbeth", "MACBETH.").
+        cues (int): How many times the character was cued.
+        lines (int): How many lines of speech followed those cues.
+        first_line (int): Index of the line the character was first cued on.
+    """
+    name: str
+    headers: tuple
+    cues: int
+    lines: int
+    first_line: int
+
+
+def _name_key(name):
+    return " ".join(name.split()).casefold()
+
+
+def _script_lines(script):
+    # A str is split here; lines from normalizer.normalize_lines are used as they are
+    return script.split("\n") if isinstance(script, str) else script
+
+
+def parse_cue(line):
+    """ Recognize a character cue.
+    Args:
+        line (str): One line of the script, already stripped.
+
+    Returns:
+        (name, speech) if the line is a cue, else None. speech is None for a name alone on its line.
+    """
+    # Only lines opening with a capital can be cues; skip the regexes for everything else
+    if not line or not ("A" <= line[0] <= "Z") or line.startswith(SETTING_HEADER):
+        return None
+    match = _STANDALONE_CUE.fullmatch(line)
+    if match and (not match.group("dot") or match.group("name").isupper()):
+        name, speech = match.group("name"), None
+    else:
+        match = _PREFIX_CUE.match(line)
+        if not match:
+            return None
+        name, speech = match.group("name"), match.group("speech")
+    if name.split(" ", 1)[0].casefold() in _HEADING_WORDS:
+        return None
+    return name, speech
+
+
+def discover_cast(script, min_lines=1, min_prefix_cues=2):
+    """ Find the characters of a script in one pass over its lines.
+
+    Three kinds of cue are understood, and may be mixed: a name alone on its line
+    ("Lady Macbeth"), an ALL-CAPS cue ("MACBETH."), and a name in front of the speech
+    ("Macbeth: Is this a dagger"). Spellings differing only in case and a trailing
+    period are the same character. Speech runs from a cue to the next cue or blank line.
+    Lines already carrying a speaker tag are left alone, and headings such as "Scene 2"
+    or "Note: ..." are not cues.
+
+    Args:
+        script (str or iterable of str): The script text, or its lines without newlines.
+        min_lines (int): Characters with fewer lines of speech are dropped as false cues.
+        min_prefix_cues (int): A name only ever seen in front of speech ("Name: text")
+            must be cued this often, unless it is ALL-CAPS; any capitalized line with a
+            colon looks like a cue once.
+
+    Returns:
+        cast (list of CastMember): The characters in order of first appearance.
+    """
+    found = {}  # name key -> [name, headers, cues, lines, first_line, prefix_only]
+    current = None
+    for index, line in enumerate(_script_lines(script)):
+        line = line.strip()
+        if not line or line.startswith(SETTING_HEADER) or line.startswith(("[", SPEAKER_ID_START)):
+            current = None
+            continue
+        cue = parse_cue(line)
+        if cue is None:
+            if current is not None:
+                current[3] += 1
+            continue
+        name, speech = cue
+        key = _name_key(name)
+        current = found.get(key)
+        if current is None:
+            current = found[key] = [name, {}, 0, 0, index, True]
+        current[1][line if speech is None else name] = None
+        current[2] += 1
+        if speech is None:
+            current[5] = False
+        elif speech:
+            current[3] += 1
+
+    return [
+        CastMember(name, tuple(headers), cues, lines, first_line)
+        for name, headers, cues, lines, first_line, prefix_only in found.values()
+        if lines >= min_lines and (not prefix_only or cues >= min_prefix_cues or name.isupper())
+    ]
+
+
+def assign_speakers(cast):
+    """ Give each character a speaker tag, SPEAKER1 first, in cast order.
+    Args:
+        cast (list of CastMember): As returned by discover_cast.
+
+    Returns:
+        actor_speaker (dictionary): Maps every header spelling of every character to its
+            speaker tag, ready to pass to ScriptIndex or tag_cues.
+    """
+    actor_speaker = {}
+    for number, member in enumerate(cast, start=1):
+        for header in member.headers:
+            actor_speaker[header] = f"SPEAKER{number}"
+    return actor_speaker
+
+
+def tag_cues(script, actor_speaker, speaker_id_tags=True):
+    """ Replace the character cues of a script with speaker tags, in one pass.
+    A name alone on its line becomes a tag alone on its line, and "Name: speech" becomes
+    the tag followed by the speech. Lines that are not cues of a known character are kept.
+
+    Args:
+        script (str or iterable of str): The script text, or its lines without newlines.
+        actor_speaker (dictionary): Maps cue spellings to speaker tags, see assign_speakers.
+        speaker_id_tags (bool): Write tags as <|speaker_id_start|>SPEAKERn<|speaker_id_end|>,
+            as normalize_transcript does, instead of [SPEAKERn].
+
+    Returns:
+        script (str): The tagged script.
+    """
+    opening, closing = (SPEAKER_ID_START, SPEAKER_ID_END) if speaker_id_tags else ("[", "]")
+    # Resolve spellings through their name key so every cue lookup is one dict hit
+    speaker_by_key = {}
+    for header, speaker in actor_speaker.items():
+        cue = parse_cue(header.strip())
+        speaker_by_key[_name_key(cue[0] if cue else header)] = speaker
+
+    def tagged(line):
+        cue = parse_cue(line.strip())
+        speaker = cue and speaker_by_key.get(_name_key(cue[0]))
+        if speaker is None:
+            return line
+        tag = f"{opening}{speaker}{closing}"
+        return f"{tag} {cue[1]}" if cue[1] else tag
+
+    return "\n".join(map(tagged, _script_lines(script)))
@@ -0,0 +1,186 @@
+import hashlib
+import math
+import re
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from script_parser import SPEAKER_TAG_PATTERN, ScriptIndex
+
+# The Higgs audio tokenizer emits 25 tokens per second of audio, and the model speaks
+# roughly 2.5 words per second. Each request also spends a few tokens on start/stop
+# markers and the pause between turns.
+AUDIO_TOKENS_PER_SECOND = 25
+WORDS_PER_SECOND = 2.5
+TURN_OVERHEAD_TOKENS = 16
+
+
+# CJK ideographs; a paragraph without any cannot be Chinese
+_CJK_CHARACTER = re.compile("[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]")
+
+LANGUAGE_CACHE_SIZE = 4096
+_languages = OrderedDict()
+_languages_lock = threading.Lock()
+
+
+def detect_language(paragraph):
+    """ langid's language code for a paragraph, cached by a hash of its content.
+    langid (and numpy with it) is only imported the first time a paragraph is classified.
+    """
+    key = hashlib.blake2b(paragraph.encode("utf-8"), digest_size=16).digest()
+    with _languages_lock:
+        language = _languages.get(key)
+        if language is not None:
+            _languages.move_to_end(key)
+            return language
+
+    # Classified outside the lock; two threads may classify the same paragraph once each
+    import langid
+
+    language = langid.classify(paragraph)[0]
+    with _languages_lock:
+        _languages[key] = language
+        _languages.move_to_end(key)
+        while len(_languages) > LANGUAGE_CACHE_SIZE:
+            _languages.popitem(last=False)
+    return language
+
+
+def _cut_chinese(paragraph):
+    # jieba builds its dictionary on the first cut; importing it here keeps that off startup
+    import jieba
+
+    return list(jieba.cut(paragraph, cut_all=False))
+
+
+def estimate_audio_tokens(text):
+    """ Rough number of completion tokens the model needs to speak text. """
+    return TURN_OVERHEAD_TOKENS + math.ceil(len(text.split()) * AUDIO_TOKENS_PER_SECOND / WORDS_PER_SECOND)
+
+
+def _words_for(tokens):
+    return int((tokens - TURN_OVERHEAD_TOKENS) * WORDS_PER_SECOND / AUDIO_TOKENS_PER_SECOND)
+
+
+def pack_turns(turns, token_budget):
+    """ Pack whole turns, in order, into as few chunks as fit the token budget.
+    Filling each chunk before opening the next is optimal when the order has to be kept.
+    A turn too long for one request is cut between words, repeating its speaker tag, and
+    its first piece fills whatever room the current chunk has left.
+    Args:
+        turns (list of str): Speaker turns, as from ScriptIndex.speaker_chunks.
+        token_budget (int): Completion tokens one request may use.
+
+    Returns:
+        chunks (list of str): The packed chunks, turns joined by "\n".
+    """
+    chunks = []
+    current, current_tokens = [], 0
+
+    def flush():
+        nonlocal current, current_tokens
+        if current:
+            chunks.append("\n".join(current))
+        current, current_tokens = [], 0
+
+    for turn in turns:
+        tokens = estimate_audio_tokens(turn)
+        if current_tokens + tokens > token_budget and tokens <= token_budget:
+            flush()
+        if tokens <= token_budget:
+            current.append(turn)
+            current_tokens += tokens
+            continue
+
+        match = SPEAKER_TAG_PATTERN.match(turn)
+        tag = turn[:match.end()].strip() + " " if match else ""
+        words = turn[match.end() if match else 0:].split()
+        # The tag is counted as a word by estimate_audio_tokens
+        tag_words = 1 if tag else 0
+        while words:
+            max_words = _words_for(token_budget - current_tokens) - tag_words
+            if max_words < 1:
+                flush()
+                max_words = max(1, _words_for(token_budget) - tag_words)
+            piece = tag + " ".join(words[:max_words])
+            words = words[max_words:]
+            current.append(piece)
+            current_tokens += estimate_audio_tokens(piece)
+            if words:
+                flush()
+    flush()
+    return chunks
+
+
+def prepare_chunk_text(
+    text,
+    chunk_method: Optional[str] = None,
+    chunk_max_word_num: int = 100,
+    chunk_max_num_turns: int = 1,
+    max_completion_tokens: int = 4096,
+    budget_fill: float = 0.9,
+):
+    """Chunk the text into smaller pieces. We will later feed the chunks one by one to the model.
+
+    Parameters
+    ----------
+    text : str
+        The text to be chunked.
+    chunk_method : str, optional
+        The method to use for chunking. Options are "speaker", "word", "budget", or None. By default, we won't use any
+        chunking and will feed the whole text to the model. "budget" packs whole speaker turns into as few chunks as
+        fit in max_completion_tokens.
+    replace_speaker_tag_with_special_tags : bool, optional
+        Whether to replace speaker tags with special tokens, by default False
+        If the flag is set to True, we will replace [SPEAKER0] with <|speaker_id_start|>SPEAKER0<|speaker_id_end|>
+    chunk_max_word_num : int, optional
+        The maximum number of words for each chunk when "word" chunking method is used, by default 100
+    chunk_max_num_turns : int, optional
+        The maximum number of turns for each chunk when "speaker" chunking method is used,
+    max_completion_tokens : int, optional
+        The completion token limit of each request when "budget" chunking method is used, by default 4096
+    budget_fill : float, optional
+        The share of max_completion_tokens a chunk is packed up to, leaving room for estimation error, by default 0.9
+
+    Returns
+    -------
+    List[str]
+        The list of text chunks.
+
+    """
+    if chunk_method is None:
+        return [text]
+    elif chunk_method == "speaker":
+        speaker_chunks = ScriptIndex(text).speaker_chunks()
+        if chunk_max_num_turns > 1:
+            merged_chunks = []
+            for i in range(0, len(speaker_chunks), chunk_max_num_turns):
+                merged_chunk = "\n".join(speaker_chunks[i : i + chunk_max_num_turns])
+                merged_chunks.append(merged_chunk)
+            return merged_chunks
+        return speaker_chunks
+    elif chunk_method == "budget":
+        return pack_turns(ScriptIndex(text).speaker_chunks(), int(max_completion_tokens * budget_fill))
+    elif chunk_method == "word":
+        # TODO: We may improve the logic in the future
+        # For long-form generation, we will first divide the text into multiple paragraphs by splitting with "\n\n"
+        # After that, we will chunk each paragraph based on word count
+        paragraphs = text.split("\n\n")
+        chunks = []
+        for idx, paragraph in enumerate(paragraphs):
+            # The language is detected per paragraph, and only when it could be Chinese
+            if _CJK_CHARACTER.search(paragraph) and detect_language(paragraph) == "zh":
+                # For Chinese, we will chunk based on character count
+                words = _cut_chinese(paragraph)
+                for i in range(0, len(words), chunk_max_word_num):
+                    chunk = "".join(words[i : i + chunk_max_word_num])
+                    chunks.append(chunk)
+            else:
+                words = paragraph.split(" ")
+                for i in range(0, len(words), chunk_max_word_num):
+                    chunk = " ".join(words[i : i + chunk_max_word_num])
+                    chunks.append(chunk)
+            chunks[-1] += "\n\n"
+        return chunks
+    else:
+        raise ValueError(f"Unknown chunk method: {chunk_method}")
@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# A double click, or a browser retrying a POST, asks for a script that is already being
+# rendered. Requests with the same fingerprint read the one render in flight, and a
+# request that repeats an idempotency key reads the render that key started, finished or
+# not, instead of paying for another generation. Keys belong to one client, and a key
+# reused for a different upload is refused instead of answered with the old audio.
+
+# How long, and how many, finished renders are kept for retries with the same key
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "600"))
+IDEMPOTENCY_MAX_RESULTS = int(os.getenv("IDEMPOTENCY_MAX_RESULTS", "16"))
+
+
+class IdempotencyConflict(Exception):
+    """ An idempotency key was reused for a request that renders something else. """
+
+
+def render_fingerprint(chunks, speaker_desc, *settings):
+    """ Hash of what a render will produce.
+    Args:
+        chunks (list of (str, str)): (scene_prompt, chunk) pairs, see pipeline.scene_chunks.
+        speaker_desc (str): "SPEAKERn: description" lines.
+        *settings: Anything else the audio depends on, e.g. the model name.
+
+    Returns:
+        fingerprint (str): A hex digest; two uploads that render the same get the same one.
+    """
+    canonical = json.dumps([chunks, speaker_desc, settings], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=20).hexdigest()
+
+
+class SharedRender:
+    """ The results of one render, readable by any number of requests while it runs.
+    The render runs on its own thread, so it carries on when the request that started
+    it goes away.
+    """
+
+    def __init__(self, results, fingerprint=None):
+        self._results = results
+        self.fingerprint = fingerprint
+        self._parts = []
+        self._error = None
+        self.done = False
+        self.finished_at = None
+        self._changed = threading.Condition()
+
+    def start(self, on_done=None):
+        def run():
+            try:
+                for part in self._results:
+                    with self._changed:
+                        self._parts.append(part)
+                        self._changed.notify_all()
+            except Exception as e:
+                self._error = e
+            finally:
+                with self._changed:
+                    self.done = True
+                    self.finished_at = time.monotonic()
+                    self._changed.notify_all()
+                if on_done is not None:
+                    on_done(self)
+
+        threading.Thread(target=run, daemon=True).start()
+        return self
+
+    @property
+    def failed(self):
+        return self._error is not None
+
+    def __iter__(self):
+        """ Every result from the first one on, waiting for those not rendered yet. """
+        i = 0
+        while True:
+            with self._changed:
+                self._changed.wait_for(lambda: i < len(self._parts) or self.done)
+                if i < len(self._parts):
+                    part = self._parts[i]
+                elif self._error is not None:
+                    raise self._error
+                else:
+                    return
+            yield part
+            i += 1
+
+
+class RenderRegistry:
+    """ Renders in flight by fingerprint, and renders by idempotency key. """
+
+    def __init__(self, ttl=IDEMPOTENCY_TTL, max_results=IDEMPOTENCY_MAX_RESULTS):
+        self.ttl = ttl
+        self.max_results = max_results
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._by_key = OrderedDict()
+
+    def render(self, fingerprint, results, idempotency_key=None, client=""):
+        """ The render for a request, joining the one in flight for the same fingerprint.
+        Args:
+            fingerprint (str): See render_fingerprint.
+            results (callable): Returns an iterable of results; only called if a new render
+                is started.
+            idempotency_key (str): The client's key for this request, or None.
+            client (str): Who sent the request, e.g. its address; keys of different
+                clients never match.
+
+        Returns:
+            render (SharedRender): Iterate it for the results.
+
+        Raises:
+            IdempotencyConflict: The client used the key before for a different request.
+        """
+        key = (client, idempotency_key) if idempotency_key else None
+        with self._lock:
+            self._expire()
+            render = self._by_key.get(key) if key else None
+            if render is not None and render.fingerprint != fingerprint:
+                raise IdempotencyConflict("The Idempotency-Key was already used for a different request")
+            if render is None:
+                render = self._in_flight.get(fingerprint)
+            started = render is None
+            if started:
+                render = self._in_flight[fingerprint] = SharedRender(results(), fingerprint)
+            if key:
+                self._by_key[key] = render
+                self._by_key.move_to_end(key)
+        if started:
+            render.start(on_done=lambda done: self._finish(fingerprint, done))
+        return render
+
+    def _finish(self, fingerprint, render):
+        with self._lock:
+            if self._in_flight.get(fingerprint) is render:
+                del self._in_flight[fingerprint]
+            if render.failed:
+                # A retry after a failure should try again, not replay the error
+                for key in [key for key, keyed in self._by_key.items() if keyed is render]:
+                    del self._by_key[key]
+            self._expire()
+
+    def _expire(self):
+        now = time.monotonic()
+        finished = [key for key, render in self._by_key.items() if render.done]
+        for key in finished:
+            if now - self._by_key[key].finished_at > self.ttl:
+                del self._by_key[key]
+        finished = [key for key in finished if key in self._by_key]
+        for key in finished[:max(0, len(finished) - self.max_results)]:
+            del self._by_key[key]
@@ -0,0 +1,277 @@
+import asyncio
+import os
+import random
+import threading
+import time
+
+import openai
+
+from metrics import (BOSON_CALLS, BOSON_CONCURRENCY_LIMIT, BOSON_ERRORS, BOSON_IN_FLIGHT, BOSON_RETRIES,
+                     BOSON_WAIT_SECONDS)
+from tracing import annotate, span
+
+# Every Boson request goes through one Dispatcher, which
+#
+# - spaces requests out with a token bucket, so a burst of chunks does not run straight
+#   into the endpoint's rate limit,
+# - caps how many requests are in flight, and moves that cap with what it sees: up by
+#   about one per round of fast successes, halved on a 429, timeout or 5xx, and trimmed
+#   when the time per generated token climbs well above its running average (requests
+#   for long and short chunks take very different times, so raw latency says little),
+# - retries a request that failed for one of those reasons after a jittered exponential
+#   backoff (or the server's Retry-After), so a hiccup costs one chunk a retry instead of
+#   the whole render, and
+# - counts what throttling costs, see Dispatcher.stats and the tts_boson_* metrics in
+#   metrics.py, and traces every attempt as an "api_call" span under the caller's
+#   current span, see tracing.py.
+#
+# The clients from boson.py do not retry on their own, so retries are not stacked.
+
+BOSON_REQUESTS_PER_SECOND = float(os.getenv("BOSON_REQUESTS_PER_SECOND", "4"))
+BOSON_BURST = int(os.getenv("BOSON_BURST", "8"))
+BOSON_MAX_RETRIES = int(os.getenv("BOSON_MAX_RETRIES", "5"))
+BOSON_MIN_CONCURRENCY = 1
+BOSON_MAX_CONCURRENCY = int(os.getenv("BOSON_MAX_CONCURRENCY", os.getenv("BOSON_MAX_CONNECTIONS", "32")))
+
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+# A request this many times slower per completion token than the running average
+# counts as congestion
+LATENCY_TOLERANCE = 2.0
+LATENCY_SMOOTHING = 0.2
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def retry_reason(error):
+    """ Why a failed request is worth retrying, or None if it is not.
+    Returns:
+        reason (str): "throttled", "timeout", "connection" or "server_error".
+    """
+    if isinstance(error, openai.RateLimitError):
+        return "throttled"
+    if isinstance(error, openai.APITimeoutError):
+        return "timeout"
+    if isinstance(error, openai.APIConnectionError):
+        return "connection"
+    if isinstance(error, openai.APIStatusError) and error.status_code >= 500:
+        return "server_error"
+    return None
+
+
+def _completion_tokens(result):
+    """ How many tokens a response generated, or None if it does not say. """
+    usage = getattr(result, "usage", None)
+    tokens = getattr(usage, "completion_tokens", None)
+    return tokens if isinstance(tokens, int) and tokens > 0 else None
+
+
+def _retry_after(error):
+    """ The server's Retry-After in seconds, if it sent one. """
+    response = getattr(error, "response", None)
+    try:
+        return max(0.0, float(response.headers.get("retry-after")))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class Dispatcher:
+    """ Rate limits, adaptively bounds and retries calls to the Boson endpoint.
+    Safe to share between threads, and between threads and one event loop.
+    Args:
+        rate (float): Requests started per second, on average.
+        burst (int): Requests that may start at once after a quiet spell.
+        max_retries (int): Retries per request before its error is raised.
+        min_concurrency, max_concurrency (int): Bounds of the in-flight cap.
+        initial_concurrency (int): Where the cap starts; defaults to max_concurrency / 4.
+    """
+
+    def __init__(self, rate=BOSON_REQUESTS_PER_SECOND, burst=BOSON_BURST, max_retries=BOSON_MAX_RETRIES,
+                 min_concurrency=BOSON_MIN_CONCURRENCY, max_concurrency=BOSON_MAX_CONCURRENCY,
+                 initial_concurrency=None):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_retries = max_retries
+        self.min_concurrency = max(1, min_concurrency)
+        self.max_concurrency = max(self.min_concurrency, max_concurrency)
+        initial = initial_concurrency or max(self.min_concurrency, self.max_concurrency // 4)
+        self.limit = float(min(self.max_concurrency, initial))
+        BOSON_CONCURRENCY_LIMIT.set(int(self.limit))
+
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._tokens = float(self.burst)
+        self._refilled_at = time.monotonic()
+        self._in_flight = 0
+        # Running average of seconds per completion token
+        self._latency = None
+        self._counters = dict(
+            calls=0,
+            succeeded=0,
+            failed=0,
+            retries=0,
+            throttled=0,
+            timeout=0,
+            connection=0,
+            server_error=0,
+            backoff_seconds=0.0,
+            rate_wait_seconds=0.0,
+            concurrency_wait_seconds=0.0,
+        )
+
+    def _try_start(self):
+        """ Take a token and an in-flight slot if both are free.
+        Returns:
+            wait (float): 0 if the call may start, else how long to wait before asking again.
+            blocked_on (str): "rate" or "concurrency" when wait > 0.
+        """
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+        if self._in_flight >= int(self.limit):
+            return 0.05, "concurrency"
+        if self._tokens < 1:
+            return (1 - self._tokens) / self.rate, "rate"
+        self._tokens -= 1
+        self._in_flight += 1
+        BOSON_IN_FLIGHT.set(self._in_flight)
+        return 0.0, None
+
+    def _finish(self, started_at, reason, tokens=None):
+        latency = time.monotonic() - started_at
+        with self._changed:
+            self._in_flight -= 1
+            BOSON_IN_FLIGHT.set(self._in_flight)
+            if reason is None:
+                self._counters["succeeded"] += 1
+                # Without a token count there is nothing to compare; only errors trim the cap
+                congested = False
+                if tokens is not None:
+                    latency /= tokens
+                    congested = self._latency is not None and latency > LATENCY_TOLERANCE * self._latency
+                    self._latency = latency if self._latency is None else (
+                        (1 - LATENCY_SMOOTHING) * self._latency + LATENCY_SMOOTHING * latency
+                    )
+                if congested:
+                    self.limit = max(self.min_concurrency, self.limit * 0.9)
+                else:
+                    self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            elif reason != "fatal":
+                self._counters[reason] += 1
+                BOSON_ERRORS.inc(reason=reason)
+                self.limit = max(self.min_concurrency, self.limit / 2)
+            BOSON_CONCURRENCY_LIMIT.set(int(self.limit))
+            self._changed.notify_all()
+
+    def _backoff(self, attempt, error):
+        delay = _retry_after(error)
+        if delay is None:
+            # Full jitter: spreads out the retries of requests that failed together
+            delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+        with self._lock:
+            self._counters["retries"] += 1
+            self._counters["backoff_seconds"] += delay
+        BOSON_RETRIES.inc()
+        BOSON_WAIT_SECONDS.inc(delay, reason="backoff")
+        return delay
+
+    def _count_wait(self, blocked_on, seconds):
+        with self._lock:
+            self._counters[f"{blocked_on}_wait_seconds"] += seconds
+        BOSON_WAIT_SECONDS.inc(seconds, reason=blocked_on)
+
+    def call(self, fn, *args, **kwargs):
+        """ fn(*args, **kwargs), rate limited and retried, see the notes above. """
+        with self._lock:
+            self._counters["calls"] += 1
+        for attempt in range(self.max_retries + 1):
+            waited = 0.0
+            with self._changed:
+                while True:
+                    wait, blocked_on = self._try_start()
+                    if not wait:
+                        break
+                    waited_from = time.monotonic()
+                    self._changed.wait(wait)
+                    self._counters[f"{blocked_on}_wait_seconds"] += time.monotonic() - waited_from
+                    BOSON_WAIT_SECONDS.inc(time.monotonic() - waited_from, reason=blocked_on)
+                    waited += time.monotonic() - waited_from
+            started_at = time.monotonic()
+            try:
+                with span("api_call", attempt=attempt, wait_seconds=waited):
+                    result = fn(*args, **kwargs)
+            except Exception as e:
+                reason = retry_reason(e)
+                self._finish(started_at, reason or "fatal")
+                if reason is None or attempt == self.max_retries:
+                    with self._lock:
+                        self._counters["failed"] += 1
+                    BOSON_CALLS.inc(result="failed")
+                    annotate(retries=attempt)
+                    raise
+                time.sleep(self._backoff(attempt, e))
+                continue
+            self._finish(started_at, None, _completion_tokens(result))
+            BOSON_CALLS.inc(result="succeeded")
+            annotate(retries=attempt)
+            return result
+
+    async def call_async(self, fn, *args, **kwargs):
+        """ Like call, for a coroutine function fn. Waits with asyncio.sleep instead of
+        blocking the event loop.
+        """
+        with self._lock:
+            self._counters["calls"] += 1
+        for attempt in range(self.max_retries + 1):
+            waited = 0.0
+            while True:
+                with self._lock:
+                    wait, blocked_on = self._try_start()
+                if not wait:
+                    break
+                waited_from = time.monotonic()
+                await asyncio.sleep(wait)
+                self._count_wait(blocked_on, time.monotonic() - waited_from)
+                waited += time.monotonic() - waited_from
+            started_at = time.monotonic()
+            try:
+                with span("api_call", attempt=attempt, wait_seconds=waited):
+                    result = await fn(*args, **kwargs)
+            except Exception as e:
+                reason = retry_reason(e)
+                self._finish(started_at, reason or "fatal")
+                if reason is None or attempt == self.max_retries:
+                    with self._lock:
+                        self._counters["failed"] += 1
+                    BOSON_CALLS.inc(result="failed")
+                    annotate(retries=attempt)
+                    raise
+                await asyncio.sleep(self._backoff(attempt, e))
+                continue
+            self._finish(started_at, None, _completion_tokens(result))
+            BOSON_CALLS.inc(result="succeeded")
+            annotate(retries=attempt)
+            return result
+
+    def stats(self):
+        """ Counters since start. Throttling costs show up as throttled requests, retries,
+        time spent backing off, and time requests waited for the rate limit or for a slot.
+        """
+        with self._lock:
+            return dict(
+                self._counters,
+                concurrency_limit=int(self.limit),
+                in_flight=self._in_flight,
+                seconds_per_token_average=self._latency,
+            )
+
+
+def get_dispatcher():
+    """ The process-wide dispatcher, created on first use. """
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = Dispatcher()
+    return _dispatcher
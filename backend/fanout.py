@@ -0,0 +1,67 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from chunking import estimate_audio_tokens
+
+# Chunks are rendered independently of each other: every request carries the same fixed
+# context (system prompt, speaker descriptions, reference audio) instead of the audio the
+# previous chunk produced, so any chunk can be in flight at any time. The longest chunks
+# are dispatched first so the slowest one starts early instead of setting the end time.
+
+
+def _dispatch_order(items, key, head_first):
+    order = sorted(range(len(items)), key=lambda i: key(items[i]), reverse=True)
+    if head_first and order:
+        # Whoever plays results as they arrive waits on items[0] before anything else
+        order.remove(0)
+        order.insert(0, 0)
+    return order
+
+
+def render_chunks(items, render, max_workers=4, key=estimate_audio_tokens, head_first=False):
+    """ Render items on a bounded thread pool and yield their results in input order.
+    Args:
+        items (list): The chunks, or whatever render takes.
+        render (callable): Renders one item, e.g. to WAV bytes.
+        max_workers (int): How many items are rendered at the same time.
+        key (callable): Estimated cost of an item; the costliest are dispatched first.
+        head_first (bool): Dispatch items[0] before the rest, for callers that stream the
+            results, so the first one is not stuck behind longer items.
+
+    Yields:
+        The result of render for items[0], items[1], ... Each one is yielded as soon as it
+        and every item before it are done, so the caller can start on the audio early.
+    """
+    pool = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items))))
+    try:
+        # The pool's queue is FIFO, so submission order is dispatch order
+        futures = [None] * len(items)
+        for i in _dispatch_order(items, key, head_first):
+            futures[i] = pool.submit(render, items[i])
+        # The futures list is the reorder buffer: results that finish early wait in it
+        for future in futures:
+            yield future.result()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def iter_chunks_async(items, render, max_concurrency=4, key=estimate_audio_tokens, head_first=False):
+    """ Like render_chunks, for a coroutine function render: an async generator yielding
+    the results in input order, each as soon as it and everything before it are done.
+    """
+    limit = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def run(item):
+        async with limit:
+            return await render(item)
+
+    # Tasks reach the semaphore in creation order and it wakes waiters first in, first out
+    tasks = [None] * len(items)
+    for i in _dispatch_order(items, key, head_first):
+        tasks[i] = asyncio.ensure_future(run(items[i]))
+    try:
+        for task in tasks:
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
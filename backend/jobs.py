@@ -0,0 +1,301 @@
+import json
+import os
+import threading
+import time
+import uuid
+
+from audio import concat_wav
+from metrics import STAGE_SECONDS
+from scheduler import FairScheduler, chunk_cost
+
+# Long scripts take longer to render than proxies and browsers wait for one response.
+# A job is accepted straight away and its chunks are rendered by a bounded pool of worker
+# threads shared by all jobs, in the order scheduler.FairScheduler picks; the client polls
+# for progress and fetches the audio once it is done. Jobs live on local disk, so a
+# restarted server picks up where it stopped: unfinished jobs are queued again, and the
+# chunks they had already rendered come back from the audio cache. Each job has
+#
+#     <id>.json          the job with its chunks, written once when it is submitted
+#     <id>.status.json   its status and times, rewritten when it starts and finishes
+#     <id>.wav           the result
+#
+# Finished jobs are kept for JOB_RETENTION seconds, and at most JOB_MAX_FINISHED of them,
+# in memory and on disk; the oldest go first.
+
+JOB_DIR = os.getenv("JOB_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".jobs"))
+# How many chunks render at the same time, across all jobs
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "8"))
+# How many accepted jobs may wait for a worker before new ones are turned away
+JOB_QUEUE_DEPTH = int(os.getenv("JOB_QUEUE_DEPTH", "32"))
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", "86400"))
+JOB_MAX_FINISHED = int(os.getenv("JOB_MAX_FINISHED", "100"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+CHUNK_PENDING = "pending"
+CHUNK_RENDERING = "rendering"
+CHUNK_DONE = "done"
+
+
+class QueueFull(Exception):
+    """ Raised by JobQueue.submit when JOB_QUEUE_DEPTH jobs are already waiting. """
+
+
+class Job:
+    """ One script to render, and how far it got.
+    Args:
+        chunks (list of (str, str)): (scene_prompt, chunk) pairs, see pipeline.scene_chunks.
+        speaker_desc (str): "SPEAKERn: description" lines.
+        submitter (str): Who asked, for sharing the workers fairly.
+    """
+
+    def __init__(self, chunks, speaker_desc, submitter="", job_id=None, status=QUEUED, chunk_status=None,
+                 error=None, created_at=None, started_at=None, finished_at=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.chunks = [tuple(chunk) for chunk in chunks]
+        self.speaker_desc = speaker_desc
+        self.submitter = submitter
+        self.status = status
+        self.chunk_status = chunk_status or [CHUNK_PENDING] * len(self.chunks)
+        self.error = error
+        self.created_at = created_at or time.time()
+        self.started_at = started_at
+        self.finished_at = finished_at
+        # Seconds each chunk waited for a worker, set when it is dispatched; not saved
+        self.queue_seconds = [None] * len(self.chunks)
+        # Held while the status file is written, see JobQueue._save_status
+        self.save_lock = threading.Lock()
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+    def to_dict(self):
+        return dict(
+            job_id=self.id,
+            chunks=self.chunks,
+            speaker_desc=self.speaker_desc,
+            submitter=self.submitter,
+            status=self.status,
+            chunk_status=self.chunk_status,
+            error=self.error,
+            created_at=self.created_at,
+            started_at=self.started_at,
+            finished_at=self.finished_at,
+        )
+
+    def status_dict(self):
+        """ What changes after submission, apart from the per-chunk progress. """
+        return dict(status=self.status, error=self.error, started_at=self.started_at, finished_at=self.finished_at)
+
+    def progress(self):
+        """ What the status endpoint reports: everything but the script itself. """
+        return dict(
+            job_id=self.id,
+            status=self.status,
+            chunks_total=len(self.chunks),
+            chunks_done=self.chunk_status.count(CHUNK_DONE),
+            chunk_status=list(self.chunk_status),
+            estimated_cost=sum(chunk_cost(chunk) for _, chunk in self.chunks),
+            error=self.error,
+            created_at=self.created_at,
+            queue_wait=None if self.started_at is None else self.started_at - self.created_at,
+            makespan=None if self.finished_at is None else self.finished_at - self.created_at,
+        )
+
+
+class JobQueue:
+    """ Accepts jobs, renders their chunks on worker threads and keeps them on disk.
+    Args:
+        render (callable): render(job, i) returns chunk i of the job as WAV bytes.
+        directory (str): Where jobs and their results are kept.
+        workers (int): How many chunks render at the same time.
+        max_queued (int): How many jobs may wait for their first chunk to start.
+        retention (float): Seconds a finished job is kept.
+        max_finished (int): How many finished jobs are kept.
+    """
+
+    def __init__(self, render, directory=JOB_DIR, workers=JOB_WORKERS, max_queued=JOB_QUEUE_DEPTH,
+                 retention=JOB_RETENTION, max_finished=JOB_MAX_FINISHED):
+        self.render = render
+        self.directory = directory
+        self.workers = max(1, workers)
+        self.max_queued = max_queued
+        self.retention = retention
+        self.max_finished = max_finished
+        self.scheduler = FairScheduler()
+        self._jobs = {}
+        # Rendered chunks of unfinished jobs, by job id and chunk index
+        self._audio = {}
+        self._lock = threading.Lock()
+        self._started = False
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        """ Load the jobs on disk, queue the unfinished ones again and start the workers. """
+        if self._started:
+            return self
+        with self._lock:
+            if self._started:
+                return self
+            self._started = True
+            unfinished = []
+            now = time.time()
+            for name in os.listdir(self.directory):
+                if not name.endswith(".json") or name.endswith(".status.json"):
+                    continue
+                job_id = name[:-len(".json")]
+                # The status file is small; an expired job's chunks are never read
+                status = self._read(self._path(job_id, ".status.json")) or {}
+                if status.get("finished_at") is not None and now - status["finished_at"] > self.retention:
+                    self._remove_files(job_id)
+                    continue
+                job = Job(**{**self._read(self._path(job_id, ".json")), **status})
+                if job.status in (QUEUED, RUNNING):
+                    # Rendered chunks were only kept in memory; the audio cache has them
+                    job.status = QUEUED
+                    job.chunk_status = [CHUNK_PENDING] * len(job.chunks)
+                    unfinished.append(job)
+                self._jobs[job.id] = job
+            for job in sorted(unfinished, key=lambda job: job.created_at):
+                self._audio[job.id] = {}
+                self.scheduler.add(job)
+        self._prune()
+        for _ in range(self.workers):
+            threading.Thread(target=self._work, daemon=True).start()
+        return self
+
+    def submit(self, chunks, speaker_desc, submitter=""):
+        """ Accept a script for rendering.
+        Returns:
+            job (Job): The queued job.
+
+        Raises:
+            QueueFull: If max_queued jobs are already waiting.
+        """
+        job = Job(chunks, speaker_desc, submitter)
+        # The chunks are written once, before the job is queued and outside the lock
+        self._write(self._path(job.id, ".json"), job.to_dict())
+        with self._lock:
+            full = self.scheduler.pending_jobs >= self.max_queued
+            if not full:
+                self._jobs[job.id] = job
+                self._audio[job.id] = {}
+                self.scheduler.add(job)
+        if full:
+            self._remove_files(job.id)
+            raise QueueFull(f"{self.max_queued} jobs are already waiting")
+        return job
+
+    def get(self, job_id):
+        """ The job with this id, or None. """
+        return self._jobs.get(job_id)
+
+    def result_path(self, job):
+        return os.path.join(self.directory, f"{job.id}.wav")
+
+    @property
+    def depth(self):
+        """ How many jobs are waiting for their first chunk to start. """
+        return self.scheduler.pending_jobs
+
+    def _path(self, job_id, suffix):
+        return os.path.join(self.directory, f"{job_id}{suffix}")
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _write(path, data):
+        # Write then rename, so a crash never leaves half a job file
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def _save_status(self, job):
+        # Outside the queue lock. The status is read under the job's own lock, so when two
+        # workers save the same job the file ends up with the later state.
+        with job.save_lock:
+            self._write(self._path(job.id, ".status.json"), job.status_dict())
+
+    def _remove_files(self, job_id):
+        for suffix in (".json", ".status.json", ".wav"):
+            try:
+                os.remove(self._path(job_id, suffix))
+            except FileNotFoundError:
+                pass
+
+    def _prune(self):
+        """ Forget finished jobs older than the retention, then the oldest beyond max_finished. """
+        now = time.time()
+        with self._lock:
+            finished = sorted((job for job in self._jobs.values() if job.finished), key=lambda job: job.finished_at)
+            expired = [job for job in finished if now - job.finished_at > self.retention]
+            kept = finished[len(expired):]
+            expired += kept[:max(0, len(kept) - self.max_finished)]
+            for job in expired:
+                del self._jobs[job.id]
+        for job in expired:
+            with job.save_lock:
+                self._remove_files(job.id)
+
+    def _finish(self, job, status, error=None):
+        # Checked and set under the lock: when several chunks of a job fail at once, the
+        # first failure is the one kept
+        with self._lock:
+            if job.finished:
+                return
+            job.status, job.error, job.finished_at = status, error, time.time()
+            self._audio.pop(job.id, None)
+        self._save_status(job)
+        self._prune()
+
+    def _work(self):
+        while True:
+            job, i, waited = self.scheduler.next()
+            with self._lock:
+                job.queue_seconds[i] = waited
+                started = job.status == QUEUED
+                if started:
+                    job.status, job.started_at = RUNNING, time.time()
+                job.chunk_status[i] = CHUNK_RENDERING
+            if started:
+                self._save_status(job)
+
+            try:
+                audio_bytes = self.render(job, i)
+            except Exception as e:
+                # The rest of the job is not worth rendering without this chunk
+                self.scheduler.cancel(job)
+                self.scheduler.done(job, i)
+                self._finish(job, FAILED, str(e))
+                continue
+
+            # Per-chunk progress is only kept in memory; a restart renders unfinished jobs
+            # again, from the audio cache
+            with self._lock:
+                job.chunk_status[i] = CHUNK_DONE
+                if job.id in self._audio:
+                    self._audio[job.id][i] = audio_bytes
+            if not self.scheduler.done(job, i):
+                continue
+
+            try:
+                chunk_audio = self._audio[job.id]
+                tmp_path = f"{self.result_path(job)}.tmp"
+                with STAGE_SECONDS.time(stage="stitch"), open(tmp_path, "wb") as f:
+                    f.write(concat_wav(chunk_audio[n] for n in range(len(job.chunks))))
+                os.replace(tmp_path, self.result_path(job))
+            except Exception as e:
+                self._finish(job, FAILED, str(e))
+            else:
+                self._finish(job, DONE)
@@ -0,0 +1,198 @@
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Counters, gauges and histograms for where a render spends its time, served by the
+# /metrics route in the Prometheus text format. Updating one is a lock, a dictionary
+# lookup and, for a histogram, a bisect, so the pipeline stages (milliseconds to
+# seconds each) and the Boson calls (seconds) are timed on every request.
+#
+# Stages, as the "stage" label of tts_stage_seconds:
+#
+#     decode_upload   reading and decoding the uploaded file
+#     normalize       normalizer.normalize_lines on the decoded text
+#     cast            finding the characters and tagging their cues
+#     parse_scenes    cutting the transcript into scenes
+#     chunk           cutting the scenes into chunks
+#     cache_read      looking a chunk up in the audio cache
+#     model_call      the Boson request, including the dispatcher's waits and retries
+#     base64_decode   turning the response into WAV bytes
+#     cache_write     writing the WAV file into the audio cache
+#     stitch          joining a job's chunks into one WAV file
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SIZE_BUCKETS = tuple(1024 * 4 ** n for n in range(10))
+
+_metrics = []
+_metrics_lock = threading.Lock()
+
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        with _metrics_lock:
+            _metrics.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key, extra=()):
+        pairs = [*zip(self.labelnames, key), *extra]
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def _samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in values.items():
+            yield f"{self.name}{self._labels(key)} {_number(value)}"
+
+    def exposition(self):
+        return "\n".join([
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+            *self._samples(),
+        ])
+
+
+class Counter(_Metric):
+    """ A total that only goes up, such as requests served or bytes sent. """
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """ A value that goes up and down, such as requests in flight. """
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """ Observations counted into buckets, with their sum and count.
+    Args:
+        buckets (tuple of float): Upper bounds, in increasing order; +Inf is added.
+    """
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # One count per bucket and +Inf, then the sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[i] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """ Observe how long the with block took, in seconds. """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self):
+        with self._lock:
+            values = {key: list(counts) for key, counts in self._values.items()}
+        for key, counts in values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{self._labels(key, [('le', _number(float(bound)))])} {cumulative}"
+            yield f"{self.name}_sum{self._labels(key)} {_number(counts[-1])}"
+            yield f"{self.name}_count{self._labels(key)} {cumulative}"
+
+
+class IterTimer:
+    """ Pass an iterable through, adding up the time spent waiting for its items. """
+
+    def __init__(self, iterable):
+        self.seconds = 0.0
+        self._iterator = iter(iterable)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            return next(self._iterator)
+        finally:
+            self.seconds += time.perf_counter() - started
+
+
+def exposition():
+    """ Every metric in the Prometheus text format. """
+    with _metrics_lock:
+        metrics = list(_metrics)
+    return "\n".join(metric.exposition() for metric in metrics) + "\n"
+
+
+STAGE_SECONDS = Histogram("tts_stage_seconds", "Time spent in each pipeline stage, see metrics.py.", ["stage"])
+REQUEST_SECONDS = Histogram(
+    "tts_request_seconds", "Time from a request's arrival to the last byte of its response.", ["endpoint"]
+)
+REQUESTS = Counter("tts_requests_total", "Requests answered, by endpoint and status code.", ["endpoint", "status"])
+REQUESTS_IN_FLIGHT = Gauge("tts_requests_in_flight", "Requests being handled or streamed right now.", ["endpoint"])
+REQUEST_BYTES = Histogram("tts_request_bytes", "Size of request bodies, such as uploaded scripts.", ["endpoint"],
+                          buckets=SIZE_BUCKETS)
+RESPONSE_BYTES = Counter("tts_response_bytes_total", "Bytes sent in responses.", ["endpoint"])
+AUDIO_SECONDS = Counter("tts_audio_seconds_total", "Seconds of audio rendered, including cache hits.")
+MODEL_AUDIO_BYTES = Counter("tts_model_audio_bytes_total", "WAV bytes received from the Boson endpoint.")
+CACHE_LOOKUPS = Counter("tts_audio_cache_lookups_total", "Audio cache lookups, by hit or miss.", ["result"])
+BOSON_CALLS = Counter("tts_boson_calls_total", "Boson requests, by whether they succeeded, counting retries once.",
+                      ["result"])
+BOSON_ERRORS = Counter(
+    "tts_boson_errors_total", "Boson attempts that failed and were worth retrying: throttled, timeout, connection "
+    "or server_error.", ["reason"]
+)
+BOSON_RETRIES = Counter("tts_boson_retries_total", "Boson attempts made again after an error.")
+BOSON_WAIT_SECONDS = Counter(
+    "tts_boson_wait_seconds_total", "Time Boson requests spent held back: backing off after an error, waiting for "
+    "the rate limit, or waiting for a slot under the concurrency limit.", ["reason"]
+)
+BOSON_CONCURRENCY_LIMIT = Gauge("tts_boson_concurrency_limit", "How many Boson requests may be in flight right now.")
+BOSON_IN_FLIGHT = Gauge("tts_boson_in_flight", "Boson requests in flight right now.")
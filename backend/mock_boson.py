@@ -0,0 +1,222 @@
+import base64
+import hashlib
+import io
+import random
+import threading
+import time
+import wave
+
+import click
+from flask import Flask, Response, jsonify, request
+
+from chunking import AUDIO_TOKENS_PER_SECOND, WORDS_PER_SECOND
+
+# A local stand-in for the Boson endpoint, for load tests and benchmarks that should not
+# spend quota or depend on the network. It speaks the two OpenAI-compatible calls this
+# repo makes, chat.completions with the audio modality and audio.speech, and answers
+# with synthetic audio: a tone picked from a hash of the text, as long as the text would
+# take to read at WORDS_PER_SECOND, so the same request always gets the same bytes.
+# Latency, jitter, errors and rate limiting are configurable. Run it with
+#
+#     python backend/mock_boson.py --port 8000 --latency 0.5 --tokens_per_second 200
+#
+# and point the backend at it with BOSON_BASE_URL=http://127.0.0.1:8000/v1.
+
+SAMPLE_RATE = 24000
+SAMPLE_WIDTH = 2
+
+app = Flask(__name__)
+app.config.update(
+    LATENCY=0.0,
+    TOKENS_PER_SECOND=0.0,
+    JITTER=0.0,
+    ERROR_RATE=0.0,
+    RATE_LIMIT=0.0,
+    RATE_BURST=1,
+)
+
+_state_lock = threading.Lock()
+_random = random.Random(0)
+_bucket = {"tokens": 1.0, "refilled_at": time.monotonic()}
+
+
+def synthetic_pcm(text, max_seconds=None):
+    """ 16-bit mono PCM for text: a tone picked from the text's hash, one second per
+    WORDS_PER_SECOND words.
+    """
+    seconds = max(0.5, len(text.split()) / WORDS_PER_SECOND)
+    if max_seconds is not None:
+        seconds = min(seconds, max_seconds)
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+    # A whole number of samples per period, so one period can be repeated as bytes
+    period = 60 + digest[0] % 120
+    amplitude = 3000 + digest[1] * 20
+    one_period = bytearray()
+    for n in range(period):
+        # A triangle wave: no math module needed and cheap to build
+        phase = n / period
+        value = 4 * phase - 1 if phase < 0.5 else 3 - 4 * phase
+        one_period += int(amplitude * value).to_bytes(SAMPLE_WIDTH, "little", signed=True)
+    frames = int(seconds * SAMPLE_RATE)
+    repeats = -(-frames // period)
+    return bytes(one_period * repeats)[:frames * SAMPLE_WIDTH]
+
+
+def pcm_to_wav(pcm):
+    out = io.BytesIO()
+    with wave.open(out, "wb") as writer:
+        writer.setnchannels(1)
+        writer.setsampwidth(SAMPLE_WIDTH)
+        writer.setframerate(SAMPLE_RATE)
+        writer.writeframes(pcm)
+    return out.getvalue()
+
+
+def _message_text(content):
+    if isinstance(content, str):
+        return content
+    # A list of content parts; only text parts are spoken
+    return " ".join(part.get("text", "") for part in content or () if isinstance(part, dict))
+
+
+def _error(status, message, error_type, headers=None):
+    return jsonify({"error": {"message": message, "type": error_type, "code": status}}), status, headers or {}
+
+
+def _admit():
+    """ Rate limiting and error injection, before any work is done.
+    Returns:
+        A Flask error response, or None if the request may go ahead.
+    """
+    config = app.config
+    with _state_lock:
+        if config["RATE_LIMIT"] > 0:
+            now = time.monotonic()
+            _bucket["tokens"] = min(
+                config["RATE_BURST"], _bucket["tokens"] + (now - _bucket["refilled_at"]) * config["RATE_LIMIT"]
+            )
+            _bucket["refilled_at"] = now
+            if _bucket["tokens"] < 1:
+                retry_after = (1 - _bucket["tokens"]) / config["RATE_LIMIT"]
+                return _error(429, "Rate limit exceeded", "rate_limit_exceeded", {"Retry-After": f"{retry_after:.3f}"})
+            _bucket["tokens"] -= 1
+        failed = _random.random() < config["ERROR_RATE"]
+        jitter = _random.uniform(-config["JITTER"], config["JITTER"])
+    if failed:
+        return _error(500, "Injected server error", "server_error")
+    request.environ["mock_boson.jitter"] = jitter
+    return None
+
+
+def _simulate_latency(audio_tokens):
+    """ Sleep like a generation of audio_tokens would take. """
+    config = app.config
+    delay = config["LATENCY"]
+    if config["TOKENS_PER_SECOND"] > 0:
+        delay += audio_tokens / config["TOKENS_PER_SECOND"]
+    delay *= 1 + request.environ.get("mock_boson.jitter", 0.0)
+    if delay > 0:
+        time.sleep(delay)
+
+
+@app.route("/v1/chat/completions", methods=["POST"])
+def chat_completions():
+    rejected = _admit()
+    if rejected:
+        return rejected
+    body = request.get_json(force=True)
+    if body.get("stream"):
+        return _error(400, "The mock server does not stream", "invalid_request_error")
+
+    # The text to speak is the last user message
+    user_messages = [m for m in body.get("messages", []) if m.get("role") == "user"]
+    text = _message_text(user_messages[-1].get("content")) if user_messages else ""
+    max_tokens = body.get("max_completion_tokens") or body.get("max_tokens")
+    max_seconds = max_tokens / AUDIO_TOKENS_PER_SECOND if max_tokens else None
+
+    pcm = synthetic_pcm(text, max_seconds)
+    audio_tokens = len(pcm) // SAMPLE_WIDTH * AUDIO_TOKENS_PER_SECOND // SAMPLE_RATE
+    _simulate_latency(audio_tokens)
+
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+    return jsonify({
+        "id": f"chatcmpl-mock-{digest}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", ""),
+        "choices": [{
+            "index": 0,
+            "finish_reason": "stop",
+            "message": {
+                "role": "assistant",
+                "content": None,
+                "audio": {
+                    "id": f"audio-mock-{digest}",
+                    "data": base64.b64encode(pcm_to_wav(pcm)).decode("ascii"),
+                    "expires_at": int(time.time()) + 3600,
+                    "transcript": text,
+                },
+            },
+        }],
+        "usage": {
+            "prompt_tokens": len(text.split()),
+            "completion_tokens": audio_tokens,
+            "total_tokens": len(text.split()) + audio_tokens,
+        },
+    })
+
+
+@app.route("/v1/audio/speech", methods=["POST"])
+def audio_speech():
+    rejected = _admit()
+    if rejected:
+        return rejected
+    body = request.get_json(force=True)
+    pcm = synthetic_pcm(body.get("input", ""))
+    _simulate_latency(len(pcm) // SAMPLE_WIDTH * AUDIO_TOKENS_PER_SECOND // SAMPLE_RATE)
+
+    response_format = body.get("response_format", "pcm")
+    if response_format == "pcm":
+        return Response(pcm, mimetype="audio/pcm")
+    if response_format == "wav":
+        return Response(pcm_to_wav(pcm), mimetype="audio/wav")
+    return _error(400, f"Unsupported response_format {response_format!r}; use pcm or wav", "invalid_request_error")
+
+
+@app.route("/health")
+def health():
+    return jsonify({"status": "ok"})
+
+
+def configure(latency=0.0, tokens_per_second=0.0, jitter=0.0, error_rate=0.0, rate_limit=0.0, rate_burst=1, seed=0):
+    """ Set the simulated behaviour; see the command line options. """
+    app.config.update(
+        LATENCY=latency,
+        TOKENS_PER_SECOND=tokens_per_second,
+        JITTER=jitter,
+        ERROR_RATE=error_rate,
+        RATE_LIMIT=rate_limit,
+        RATE_BURST=max(1, rate_burst),
+    )
+    with _state_lock:
+        _random.seed(seed)
+        _bucket.update(tokens=float(max(1, rate_burst)), refilled_at=time.monotonic())
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1")
+@click.option("--port", type=int, default=8000)
+@click.option("--latency", type=float, default=0.0, help="Fixed seconds added to every request.")
+@click.option("--tokens_per_second", type=float, default=0.0, help="Audio tokens generated per second; 0 for no generation time.")
+@click.option("--jitter", type=float, default=0.0, help="Latency varies by up to this fraction either way, e.g. 0.2.")
+@click.option("--error_rate", type=float, default=0.0, help="Fraction of requests answered with a 500.")
+@click.option("--rate_limit", type=float, default=0.0, help="Requests per second before 429s; 0 for no limit.")
+@click.option("--rate_burst", type=int, default=1, help="Requests allowed at once under the rate limit.")
+@click.option("--seed", type=int, default=0, help="Seed for jitter and injected errors.")
+def main(host, port, **settings):
+    configure(**settings)
+    app.run(host=host, port=port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import io
+import mmap
+import os
+import re
+from itertools import product
+
+# Sound-effect tags the Higgs model understands, and what they become in the prompt
+SOUND_EFFECT_TAGS = [
+    ("[laugh]", "<SE>[Laughter]</SE>"),
+    ("[humming start]", "<SE_s>[Humming]</SE_s>"),
+    ("[humming end]", "<SE_e>[Humming]</SE_e>"),
+    ("[music start]", "<SE_s>[Music]</SE_s>"),
+    ("[music end]", "<SE_e>[Music]</SE_e>"),
+    ("[music]", "<SE>[Music]</SE>"),
+    ("[sing start]", "<SE_s>[Singing]</SE_s>"),
+    ("[sing end]", "<SE_e>[Singing]</SE_e>"),
+    ("[applause]", "<SE>[Applause]</SE>"),
+    ("[cheering]", "<SE>[Cheering]</SE>"),
+    ("[cough]", "<SE>[Cough]</SE>"),
+]
+
+SYMBOL_REPLACEMENTS = [
+    ("(", " "),
+    (")", " "),
+    ("°F", " degrees Fahrenheit"),
+    ("°C", " degrees Celsius"),
+]
+
+SPEAKER_ID_START = "<|speaker_id_start|>"
+SPEAKER_ID_END = "<|speaker_id_end|>"
+
+
+def _paren_variants(tag):
+    # The old replace chain turned parentheses into spaces before looking for tags,
+    # so "[music(start]" was still a tag. Every space in a tag may be spelled as ( or ).
+    pieces = tag.split(" ")
+    for seps in product(" ()", repeat=len(pieces) - 1):
+        yield pieces[0] + "".join(sep + piece for sep, piece in zip(seps, pieces[1:]))
+
+
+def _build_table(speaker_id_tags):
+    table = dict(SYMBOL_REPLACEMENTS)
+    for tag, replacement in SOUND_EFFECT_TAGS:
+        for variant in _paren_variants(tag):
+            table[variant] = replacement
+    if speaker_id_tags:
+        # The chain rewrote every bracket after the tags, including the brackets the tag
+        # replacements themselves produced, so bake that into the table.
+        for key, value in table.items():
+            table[key] = value.replace("[", SPEAKER_ID_START).replace("]", SPEAKER_ID_END)
+        table["["] = SPEAKER_ID_START
+        table["]"] = SPEAKER_ID_END
+    return table
+
+
+def _build_pattern(speaker_id_tags):
+    # Every top-level alternative starts with a literal character so the regex engine can
+    # skip ahead to the next [ ] ( ) or ° instead of trying each alternative at every offset.
+    tag_bodies = "|".join(
+        re.escape(tag[1:-1]).replace(r"\ ", "[ ()]") for tag, _ in SOUND_EFFECT_TAGS
+    )
+    if speaker_id_tags:
+        alternatives = [rf"\[(?:(?:{tag_bodies})\])?", r"\]"]
+    else:
+        alternatives = [rf"\[(?:{tag_bodies})\]"]
+    alternatives += ["°[FC]", r"\(", r"\)"]
+    return re.compile("(" + "|".join(alternatives) + ")")
+
+
+class TranscriptNormalizer:
+    """ Single-scan replacement of the symbol and sound-effect table.
+    Args:
+        speaker_id_tags (bool): Whether to rewrite [ and ] as <|speaker_id_start|> and <|speaker_id_end|>.
+    """
+
+    def __init__(self, speaker_id_tags=True):
+        self.speaker_id_tags = speaker_id_tags
+        self._table = _build_table(speaker_id_tags)
+        self._pattern = _build_pattern(speaker_id_tags)
+
+    def replace_tags(self, text):
+        # split() with one capture group puts the matched tokens at the odd indices
+        parts = self._pattern.split(text)
+        parts[1::2] = [self._table[token] for token in parts[1::2]]
+        return "".join(parts)
+
+    def iter_lines(self, lines):
+        """ Normalize lines one at a time, yielding the ones that are not blank.
+        Tags never span a newline, so joining the output with "\n" gives the same
+        result as normalizing the whole text at once.
+        Args:
+            lines (iterable of str): Lines with or without their trailing newline.
+        """
+        for line in lines:
+            for piece in self.replace_tags(line).split("\n"):
+                words = piece.split()
+                if words:
+                    yield " ".join(words)
+
+    def __call__(self, text):
+        return "\n".join(self.iter_lines([text]))
+
+
+_normalizers = {}
+
+
+def get_normalizer(speaker_id_tags=True):
+    if speaker_id_tags not in _normalizers:
+        _normalizers[speaker_id_tags] = TranscriptNormalizer(speaker_id_tags)
+    return _normalizers[speaker_id_tags]
+
+
+def normalize_lines(lines, speaker_id_tags=True):
+    """ Streaming version of normalize_transcript, see TranscriptNormalizer.iter_lines. """
+    return get_normalizer(speaker_id_tags).iter_lines(lines)
+
+
+def iter_file_blocks(path, block_size=1 << 16, encoding="utf-8"):
+    """ Yield a file as decoded blocks of whole lines, reading it through mmap.
+    Only one block is decoded at a time, so huge scripts never sit in memory as one str.
+    Feed the blocks to normalize_lines; each one ends just before a "\n".
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            start = 0
+            while start < len(buf):
+                end = buf.find(b"\n", start + block_size)
+                if end == -1:
+                    end = len(buf)
+                yield buf[start:end].decode(encoding)
+                start = end + 1
+
+
+def iter_stream_blocks(stream, block_size=1 << 16, encoding="utf-8"):
+    """ Like iter_file_blocks, for a binary stream such as an uploaded file. """
+    text = io.TextIOWrapper(stream, encoding=encoding, newline="")
+    try:
+        # readlines also ends a line at a lone "\r", which normalize_transcript reads as a
+        # space, so blocks end after a "\n" and the lines after the last one are held back
+        pending = []
+        while True:
+            lines = text.readlines(block_size)
+            if not lines:
+                break
+            end = len(lines)
+            while end and not lines[end - 1].endswith("\n"):
+                end -= 1
+            if end:
+                yield "".join(pending + lines[:end])
+                pending = []
+            pending += lines[end:]
+        if pending:
+            yield "".join(pending)
+    finally:
+        # Hand the stream back to its owner instead of closing it with the wrapper
+        text.detach()
+
+
+def normalize_transcript(transcript, speaker_id_tags=True):
+    """ Clean a transcript for the Higgs model.
+    Args:
+        transcript (str): The raw transcript text.
+        speaker_id_tags (bool): Whether to rewrite [ and ] as speaker id tokens. The local
+            generation scripts keep the raw [SPEAKERn] tags and pass False.
+
+    Returns:
+        transcript (str): The transcript with symbols and tags replaced, whitespace collapsed
+            and blank lines dropped.
+    """
+    return get_normalizer(speaker_id_tags)(transcript)
@@ -0,0 +1,150 @@
+import base64
+import os
+import time
+
+from boson import BOSON_MODEL
+from cast import assign_speakers, discover_cast, tag_cues
+from chunking import prepare_chunk_text
+from metrics import STAGE_SECONDS, IterTimer
+from normalizer import iter_stream_blocks, normalize_lines
+from script_parser import ScriptIndex
+
+# Shared by the Flask app (app.py) and the ASGI app (async_app.py): everything between
+# the uploaded file and the Boson requests, and turning a response back into audio.
+
+# How many chunks of one script are rendered against the Boson endpoint at the same time
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "4"))
+
+MAX_COMPLETION_TOKENS = 4096
+
+TTS_SYSTEM_MESSAGE = "You are an AI assistant designed to convert text into speech. If the user's message includes a [SPEAKER*] tag, do not read out the tag and generate speech for the following text, using the specified voice. If no speaker tag is present, select a suitable voice on your own."
+
+
+def actor_descriptions(form):
+    """ Read the actor description boxes of the upload form.
+    Args:
+        form (dictionary): The submitted form, with "actor1", "actor2", ... fields such as
+            "Juliet : naive female voice".
+
+    Returns:
+        descriptions (dictionary): Maps actor names to voice descriptions.
+    """
+    descriptions = {}
+    for field, value in form.items():
+        if not field.startswith("actor"):
+            continue
+        name, _, description = value.partition(":")
+        if name.strip() and description.strip():
+            descriptions[name.strip()] = description.strip()
+    return descriptions
+
+
+def speaker_descriptions(cast, descriptions):
+    """ "SPEAKERn: description" lines for the characters the form described. """
+    described = {name.casefold(): description for name, description in descriptions.items()}
+    speaker_desc = []
+    for number, member in enumerate(cast, start=1):
+        description = described.get(member.name.casefold())
+        if description:
+            speaker_desc.append(f"SPEAKER{number}: {description}")
+    return "\n".join(speaker_desc)
+
+
+def prepare_scenes(stream, form):
+    """ Turn an uploaded script into the scenes to render.
+    Args:
+        stream (binary file): The uploaded file.
+        form (dictionary): The rest of the upload form, see actor_descriptions.
+
+    Returns:
+        scenes (list of (str, str)): (scene_prompt, transcript) pairs in script order. Empty
+            if the upload has no text.
+        speaker_desc (str): "SPEAKERn: description" lines for every scene.
+
+    The upload is decoded and normalized a block at a time, so the raw bytes and the
+    decoded text never sit in memory whole. The normalized script does, once as lines
+    and once as the tagged text: every line has to be seen before the cast is known and
+    any cue can be tagged, and the scenes are cut from the whole text.
+    """
+    # Both happen in the same loop; the time spent reading blocks is the decoding
+    started = time.perf_counter()
+    blocks = IterTimer(iter_stream_blocks(stream))
+    lines = list(normalize_lines(blocks))
+    STAGE_SECONDS.observe(blocks.seconds, stage="decode_upload")
+    STAGE_SECONDS.observe(time.perf_counter() - started - blocks.seconds, stage="normalize")
+    if not lines:
+        return [], ""
+
+    # Character cues become speaker tags, so the model keeps one voice per character.
+    # Both passes read the lines as they are instead of splitting a joined copy.
+    with STAGE_SECONDS.time(stage="cast"):
+        cast = discover_cast(lines)
+        transcript = tag_cues(lines, assign_speakers(cast)) if cast else "\n".join(lines)
+        del lines
+        speaker_desc = speaker_descriptions(cast, actor_descriptions(form))
+
+    # Every SETTING: block opens a scene with its own description
+    with STAGE_SECONDS.time(stage="parse_scenes"):
+        scenes = [scene for scene in ScriptIndex(transcript).scenes() if scene[1]]
+    return scenes, speaker_desc
+
+
+def scene_chunks(scenes, max_completion_tokens=MAX_COMPLETION_TOKENS):
+    """ Cut every scene into chunks that each fit in one request.
+    Args:
+        scenes (list of (str, str)): (scene_prompt, transcript) pairs, see prepare_scenes.
+        max_completion_tokens (int): The completion token limit of one request.
+
+    Returns:
+        chunks (list of (str, str)): (scene_prompt, chunk) pairs in script order.
+    """
+    with STAGE_SECONDS.time(stage="chunk"):
+        return [
+            (scene_prompt, chunk)
+            for scene_prompt, transcript in scenes
+            for chunk in prepare_chunk_text(transcript, chunk_method="budget", max_completion_tokens=max_completion_tokens)
+        ]
+
+
+def generation_request(scene_prompt, transcript, speaker_desc="", reference_messages=()):
+    """ Keyword arguments of chat.completions.create for one scene or chunk.
+    Args:
+        scene_prompt (str): The scene description, or "" if the scene has none.
+        transcript (str): The normalized transcript to speak.
+        speaker_desc (str): "SPEAKERn: description" lines, or "" to let the model pick voices.
+        reference_messages (list of dict): Reference transcript/audio message pairs. Every
+            chunk gets the same ones, so chunks do not depend on each other's output.
+    """
+    scene_desc = "\n\n".join(desc for desc in (scene_prompt, speaker_desc) if desc)
+    if scene_desc:
+        scene_desc = f"<|scene_desc_start|>\n{scene_desc}\n<|scene_desc_end|>"
+
+    return dict(
+        model=BOSON_MODEL,
+        messages=[
+            {"role": "system", "content": TTS_SYSTEM_MESSAGE},
+            *reference_messages,
+            {"role": "user", "content": transcript},
+            {"role": "system", "content": f"Generate realistic multi-speaker audio. {scene_desc}"}
+        ],
+        modalities=["text", "audio"],
+        max_completion_tokens=MAX_COMPLETION_TOKENS,
+        temperature=1.0,
+        top_p=0.95,
+        stream=False,
+        stop=["<|eot_id|>", "<|end_of_text|>", "<|audio_eos|>"],
+        extra_body={"top_k": 50},
+    )
+
+
+def response_audio(resp):
+    """ The WAV bytes of a chat.completions response. """
+    return base64.b64decode(resp.choices[0].message.audio.data)
+
+
+def response_tokens(resp):
+    """ The prompt and completion token counts of a chat.completions response, if it has them. """
+    usage = getattr(resp, "usage", None)
+    if usage is None:
+        return {}
+    return dict(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
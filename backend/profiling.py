@@ -0,0 +1,305 @@
+import functools
+import hmac
+import json
+import os
+import runpy
+import sys
+import threading
+import time
+import uuid
+
+import click
+
+# Profiles of single requests, taken on demand. A /generate_audio request that carries
+# the header "X-Profile: <PROFILE_TOKEN>" runs under a sampling profiler: every
+# PROFILE_INTERVAL seconds it records the stacks of the threads working for that request
+# (the request thread and the threads rendering its chunks) and adds up, per call path,
+#
+#     wall   the time a thread spent there, including waiting, e.g. for the Boson API
+#     cpu    the CPU time that thread used meanwhile (Linux; 0 elsewhere)
+#
+# The profile is saved under PROFILE_DIR as "<id>.json" (the call tree) and "<id>.folded"
+# (collapsed stacks for flame graph tools), and served by /profiles/<id>. Without
+# PROFILE_TOKEN set, or without the header, nothing is sampled. The generation scripts
+# take --profile PATH for the same profile of one run, and
+#
+#     python backend/profiling.py --out run.json TestingMultitalk/gen6.py
+#
+# profiles any script.
+
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".profiles"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+# Saved profiles beyond this many are deleted, oldest first
+PROFILE_MAX_SAVED = int(os.getenv("PROFILE_MAX_SAVED", "100"))
+
+PROFILE_HEADER = "X-Profile"
+
+
+def _thread_cpu_time(ident):
+    """ CPU seconds used by the thread with this ident, or None where that cannot be read. """
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(ident))
+    except (AttributeError, OSError, OverflowError):
+        return None
+
+
+def _node(name):
+    return {"name": name, "wall": 0.0, "cpu": 0.0, "children": {}}
+
+
+class Profiler:
+    """ Samples the stacks of some threads, or all of them, on a background thread.
+    Args:
+        interval (float): Seconds between samples.
+        all_threads (bool): Sample every thread instead of the watched ones.
+        label (str): What was profiled, e.g. the request path.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL, all_threads=False, label=""):
+        self.id = uuid.uuid4().hex
+        self.interval = interval
+        self.all_threads = all_threads
+        self.label = label
+        self.samples = 0
+        self.started_at = None
+        self.duration = None
+        self._root = _node("all")
+        self._watched = {}
+        self._cpu = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._sampler = None
+        self._started = None
+
+    def watch(self, ident=None):
+        """ Sample the calling thread, or the thread with this ident, until unwatch. """
+        ident = ident or threading.get_ident()
+        with self._lock:
+            self._watched[ident] = self._watched.get(ident, 0) + 1
+            self._cpu.setdefault(ident, _thread_cpu_time(ident))
+
+    def unwatch(self, ident=None):
+        ident = ident or threading.get_ident()
+        with self._lock:
+            self._watched[ident] -= 1
+            if not self._watched[ident]:
+                del self._watched[ident]
+
+    def start(self):
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self._sampler = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._sampler.start()
+        return self
+
+    def stop(self):
+        """ Stop sampling; later calls do nothing. """
+        if self._stopped.is_set():
+            return self
+        self._stopped.set()
+        if self._sampler is not threading.current_thread():
+            self._sampler.join()
+        self.duration = time.perf_counter() - self._started
+        return self
+
+    def _run(self):
+        sampler = threading.get_ident()
+        last = time.perf_counter()
+        while not self._stopped.wait(self.interval):
+            now = time.perf_counter()
+            elapsed, last = now - last, now
+            frames = sys._current_frames()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            with self._lock:
+                idents = [i for i in frames if i != sampler] if self.all_threads else list(self._watched)
+                for ident in idents:
+                    frame = frames.get(ident)
+                    if frame is None:
+                        continue
+                    cpu = _thread_cpu_time(ident)
+                    previous = self._cpu.get(ident)
+                    self._cpu[ident] = cpu
+                    used = cpu - previous if cpu is not None and previous is not None else 0.0
+                    self._add(names.get(ident, str(ident)), frame, elapsed, used)
+                self.samples += 1
+
+    def _add(self, thread_name, frame, wall, cpu):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+            frame = frame.f_back
+        node = self._root
+        node["wall"] += wall
+        node["cpu"] += cpu
+        for name in [f"thread {thread_name}", *reversed(stack)]:
+            child = node["children"].get(name)
+            if child is None:
+                child = node["children"][name] = _node(name)
+            child["wall"] += wall
+            child["cpu"] += cpu
+            node = child
+
+    def tree(self):
+        """ The call tree: name, wall and cpu seconds, self_wall and children, largest first. """
+
+        def export(node):
+            children = sorted(node["children"].values(), key=lambda child: child["wall"], reverse=True)
+            return dict(
+                name=node["name"],
+                wall=node["wall"],
+                cpu=node["cpu"],
+                self_wall=node["wall"] - sum(child["wall"] for child in children),
+                children=[export(child) for child in children],
+            )
+
+        with self._lock:
+            return export(self._root)
+
+    def folded(self):
+        """ Collapsed stacks, "frame;frame;frame microseconds" per line, for flame graphs. """
+        lines = []
+
+        def walk(node, path):
+            self_wall = node["wall"] - sum(child["wall"] for child in node["children"].values())
+            if path and self_wall > 0:
+                lines.append(f"{';'.join(path)} {int(self_wall * 1e6)}")
+            for child in node["children"].values():
+                walk(child, [*path, child["name"].replace(";", ":")])
+
+        with self._lock:
+            walk(self._root, [])
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self):
+        return dict(
+            profile_id=self.id,
+            label=self.label,
+            started_at=self.started_at,
+            duration=self.duration,
+            interval=self.interval,
+            samples=self.samples,
+            tree=self.tree(),
+        )
+
+    def save(self, path):
+        """ Write the profile to path (JSON) and the collapsed stacks next to it (.folded). """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f)
+        with open(f"{os.path.splitext(path)[0]}.folded", "w", encoding="utf-8") as f:
+            f.write(self.folded())
+        return path
+
+
+def authorized(headers):
+    """ Whether a request's headers carry the profiling token. """
+    if PROFILE_TOKEN is None:
+        return False
+    return hmac.compare_digest(headers.get(PROFILE_HEADER, "").encode("utf-8"), PROFILE_TOKEN.encode("utf-8"))
+
+
+def start_for_request(headers, label=""):
+    """ A started Profiler watching the calling thread if the request asked for one with
+    the right token, else None.
+    """
+    if not authorized(headers):
+        return None
+    profiler = Profiler(label=label).start()
+    profiler.watch()
+    return profiler
+
+
+def follow(fn, profiler):
+    """ fn, with the thread that runs it watched by profiler; fn itself if profiler is None. """
+    if profiler is None:
+        return fn
+
+    @functools.wraps(fn)
+    def watched(*args, **kwargs):
+        profiler.watch()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profiler.unwatch()
+
+    return watched
+
+
+def profile_path(profile_id, extension=".json", directory=PROFILE_DIR):
+    """ Where a saved profile is, or None for an id that is not one. """
+    if not profile_id.isalnum():
+        return None
+    return os.path.join(directory, f"{profile_id}{extension}")
+
+
+def save_profile(profiler, directory=PROFILE_DIR):
+    """ Save a request's profile under directory, then drop the oldest beyond PROFILE_MAX_SAVED. """
+    profiler.save(profile_path(profiler.id, directory=directory))
+    saved = sorted(
+        (entry for entry in os.scandir(directory) if entry.name.endswith(".json")),
+        key=lambda entry: entry.stat().st_mtime,
+    )
+    for entry in saved[:-PROFILE_MAX_SAVED]:
+        for extension in (".json", ".folded"):
+            try:
+                os.remove(profile_path(entry.name[:-len(".json")], extension, directory))
+            except FileNotFoundError:
+                pass
+
+
+def saved_profiles(directory=PROFILE_DIR):
+    """ (profile id, saved at) of the saved profiles, newest first. """
+    if not os.path.isdir(directory):
+        return []
+    saved = [
+        (entry.name[:-len(".json")], entry.stat().st_mtime)
+        for entry in os.scandir(directory) if entry.name.endswith(".json")
+    ]
+    return sorted(saved, key=lambda item: item[1], reverse=True)
+
+
+def profile_option(fn):
+    """ Give a click command a --profile PATH option that runs it under the profiler. Put
+    it straight under @click.command().
+    """
+
+    @click.option("--profile", "profile_to", type=str, default=None,
+                  help="Profile the run and save the call tree here (JSON), with a .folded file next to it.")
+    @functools.wraps(fn)
+    def profiled(*args, profile_to=None, **kwargs):
+        if profile_to is None:
+            return fn(*args, **kwargs)
+        profiler = Profiler(all_threads=True, label=" ".join(sys.argv)).start()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profiler.stop().save(profile_to)
+            print(f"Profile saved to {profile_to}")
+
+    return profiled
+
+
+@click.command(context_settings=dict(ignore_unknown_options=True))
+@click.option("--out", type=str, default="profile.json", help="Where to save the call tree (JSON).")
+@click.option("--interval", type=float, default=PROFILE_INTERVAL, help="Seconds between samples.")
+@click.argument("script", type=click.Path(exists=True))
+@click.argument("args", nargs=-1, type=click.UNPROCESSED)
+def main(out, interval, script, args):
+    """ Run SCRIPT with ARGS under the profiler. """
+    sys.argv = [script, *args]
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+    profiler = Profiler(interval=interval, all_threads=True, label=" ".join(sys.argv)).start()
+    try:
+        runpy.run_path(script, run_name="__main__")
+    except SystemExit:
+        pass
+    finally:
+        profiler.stop().save(out)
+        print(f"Profile saved to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import base64
+import json
+import os
+import threading
+from concurrent.futures import Future
+
+from audio_cache import request_key
+from boson import BOSON_MODEL
+from dispatch import get_dispatcher
+from fanout import render_chunks
+from pipeline import response_audio
+import tracing
+
+# Reference clips are sent base64-encoded with every request that uses the voice, and a
+# clip is often over a megabyte. Each clip is read and encoded once per process and kept
+# until the file changes; a render only pays for one stat call.
+
+_encoded = {}
+_encoded_lock = threading.Lock()
+
+# Voices generated from a description are stored under a hash of the request that made
+# them, next to a record of the description and settings. Concurrent requests for the
+# same voice wait on one generation instead of each calling the API.
+_voices_in_flight = {}
+_voices_lock = threading.Lock()
+
+VOICE_DIR = os.getenv("VOICE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".voices"))
+
+
+def _signature(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def encoded_reference(path):
+    """ The base64 text of a reference audio file, encoded at most once per version.
+    Args:
+        path (str): The audio file.
+
+    Returns:
+        data (str): The file's bytes, base64-encoded.
+    """
+    path = os.path.abspath(path)
+    signature = _signature(path)
+    entry = _encoded.get(path)
+    if entry is not None and entry[0] == signature:
+        return entry[1]
+
+    with open(path, "rb") as f:
+        data = base64.b64encode(f.read()).decode("utf-8")
+    # The file may have changed while it was read; only keep the result if it did not
+    if _signature(path) == signature:
+        with _encoded_lock:
+            _encoded[path] = (signature, data)
+    return data
+
+
+def reference_messages(transcript, path, audio_format="wav"):
+    """ A reference transcript/audio message pair, for pipeline.generation_request.
+    Args:
+        transcript (str): What is said in the clip, with its speaker tag, e.g. "[SPEAKER1] ...".
+        path (str): The clip.
+        audio_format (str): The clip's audio format.
+
+    Returns:
+        messages (list of dict): The user turn with the transcript and the assistant turn
+            with the clip, base64-encoded.
+    """
+    return [
+        {"role": "user", "content": transcript},
+        {"role": "assistant", "content": [{
+            "type": "input_audio",
+            "input_audio": {
+                "data": encoded_reference(path),
+                "format": audio_format,
+            },
+        }]},
+    ]
+
+
+def voice_request(speaker, voice_description, temperature=1.0, top_p=0.95, top_k=50, max_completion_tokens=1024):
+    """ Keyword arguments of chat.completions.create that speak a voice description. """
+    return dict(
+        model=BOSON_MODEL,
+        messages=[{"role": "user", "content": f"[{speaker}] {voice_description}"}],
+        modalities=["text", "audio"],
+        max_completion_tokens=max_completion_tokens,
+        temperature=temperature,
+        top_p=top_p,
+        stream=False,
+        stop=["<|eot_id|>", "<|end_of_text|>", "<|audio_eos|>"],
+        extra_body={"top_k": top_k},
+    )
+
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def reference_voice(client, speaker, voice_description, voice_dir, **sampling):
+    """ A reference clip for a described voice, generated once and then reused.
+    Args:
+        client (OpenAI): The Boson client, see boson.get_client.
+        speaker (str): The speaker tag the voice is introduced with, e.g. "SPEAKER1".
+        voice_description (str): e.g. "A warm, thoughtful woman with a soft British accent."
+        voice_dir (str): Where the clips and their records are kept.
+        **sampling: temperature, top_p, top_k or max_completion_tokens, see voice_request.
+
+    Returns:
+        audio_path (str): The WAV file. "<same name>.json" records the description and
+            settings that produced it.
+    """
+    request = voice_request(speaker, voice_description, **sampling)
+    key = request_key(request)
+    audio_path = os.path.join(voice_dir, f"{key}.wav")
+    if os.path.exists(audio_path):
+        return audio_path
+
+    with _voices_lock:
+        future = _voices_in_flight.get(audio_path)
+        owner = future is None
+        if owner:
+            future = _voices_in_flight[audio_path] = Future()
+    if not owner:
+        return future.result()
+
+    try:
+        # Another process, or a generation that just finished, may have written it
+        if not os.path.exists(audio_path):
+            audio_bytes = response_audio(get_dispatcher().call(client.chat.completions.create, **request))
+            os.makedirs(voice_dir, exist_ok=True)
+            record = {
+                "speaker": speaker,
+                "voice_description": voice_description,
+                "model": request["model"],
+                "temperature": request["temperature"],
+                "top_p": request["top_p"],
+                "top_k": request["extra_body"]["top_k"],
+                "max_completion_tokens": request["max_completion_tokens"],
+            }
+            # The record goes first, so every clip in the directory has one
+            _write_atomic(audio_path[:-len(".wav")] + ".json", json.dumps(record, indent=2).encode("utf-8"))
+            _write_atomic(audio_path, audio_bytes)
+        future.set_result(audio_path)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _voices_lock:
+            del _voices_in_flight[audio_path]
+    return audio_path
+
+
+def voice_record(audio_path):
+    """ The description and settings a clip from reference_voice was generated with. """
+    with open(audio_path[:-len(".wav")] + ".json", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def voice_messages(audio_path):
+    """ reference_messages for a clip from reference_voice, with the transcript it was
+    generated from read back from its record.
+    """
+    record = voice_record(audio_path)
+    return reference_messages(f"[{record['speaker']}] {record['voice_description']}", audio_path)
+
+
+def cast_references(client, speaker_desc, voice_dir=VOICE_DIR):
+    """ Reference messages for every described cast member, so each keeps one voice in
+    every chunk of a script. The first render with a description generates its clip; later
+    ones read it from voice_dir.
+    Args:
+        client (OpenAI): The Boson client, see boson.get_client.
+        speaker_desc (str): "SPEAKERn: description" lines, see pipeline.speaker_descriptions.
+        voice_dir (str): Where the clips and their records are kept.
+
+    Returns:
+        messages (list of dict): Transcript/audio pairs for pipeline.generation_request, in
+            speaker order; [] without descriptions.
+    """
+    voices = []
+    for line in speaker_desc.splitlines():
+        speaker, _, description = line.partition(":")
+        if speaker.strip() and description.strip():
+            voices.append((speaker.strip(), description.strip()))
+    messages = []
+    for pair in render_chunks(
+        voices,
+        tracing.bind(lambda voice: voice_messages(reference_voice(client, *voice, voice_dir))),
+        max_workers=len(voices),
+        key=lambda voice: len(voice[1]),
+    ):
+        messages.extend(pair)
+    return messages
@@ -0,0 +1,177 @@
+import os
+import threading
+import time
+from collections import deque
+
+from chunking import TURN_OVERHEAD_TOKENS, estimate_audio_tokens
+
+# Jobs are scheduled a chunk at a time, so a three-hour play never holds the workers for
+# longer than one chunk. Each time a worker frees up, the next chunk comes from:
+#
+# 1. the submitter who has received the least rendering so far (fair share: every
+#    submitter with work waiting gets an equal slice of the workers, however many jobs
+#    they queued), then
+# 2. that submitter's job with the least estimated work left (shortest job first, which
+#    keeps one-page scenes from waiting behind a play), with waiting time counted against
+#    the estimate so a long job is never starved, then
+# 3. that job's next chunk in script order.
+#
+# A long render is therefore preempted between chunks whenever shorter or fairer work
+# arrives, and resumes as soon as it is the best pick again.
+
+# Fixed cost of one request, in completion tokens: a round trip is worth a few seconds of audio
+CHUNK_OVERHEAD_TOKENS = 50
+# How many tokens of estimated work a job is let off per second it has waited
+SCHEDULER_AGING_RATE = float(os.getenv("SCHEDULER_AGING_RATE", "20"))
+# How many finished jobs the wait and makespan figures are taken over
+SCHEDULER_STATS_WINDOW = 256
+
+
+def chunk_cost(chunk):
+    """ Estimated cost of rendering one chunk, in completion tokens.
+    Counts its words, its speaker turns (one per line) and the request itself.
+    """
+    turns = chunk.count("\n") + 1
+    return estimate_audio_tokens(chunk) + (turns - 1) * TURN_OVERHEAD_TOKENS + CHUNK_OVERHEAD_TOKENS
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class _Entry:
+    """ A job in the scheduler: its chunks not dispatched yet and their cost. """
+
+    def __init__(self, job, costs, submitted_at):
+        self.job = job
+        self.costs = costs
+        self.pending = deque(range(len(costs)))
+        self.remaining = sum(costs)
+        self.submitted_at = submitted_at
+        self.first_dispatch_at = None
+        self.outstanding = 0
+        self.cancelled = False
+
+
+class FairScheduler:
+    """ Hands out chunks of jobs to render, see the notes above.
+    Jobs need an "id", a "submitter" and a "chunks" list of (scene_prompt, chunk) pairs.
+    Safe to share between threads.
+    """
+
+    def __init__(self, aging_rate=SCHEDULER_AGING_RATE):
+        self.aging_rate = aging_rate
+        self._changed = threading.Condition()
+        self._entries = {}
+        # Rendering received per submitter, in estimated tokens
+        self._service = {}
+        self._waits = deque(maxlen=SCHEDULER_STATS_WINDOW)
+        self._makespans = deque(maxlen=SCHEDULER_STATS_WINDOW)
+
+    def add(self, job):
+        """ Queue all of a job's chunks. A job must have at least one. """
+        costs = [chunk_cost(chunk) for _, chunk in job.chunks]
+        with self._changed:
+            entry = self._entries[job.id] = _Entry(job, costs, time.monotonic())
+            # A submitter coming back starts level with the others rather than with credit
+            # for the time they were away
+            active = [self._service[e.job.submitter] for e in self._entries.values() if e is not entry]
+            floor = min(active) if active else 0
+            self._service[job.submitter] = max(self._service.get(job.submitter, 0), floor)
+            # One idle worker per chunk, so a job's chunks start side by side
+            self._changed.notify(len(costs))
+
+    @property
+    def pending_jobs(self):
+        """ How many jobs have not had a chunk dispatched yet. """
+        with self._changed:
+            return sum(1 for entry in self._entries.values() if entry.first_dispatch_at is None)
+
+    def _pick(self):
+        waiting = [entry for entry in self._entries.values() if entry.pending]
+        if not waiting:
+            return None
+        now = time.monotonic()
+        submitter = min({entry.job.submitter for entry in waiting}, key=lambda s: self._service[s])
+        return min(
+            (entry for entry in waiting if entry.job.submitter == submitter),
+            key=lambda entry: (entry.remaining - self.aging_rate * (now - entry.submitted_at), entry.submitted_at),
+        )
+
+    def next(self, timeout=None):
+        """ The next chunk to render, waiting for one if there is none.
+        Returns:
+            (job, i, waited): Render job.chunks[i], then call done(job, i). waited is how
+                long the chunk waited for a worker, in seconds since its job was queued.
+                None on timeout.
+        """
+        with self._changed:
+            if not self._changed.wait_for(lambda: self._pick() is not None, timeout):
+                return None
+            entry = self._pick()
+            i = entry.pending.popleft()
+            entry.remaining -= entry.costs[i]
+            entry.outstanding += 1
+            self._service[entry.job.submitter] += entry.costs[i]
+            waited = time.monotonic() - entry.submitted_at
+            if entry.first_dispatch_at is None:
+                entry.first_dispatch_at = entry.submitted_at + waited
+                self._waits.append(waited)
+            return entry.job, i, waited
+
+    def done(self, job, i):
+        """ Report chunk i of job as finished.
+        Returns:
+            finished (bool): Whether that was the job's last chunk.
+        """
+        with self._changed:
+            entry = self._entries.get(job.id)
+            if entry is None:
+                return False
+            entry.outstanding -= 1
+            if entry.pending or entry.outstanding:
+                return False
+            self._remove(entry)
+            if entry.cancelled:
+                return False
+            self._makespans.append(time.monotonic() - entry.submitted_at)
+            return True
+
+    def cancel(self, job):
+        """ Drop a job's chunks that were not dispatched yet, e.g. after one of them failed. """
+        with self._changed:
+            entry = self._entries.get(job.id)
+            if entry is None:
+                return
+            entry.pending.clear()
+            entry.remaining = 0
+            entry.cancelled = True
+            if not entry.outstanding:
+                self._remove(entry)
+
+    def _remove(self, entry):
+        # A submitter with nothing left queued is forgotten; add() starts them level with
+        # the others when they come back
+        submitter = entry.job.submitter
+        del self._entries[entry.job.id]
+        if all(other.job.submitter != submitter for other in self._entries.values()):
+            del self._service[submitter]
+
+    def stats(self):
+        """ Queue wait (submission to first chunk) and makespan (submission to last chunk)
+        of recent jobs, in seconds.
+        """
+        with self._changed:
+            waits, makespans = list(self._waits), list(self._makespans)
+        return dict(
+            jobs_measured=len(makespans),
+            queue_wait_p50=_percentile(waits, 0.5),
+            queue_wait_p95=_percentile(waits, 0.95),
+            queue_wait_max=max(waits, default=None),
+            makespan_p50=_percentile(makespans, 0.5),
+            makespan_p95=_percentile(makespans, 0.95),
+            makespan_max=max(makespans, default=None),
+        )
@@ -0,0 +1,355 @@
+import re
+from array import array
+from bisect import bisect_left
+from functools import cached_property, partial
+from itertools import chain, islice
+from operator import itemgetter
+from typing import NamedTuple
+
+from normalizer import SPEAKER_ID_END, SPEAKER_ID_START
+
+# "[SPEAKER1]" as written in a script, or the same tag after normalize_transcript rewrote its brackets
+SPEAKER_TAG_PATTERN = re.compile(
+    r"(?:\[|" + re.escape(SPEAKER_ID_START) + r")(?P<speaker>SPEAKER\d+)(?:\]|" + re.escape(SPEAKER_ID_END) + r")\s*"
+)
+
+# What prepare_chunk_text(chunk_method="speaker") treats as the start of a speaker chunk
+SPEAKER_CHUNK_PREFIXES = ("[SPEAKER", SPEAKER_ID_START)
+
+SETTING_HEADER = "SETTING:"
+
+# A newline followed by a line opening with one of SPEAKER_CHUNK_PREFIXES
+_SPEAKER_CHUNK_LINE = re.compile(
+    r"\n(?=[^\S\n]*(?:" + "|".join(re.escape(prefix) for prefix in SPEAKER_CHUNK_PREFIXES) + "))"
+)
+_NEWLINE = re.compile("\n")
+# A newline with whitespace on either side; anchored on the newline so the scan stays fast
+_LINE_EDGE_SPACE = re.compile(r"\n(?:[^\S\n]|(?<=[^\S\n]\n))")
+
+# A speaker tag opening a line, and the whitespace after it
+_TAG_LINE = (
+    r"(?:\[|" + re.escape(SPEAKER_ID_START) + r")(?P<speaker>SPEAKER\d+)(?:\]|" + re.escape(SPEAKER_ID_END) + r")[^\S\n]*"
+)
+_BLANK_LINE = r"\n[^\S\n]*(?=\n|\Z)"
+
+
+def _turn_patterns(actor_names):
+    """ (pattern for a turn opening on the first line, pattern for a newline and a turn
+    opening on the line after it). A turn opens with an actor name line or a speaker tag,
+    and the group "speech" spans the lines of speech after it. The second pattern starts
+    with a literal newline, so the regex engine skips ahead from line to line instead of
+    trying every offset, and the speech lines are matched without a Python step per line.
+    """
+    header = ""
+    if actor_names:
+        header = "(?:" + "|".join(re.escape(name) for name in sorted(actor_names, key=len, reverse=True)) + r")(?=\n|\Z)"
+    tag = _TAG_LINE.replace("(?P<speaker>", "(?:")
+    # What ends the speech of a turn: an actor name, a tag, a SETTING line or a blank line
+    # (that one only under an actor name; after a tag, speech runs on across blank lines)
+    stop = "|".join([*([header] if header else []), tag, re.escape(SETTING_HEADER) + r"(?=\n|\Z)", r"[^\S\n]*(?:\n|\Z)"])
+    # Most lines open with a character no stop line can open with, which is one check
+    openers = "".join(sorted({re.escape(name[:1]) for name in actor_names or ()} | {"[", "<", SETTING_HEADER[0]}))
+    speech_line = rf"\n(?:(?=[^\s{openers}])|(?!{stop}))[^\n]*"
+    turns = [
+        rf"{_TAG_LINE}(?:(?:(?=\S)|(?:{_BLANK_LINE})*\n(?!{stop}))(?P<tag_speech>[^\n]*(?:(?:{_BLANK_LINE})*{speech_line})*))?",
+    ]
+    if header:
+        turns.append(rf"(?P<header>{header})(?:\n(?!{stop})(?P<speech>[^\n]*(?:{speech_line})*))?")
+    body = "(?P<newline>)(?:" + "|".join(turns) + ")"
+    return re.compile(body), re.compile("\n" + body)
+
+
+class Turn(NamedTuple):
+    """ One speaker turn, stored as offsets into the script it was parsed from.
+    Args:
+        speaker (str): The speaker tag, e.g. "SPEAKER1".
+        start (int): Offset of the first character of speech.
+        end (int): Offset one past the last character of speech.
+    """
+    speaker: str
+    start: int
+    end: int
+
+    def text(self, script):
+        return script[self.start:self.end]
+
+    def lines(self, script):
+        """ The non-blank lines of the turn, stripped. """
+        return [line.strip() for line in self.text(script).split("\n") if line.strip()]
+
+
+class SettingBlock(NamedTuple):
+    """ A "SETTING:" line and the scene description under it, up to the next blank line,
+    "SETTING:" line or actor name line.
+    Args:
+        start (int): Offset of the "SETTING:" line.
+        text_start (int): Offset of the first line of the description.
+        end (int): Offset of the line closing the block, or the script length.
+    """
+    start: int
+    text_start: int
+    end: int
+
+    def text(self, script):
+        return script[self.text_start:self.end - 1] if self.end > self.text_start else ""
+
+
+class ScriptIndex:
+    """ Offsets of the lines, SETTING blocks, actor headers and turns of a script.
+
+    Everything is stored as offsets into self.script and text is only sliced out when a
+    caller asks for it, so scene extraction, dialogue extraction and chunking can share
+    one index instead of each splitting the script again. Each part is found on first
+    use: SETTING blocks, line starts and speaker chunks with str.find / regex scans,
+    actor headers and turns together in one regex scan with one match per turn.
+
+    Args:
+        script (str): The script text.
+        actor_speaker (dictionary): Maps actor names to their speaker tags. Optional.
+    """
+
+    def __init__(self, script, actor_speaker=None):
+        self.script = script
+        self.actor_speaker = actor_speaker or {}
+        self._actor_headers = None
+        self._turns = None
+
+    @cached_property
+    def setting_blocks(self):
+        script = self.script
+        headers = []
+        pos = 0
+        while True:
+            start = script.find(SETTING_HEADER, pos)
+            if start == -1:
+                break
+            pos = start + len(SETTING_HEADER)
+            if (start == 0 or script[start - 1] == "\n") and (pos == len(script) or script[pos] == "\n"):
+                headers.append(start)
+
+        blocks = []
+        for start, next_start in zip(headers, headers[1:] + [-1]):
+            header_end = start + len(SETTING_HEADER)
+            blank = script.find("\n\n", header_end, len(script) if next_start == -1 else next_start)
+            if blank != -1:
+                end = blank + 1
+            elif next_start != -1:
+                end = next_start  # the next SETTING: line opens a new scene
+            elif script.endswith("\n") and header_end < len(script):
+                end = len(script)  # the empty last line closes the block
+            else:
+                end = len(script) + 1  # no blank line, the block runs to the end
+            text_start = min(header_end + 1, len(script))
+            if self.actor_speaker:
+                end = self._first_actor_header(text_start, end)
+            blocks.append(SettingBlock(start, text_start, end))
+        return blocks
+
+    def _first_actor_header(self, start, end):
+        # Normalized scripts have no blank line after the description, so the first actor
+        # name line closes the block instead
+        match = self._actor_header_line.search(self.script, start - 1, end)
+        return end if match is None else match.start() + 1
+
+    @cached_property
+    def _turn_patterns(self):
+        return _turn_patterns(self.actor_speaker)
+
+    @cached_property
+    def _actor_header_line(self):
+        # A newline and an actor name alone on the line after it
+        names = "|".join(re.escape(name) for name in sorted(self.actor_speaker, key=len, reverse=True))
+        return re.compile(f"\n(?:{names})(?=\n|\Z)")
+
+    @cached_property
+    def line_starts(self):
+        line_starts = array("q", [0])
+        line_starts.extend(match.end() for match in _NEWLINE.finditer(self.script))
+        return line_starts
+
+    @property
+    def actor_headers(self):
+        """ (offset, speaker tag) of every actor name line. """
+        if self._actor_headers is None:
+            self._scan()
+        return self._actor_headers
+
+    @property
+    def turns(self):
+        if self._turns is None:
+            self._scan()
+        return self._turns
+
+    def _scan(self):
+        # One regex match per turn: the regex engine steps over the lines of speech, and
+        # only the offsets of each turn are looked at here
+        script = self.script
+        headers = self.actor_speaker
+        first_turn, next_turn = self._turn_patterns
+        actor_headers = []
+        turns = []
+        add_turn = turns.append
+        # Turn(...) without the generated __new__, which is a Python call per turn
+        make_turn = partial(tuple.__new__, Turn)
+        groups = next_turn.groupindex
+        newline, speaker_group, tag_speech = groups["newline"], groups["speaker"], groups["tag_speech"]
+        header_group, speech = groups.get("header", len(groups) + 1), groups.get("speech")
+        # SETTING blocks are not anybody's speech; turns opening inside one are skipped
+        settings = iter(self.setting_blocks)
+        no_setting = (len(script) + 2,) * 3
+        skip_from, skip_to = next(settings, no_setting)[::2]
+
+        first = first_turn.match(script)
+        for match in chain((first,) if first else (), next_turn.finditer(script, first.end() if first else 0)):
+            line_start = match.end(newline)
+            while line_start >= skip_to:
+                skip_from, skip_to = next(settings, no_setting)[::2]
+            if line_start >= skip_from:
+                continue
+            if match.lastindex >= header_group:
+                speaker = headers[match[header_group]]
+                actor_headers.append((line_start, speaker))
+                start, end = match.span(speech)
+            else:
+                speaker = match[speaker_group]
+                start, end = match.span(tag_speech)
+            if start >= 0:
+                add_turn(make_turn((speaker, start, end)))
+        self._actor_headers, self._turns = actor_headers, turns
+
+    @property
+    def num_lines(self):
+        return len(self.line_starts)
+
+    def line(self, index):
+        line_starts = self.line_starts
+        end = line_starts[index + 1] - 1 if index + 1 < len(line_starts) else len(self.script)
+        return self.script[line_starts[index]:end]
+
+    def scene_description(self):
+        """ Same contract as extract_scene_description, for the first SETTING block.
+        Returns:
+            scene_prompt (str): The extracted scene description.
+            scene_prompt_given (bool): Whether a scene description was found.
+            remaining_transcript (str): The transcript after the scene description.
+        """
+        if not self.setting_blocks:
+            return "", False, self.script
+        block = self.setting_blocks[0]
+        return block.text(self.script).strip(), True, self.script[block.end:].strip()
+
+    def scenes(self):
+        """ Split the script into one scene per SETTING block.
+
+        Text before the first SETTING block is a scene of its own with an empty prompt.
+        A description ends at the blank line closing its block, or at the first speaker
+        tag or character cue line inside it. Normalized scripts have no blank lines left,
+        so a description that nothing closes is its first line only, and the rest of the
+        block is the scene's text. A description with no text after it is read out as
+        the scene's text.
+
+        Returns:
+            scenes (list of (str, str)): (scene_prompt, transcript) pairs in script order.
+                Scenes with neither a prompt nor any text are dropped.
+        """
+        # cast imports this module for SETTING_HEADER
+        from cast import parse_cue
+
+        script = self.script
+        blocks = self.setting_blocks
+        chunk_starts = self.speaker_chunk_starts
+        scenes = []
+        head = script[:blocks[0].start if blocks else len(script)].strip()
+        if head:
+            scenes.append(("", head))
+        for i, block in enumerate(blocks):
+            scene_end = blocks[i + 1].start if i + 1 < len(blocks) else len(script)
+            text_end = min(block.end, scene_end)
+            # A block that stops short of the next scene was closed by a blank line or an actor name
+            closed = block.end < scene_end
+            first_tag = bisect_left(chunk_starts, block.text_start)
+            if first_tag < len(chunk_starts) and chunk_starts[first_tag] < text_end:
+                text_end, closed = chunk_starts[first_tag], True
+
+            # Walk the description's lines by offset, up to the first cue
+            pos = block.text_start
+            first_line_end = None
+            while pos < text_end:
+                newline = script.find("\n", pos, text_end)
+                line_end = text_end if newline == -1 else newline
+                if first_line_end is None:
+                    first_line_end = min(line_end + 1, text_end)
+                if parse_cue(script[pos:line_end].strip()):
+                    text_end, closed = pos, True
+                    break
+                pos = line_end + 1
+            if not closed and first_line_end is not None:
+                text_end = first_line_end
+
+            scene_prompt = script[block.text_start:text_end].strip()
+            transcript = script[text_end:scene_end].strip()
+            if not transcript:
+                scene_prompt, transcript = "", scene_prompt
+            if transcript:
+                scenes.append((scene_prompt, transcript))
+        return scenes
+
+    @property
+    def body_start(self):
+        """ Offset where the dialogue starts: after the first SETTING block, if any. """
+        if not self.setting_blocks:
+            return 0
+        return min(self.setting_blocks[0].end, len(self.script))
+
+    def dialogue(self, start=0):
+        """ The turns beginning at or after offset start, one "[SPEAKERn]line" per line. """
+        script = self.script
+        turns = self.turns
+        # Turns are in script order, so the ones before start are a prefix
+        first = bisect_left(turns, start, key=itemgetter(1))
+        return "\n".join([
+            f"[{speaker}]" + script[turn_start:turn_end].replace("\n", f"\n[{speaker}]")
+            for speaker, turn_start, turn_end in islice(turns, first, None)
+        ])
+
+    @cached_property
+    def speaker_chunk_starts(self):
+        """ Offsets of the lines prepare_chunk_text(chunk_method="speaker") starts a chunk at. """
+        return [match.end() for match in _SPEAKER_CHUNK_LINE.finditer(self.script)]
+
+    def speaker_chunks(self):
+        """ The chunks prepare_chunk_text(chunk_method="speaker") splits the script into. """
+        script = self.script
+        # Dialogue as written out by dialogue() has a tag on every line: each line is a chunk
+        if script.startswith(SPEAKER_CHUNK_PREFIXES) and script.count("\n") == sum(
+            script.count("\n" + prefix) for prefix in SPEAKER_CHUNK_PREFIXES
+        ):
+            return list(map(str.strip, script.split("\n")))
+        chunks = _SPEAKER_CHUNK_LINE.split(script)
+        # Each line used to be stripped on its own; only redo that, chunk by chunk, for the
+        # chunks with whitespace around an inner line break
+        if _LINE_EDGE_SPACE.search(script):
+            chunks = [
+                "\n".join(line.strip() for line in chunk.split("\n")) if _LINE_EDGE_SPACE.search(chunk) else chunk
+                for chunk in chunks
+            ]
+        return [chunk for chunk in map(str.strip, chunks) if chunk]
+
+def parse_turns(script, actor_speaker=None):
+    """ Split a script into speaker turns in a single scan of the script.
+
+    Two layouts are understood, and may be mixed:
+      - an actor name from actor_speaker alone on a line, followed by that actor's lines
+        up to the next blank line or actor name;
+      - a [SPEAKERn] tag, either alone on a line or in front of the first line of speech,
+        followed by lines up to the next tag or actor name. Blank lines do not end these turns.
+    SETTING: blocks are skipped.
+
+    Args:
+        script (str): The script text (excluding scene description).
+        actor_speaker (dictionary): Maps actor names to their speaker tags. Optional.
+
+    Returns:
+        turns (list of Turn): The turns in script order. Turns with no speech are dropped.
+    """
+    return ScriptIndex(script, actor_speaker).turns
@@ -0,0 +1,25 @@
+import os
+import sys
+import tempfile
+
+# The backend modules import each other by name, from the backend directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_data_dir = None
+
+
+def pytest_configure(config):
+    # The backend reads its directories and endpoint when a module is imported, so they are
+    # pointed at a scratch directory and a closed port before any test imports one
+    global _data_dir
+    _data_dir = tempfile.TemporaryDirectory()
+    for name in ("AUDIO_CACHE_DIR", "JOB_DIR", "PROFILE_DIR", "VOICE_DIR"):
+        os.environ[name] = os.path.join(_data_dir.name, name.lower())
+    os.environ["BOSON_BASE_URL"] = "http://127.0.0.1:9/v1"
+    os.environ.setdefault("BOSON_API_KEY", "test")
+    os.environ.pop("TRACE_FILE", None)
+
+
+def pytest_unconfigure(config):
+    if _data_dir is not None:
+        _data_dir.cleanup()
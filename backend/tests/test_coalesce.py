@@ -0,0 +1,139 @@
+import io
+import threading
+
+import pytest
+
+from coalesce import IdempotencyConflict, RenderRegistry, render_fingerprint
+from mock_boson import pcm_to_wav, synthetic_pcm
+
+
+class FakeRender:
+    """ A results callable for RenderRegistry.render that counts how often it is called and
+    holds its results back until released.
+    """
+
+    def __init__(self, parts=("a", "b")):
+        self.parts = parts
+        self.calls = 0
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        return self._results()
+
+    def _results(self):
+        self.release.wait(5)
+        yield from self.parts
+
+
+def test_fingerprint_depends_on_chunks_voices_and_settings():
+    chunks = [("", "[SPEAKER1] Hello there.")]
+    fingerprint = render_fingerprint(chunks, "SPEAKER1: a low voice", "model")
+    assert fingerprint == render_fingerprint([list(chunks[0])], "SPEAKER1: a low voice", "model")
+    assert fingerprint != render_fingerprint(chunks, "SPEAKER1: a high voice", "model")
+    assert fingerprint != render_fingerprint(chunks, "SPEAKER1: a low voice", "other-model")
+
+
+def test_identical_requests_share_the_render_in_flight():
+    registry = RenderRegistry()
+    results = FakeRender()
+    first = registry.render("fp", results)
+    second = registry.render("fp", results)
+    assert first is second
+    results.release.set()
+    assert list(first) == list(second) == ["a", "b"]
+    assert results.calls == 1
+
+
+def test_finished_render_is_not_joined_without_a_key():
+    registry = RenderRegistry()
+    results = FakeRender()
+    results.release.set()
+    assert list(registry.render("fp", results)) == ["a", "b"]
+    assert list(registry.render("fp", results)) == ["a", "b"]
+    assert results.calls == 2
+
+
+def test_repeated_key_replays_the_finished_render():
+    registry = RenderRegistry()
+    results = FakeRender()
+    results.release.set()
+    first = registry.render("fp", results, "key-1", "client")
+    assert list(first) == ["a", "b"]
+    assert registry.render("fp", results, "key-1", "client") is first
+    assert results.calls == 1
+
+
+def test_key_reused_for_another_request_is_refused():
+    registry = RenderRegistry()
+    registry.render("fp", FakeRender(), "key-1", "client")
+    with pytest.raises(IdempotencyConflict):
+        registry.render("other-fp", FakeRender(), "key-1", "client")
+
+
+def test_keys_are_scoped_per_client():
+    registry = RenderRegistry()
+    first = FakeRender()
+    first.release.set()
+    list(registry.render("fp", first, "key-1", "client-a"))
+    second = FakeRender()
+    second.release.set()
+    assert list(registry.render("other-fp", second, "key-1", "client-b")) == ["a", "b"]
+    assert second.calls == 1
+
+
+def test_failed_render_is_retried_not_replayed():
+    registry = RenderRegistry()
+
+    def failing():
+        raise RuntimeError("boom")
+        yield
+
+    failed = registry.render("fp", failing, "key-1", "client")
+    with pytest.raises(RuntimeError):
+        list(failed)
+    results = FakeRender()
+    results.release.set()
+    assert list(registry.render("fp", results, "key-1", "client")) == ["a", "b"]
+    assert results.calls == 1
+
+
+@pytest.fixture
+def client(monkeypatch):
+    import app
+
+    renders = []
+
+    def fake_render(client, chunks, speaker_desc, trace, profiler=None):
+        renders.append(chunks)
+        return [pcm_to_wav(synthetic_pcm(chunk)) for _, chunk in chunks]
+
+    monkeypatch.setattr(app, "renders", RenderRegistry())
+    monkeypatch.setattr(app, "traced_render", fake_render)
+    test_client = app.app.test_client()
+    test_client.renders = renders
+    return test_client
+
+
+def upload(client, text, key=None):
+    headers = {"Idempotency-Key": key} if key else {}
+    return client.post(
+        "/generate_audio", data={"file": (io.BytesIO(text.encode()), "play.txt")}, headers=headers,
+        content_type="multipart/form-data", buffered=True,
+    )
+
+
+def test_generate_audio_replays_a_repeated_key(client):
+    first = upload(client, "[SPEAKER1] Now is the winter of our discontent.", key="key-1")
+    second = upload(client, "[SPEAKER1] Now is the winter of our discontent.", key="key-1")
+    assert first.status_code == second.status_code == 200
+    assert first.data == second.data
+    assert len(client.renders) == 1
+
+
+def test_generate_audio_answers_422_for_a_reused_key(client):
+    assert upload(client, "[SPEAKER1] Now is the winter of our discontent.", key="key-1").status_code == 200
+    response = upload(client, "[SPEAKER1] Made glorious summer by this sun of York.", key="key-1")
+    assert response.status_code == 422
+    assert "Idempotency-Key" in response.get_json()["error"]
+    assert len(client.renders) == 1
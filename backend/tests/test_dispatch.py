@@ -0,0 +1,146 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+import dispatch
+from dispatch import Dispatcher, retry_reason
+from metrics import exposition
+
+REQUEST = httpx.Request("POST", "http://127.0.0.1:9/v1/chat/completions")
+RESULT = SimpleNamespace(usage=SimpleNamespace(completion_tokens=100))
+
+
+def status_error(cls, status, retry_after=None):
+    headers = {"retry-after": retry_after} if retry_after is not None else {}
+    return cls(f"HTTP {status}", response=httpx.Response(status, request=REQUEST, headers=headers), body=None)
+
+
+class FlakyCall:
+    """ Raises the given errors one per call, then returns RESULT. """
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return RESULT
+
+
+def metric_value(sample):
+    for line in exposition().splitlines():
+        if line.startswith(sample + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """ The backoff delays the dispatcher sleeps for, without sleeping. """
+    delays = []
+    monkeypatch.setattr(dispatch.time, "sleep", delays.append)
+    return delays
+
+
+def test_retry_reasons():
+    assert retry_reason(status_error(openai.RateLimitError, 429)) == "throttled"
+    assert retry_reason(openai.APITimeoutError(request=REQUEST)) == "timeout"
+    assert retry_reason(openai.APIConnectionError(request=REQUEST)) == "connection"
+    assert retry_reason(status_error(openai.InternalServerError, 503)) == "server_error"
+    assert retry_reason(status_error(openai.BadRequestError, 400)) is None
+    assert retry_reason(ValueError("not an API error")) is None
+
+
+def test_throttled_call_is_retried_after_retry_after(sleeps):
+    dispatcher = Dispatcher(rate=1000, burst=10)
+    retries_before = metric_value("tts_boson_retries_total")
+    call = FlakyCall(status_error(openai.RateLimitError, 429, "1.5"), status_error(openai.RateLimitError, 429, "0"))
+
+    assert dispatcher.call(call) is RESULT
+    assert call.calls == 3
+    assert sleeps == [1.5, 0.0]
+    stats = dispatcher.stats()
+    assert (stats["calls"], stats["succeeded"], stats["failed"]) == (1, 1, 0)
+    assert (stats["retries"], stats["throttled"], stats["backoff_seconds"]) == (2, 2, 1.5)
+    assert metric_value("tts_boson_retries_total") == retries_before + 2
+
+
+def test_backoff_is_jittered_and_exponential(sleeps):
+    dispatcher = Dispatcher(rate=1000, burst=10, max_retries=4)
+    call = FlakyCall(openai.APITimeoutError(request=REQUEST), openai.APIConnectionError(request=REQUEST),
+                     openai.APITimeoutError(request=REQUEST))
+
+    assert dispatcher.call(call) is RESULT
+    assert len(sleeps) == 3
+    for attempt, delay in enumerate(sleeps):
+        assert 0 <= delay <= dispatch.BACKOFF_BASE * 2 ** attempt
+    stats = dispatcher.stats()
+    assert (stats["timeout"], stats["connection"]) == (2, 1)
+    assert stats["backoff_seconds"] == pytest.approx(sum(sleeps))
+
+
+def test_gives_up_after_max_retries(sleeps):
+    dispatcher = Dispatcher(rate=1000, burst=10, max_retries=2)
+    call = FlakyCall(*[status_error(openai.InternalServerError, 500, "0")] * 5)
+
+    with pytest.raises(openai.InternalServerError):
+        dispatcher.call(call)
+    assert call.calls == 3
+    stats = dispatcher.stats()
+    assert (stats["failed"], stats["retries"], stats["server_error"]) == (1, 2, 3)
+
+
+def test_other_errors_are_not_retried(sleeps):
+    dispatcher = Dispatcher(rate=1000, burst=10)
+    call = FlakyCall(status_error(openai.BadRequestError, 400))
+
+    with pytest.raises(openai.BadRequestError):
+        dispatcher.call(call)
+    assert call.calls == 1
+    assert sleeps == []
+    assert dispatcher.stats()["retries"] == 0
+
+
+def test_errors_halve_the_concurrency_limit_and_successes_raise_it(sleeps):
+    dispatcher = Dispatcher(rate=1000, burst=10, min_concurrency=1, max_concurrency=16, initial_concurrency=8)
+    dispatcher.call(FlakyCall(status_error(openai.RateLimitError, 429, "0")))
+    # Halved by the 429, then a quarter step up for the success
+    assert dispatcher.limit == pytest.approx(4.25)
+    for _ in range(20):
+        dispatcher.call(FlakyCall())
+    assert dispatcher.stats()["concurrency_limit"] > 4
+
+
+def test_requests_are_spaced_out_by_the_rate_limit():
+    dispatcher = Dispatcher(rate=20, burst=1)
+    started = time.monotonic()
+    for _ in range(4):
+        dispatcher.call(FlakyCall())
+    # The first call takes the burst token; each of the others waits about 1 / rate
+    assert time.monotonic() - started >= 0.12
+    assert dispatcher.stats()["rate_wait_seconds"] >= 0.12
+
+
+def test_async_calls_are_retried_too(monkeypatch):
+    delays = []
+
+    async def no_sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(dispatch.asyncio, "sleep", no_sleep)
+    dispatcher = Dispatcher(rate=1000, burst=10)
+    call = FlakyCall(status_error(openai.RateLimitError, 429, "2"))
+
+    async def call_async():
+        return call()
+
+    assert asyncio.run(dispatcher.call_async(call_async)) is RESULT
+    assert call.calls == 2
+    assert delays == [2.0]
+    assert dispatcher.stats()["retries"] == 1
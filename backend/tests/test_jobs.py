@@ -0,0 +1,123 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from audio import concat_wav
+from jobs import CHUNK_DONE, DONE, FAILED, QUEUED, JobQueue, QueueFull
+from mock_boson import pcm_to_wav, synthetic_pcm
+
+CHUNKS = [("", "[SPEAKER1] Friends, Romans, countrymen."), ("", "[SPEAKER1] Lend me your ears."),
+          ("A street.", "[SPEAKER2] I come to bury Caesar, not to praise him.")]
+
+
+def render_chunk(job, i):
+    return pcm_to_wav(synthetic_pcm(job.chunks[i][1]))
+
+
+def wait_finished(queue, job_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job is not None and job.finished:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def read_status(directory, job_id):
+    with open(os.path.join(directory, f"{job_id}.status.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_job_renders_every_chunk_and_stitches_them(tmp_path):
+    queue = JobQueue(render_chunk, directory=str(tmp_path), workers=2).start()
+    job = wait_finished(queue, queue.submit(CHUNKS, "SPEAKER1: low", "client").id)
+
+    assert job.status == DONE
+    assert job.chunk_status == [CHUNK_DONE] * len(CHUNKS)
+    assert all(seconds is not None and seconds >= 0 for seconds in job.queue_seconds)
+    with open(queue.result_path(job), "rb") as f:
+        assert f.read() == concat_wav(render_chunk(job, i) for i in range(len(CHUNKS)))
+    assert read_status(tmp_path, job.id)["status"] == DONE
+
+
+def test_failed_chunk_cancels_the_rest_of_the_job(tmp_path):
+    rendered = []
+
+    def render(job, i):
+        rendered.append(i)
+        raise RuntimeError(f"chunk {i} failed")
+
+    queue = JobQueue(render, directory=str(tmp_path), workers=1).start()
+    job = wait_finished(queue, queue.submit(CHUNKS, "", "client").id)
+
+    assert job.status == FAILED
+    assert job.error == "chunk 0 failed"
+    assert rendered == [0]
+    assert not os.path.exists(queue.result_path(job))
+
+
+def test_chunks_failing_together_keep_the_first_error(tmp_path):
+    both_started = threading.Barrier(2)
+
+    def render(job, i):
+        both_started.wait(5)
+        raise RuntimeError(f"chunk {i} failed")
+
+    queue = JobQueue(render, directory=str(tmp_path), workers=2).start()
+    job = wait_finished(queue, queue.submit(CHUNKS[:2], "", "client").id)
+    # The second failure must not overwrite the first, in memory or on disk
+    time.sleep(0.1)
+
+    assert job.status == FAILED
+    assert job.error in ("chunk 0 failed", "chunk 1 failed")
+    status = read_status(tmp_path, job.id)
+    assert (status["status"], status["error"], status["finished_at"]) == (job.status, job.error, job.finished_at)
+
+
+def test_unfinished_jobs_resume_after_a_restart(tmp_path):
+    before = JobQueue(render_chunk, directory=str(tmp_path), workers=1).start()
+    finished = wait_finished(before, before.submit(CHUNKS[:1], "", "client").id)
+    # Never started, like a server that stopped before rendering the job
+    stopped = JobQueue(render_chunk, directory=str(tmp_path))
+    unfinished = stopped.submit(CHUNKS, "SPEAKER1: low", "client")
+    assert unfinished.status == QUEUED
+
+    rendered = []
+
+    def render(job, i):
+        rendered.append((job.id, i))
+        return render_chunk(job, i)
+
+    after = JobQueue(render, directory=str(tmp_path), workers=2).start()
+    resumed = wait_finished(after, unfinished.id)
+
+    assert resumed.status == DONE
+    assert (resumed.chunks, resumed.speaker_desc, resumed.created_at) == (
+        unfinished.chunks, unfinished.speaker_desc, unfinished.created_at)
+    assert sorted(rendered) == [(unfinished.id, i) for i in range(len(CHUNKS))]
+    assert after.get(finished.id).status == DONE
+    assert os.path.exists(after.result_path(resumed))
+
+
+def test_expired_jobs_are_removed_on_start(tmp_path):
+    before = JobQueue(render_chunk, directory=str(tmp_path), workers=1).start()
+    job = wait_finished(before, before.submit(CHUNKS[:1], "", "client").id)
+
+    after = JobQueue(render_chunk, directory=str(tmp_path), retention=0).start()
+
+    assert after.get(job.id) is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_submit_refuses_jobs_beyond_the_queue_depth(tmp_path):
+    queue = JobQueue(render_chunk, directory=str(tmp_path), max_queued=1)
+    kept = queue.submit(CHUNKS, "", "client")
+    with pytest.raises(QueueFull):
+        queue.submit(CHUNKS, "", "client")
+
+    assert queue.depth == 1
+    assert sorted(os.listdir(tmp_path)) == [f"{kept.id}.json"]
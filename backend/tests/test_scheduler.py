@@ -0,0 +1,123 @@
+import threading
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+from scheduler import FairScheduler, chunk_cost
+
+SHORT = "[SPEAKER1] Out, damned spot."
+LONG = "[SPEAKER1] " + " ".join(["To-morrow, and to-morrow, and to-morrow, creeps in this petty pace."] * 20)
+
+
+def make_job(job_id, submitter, *chunks):
+    return SimpleNamespace(id=job_id, submitter=submitter, chunks=[("", chunk) for chunk in chunks])
+
+
+def drain(scheduler):
+    """ Dispatch and finish every chunk, returning (job id, chunk index) in dispatch order. """
+    order = []
+    while (item := scheduler.next(timeout=0)) is not None:
+        job, i, _ = item
+        order.append((job.id, i))
+        scheduler.done(job, i)
+    return order
+
+
+def test_chunk_cost_grows_with_words_and_turns():
+    assert chunk_cost(LONG) > chunk_cost(SHORT)
+    assert chunk_cost(SHORT + "\n" + SHORT) > chunk_cost(SHORT)
+
+
+def test_shortest_job_goes_first_and_chunks_in_script_order():
+    scheduler = FairScheduler(aging_rate=0)
+    scheduler.add(make_job("long", "a", LONG, LONG))
+    scheduler.add(make_job("short", "a", SHORT, SHORT))
+    assert drain(scheduler) == [("short", 0), ("short", 1), ("long", 0), ("long", 1)]
+
+
+def test_waiting_counts_against_a_long_job():
+    scheduler = FairScheduler(aging_rate=1e6)
+    scheduler.add(make_job("long", "a", LONG))
+    time.sleep(0.05)
+    scheduler.add(make_job("short", "a", SHORT))
+    assert drain(scheduler) == [("long", 0), ("short", 0)]
+
+
+def test_submitters_share_the_workers_however_many_jobs_they_queue():
+    scheduler = FairScheduler(aging_rate=0)
+    for n in range(3):
+        scheduler.add(make_job(f"a{n}", "a", SHORT, SHORT))
+    scheduler.add(make_job("b0", "b", SHORT, SHORT, SHORT))
+    dispatched = []
+    for _ in range(6):
+        job, i, _ = scheduler.next(timeout=0)
+        dispatched.append(job.submitter)
+    assert Counter(dispatched[:2]) == Counter(dispatched[2:4]) == Counter(dispatched[4:6]) == Counter("ab")
+
+
+def test_returning_submitter_starts_level_with_the_others():
+    scheduler = FairScheduler(aging_rate=0)
+    scheduler.add(make_job("a0", "a", *[SHORT] * 6))
+    for _ in range(4):
+        job, i, _ = scheduler.next(timeout=0)
+        scheduler.done(job, i)
+    # b has no credit for the chunks a already had: from here on they take turns
+    scheduler.add(make_job("b0", "b", SHORT, SHORT, SHORT))
+    dispatched = [scheduler.next(timeout=0)[0].submitter for _ in range(4)]
+    assert Counter(dispatched[:2]) == Counter(dispatched[2:]) == Counter("ab")
+
+
+def test_cancel_drops_the_chunks_not_dispatched():
+    scheduler = FairScheduler()
+    job = make_job("job", "a", SHORT, SHORT, SHORT)
+    scheduler.add(job)
+    job, i, _ = scheduler.next(timeout=0)
+    scheduler.cancel(job)
+    assert scheduler.next(timeout=0) is None
+    # The chunk in flight still reports back, but the job does not count as finished
+    assert scheduler.done(job, i) is False
+    assert scheduler.stats()["jobs_measured"] == 0
+
+
+def test_done_reports_the_last_chunk_of_a_job():
+    scheduler = FairScheduler()
+    job = make_job("job", "a", SHORT, SHORT)
+    scheduler.add(job)
+    first, second = scheduler.next(timeout=0), scheduler.next(timeout=0)
+    assert scheduler.pending_jobs == 0
+    assert scheduler.done(*first[:2]) is False
+    assert scheduler.done(*second[:2]) is True
+    assert scheduler.stats()["jobs_measured"] == 1
+
+
+def test_next_reports_how_long_the_chunk_waited():
+    scheduler = FairScheduler()
+    assert scheduler.next(timeout=0) is None
+    scheduler.add(make_job("job", "a", SHORT))
+    time.sleep(0.05)
+    _, _, waited = scheduler.next(timeout=0)
+    assert waited >= 0.05
+
+
+def test_a_job_wakes_a_worker_per_chunk():
+    scheduler = FairScheduler()
+    dispatched = []
+    workers = [threading.Thread(target=lambda: dispatched.append(scheduler.next(timeout=5))) for _ in range(2)]
+    for worker in workers:
+        worker.start()
+    time.sleep(0.05)
+    scheduler.add(make_job("job", "a", SHORT, SHORT))
+    for worker in workers:
+        worker.join(timeout=1)
+    assert sorted(i for _, i, _ in dispatched) == [0, 1]
+
+
+def test_submitters_with_nothing_queued_are_forgotten():
+    scheduler = FairScheduler()
+    scheduler.add(make_job("a0", "a", SHORT))
+    scheduler.add(make_job("b0", "b", SHORT, SHORT))
+    drain(scheduler)
+    cancelled = make_job("c0", "c", SHORT)
+    scheduler.add(cancelled)
+    scheduler.cancel(cancelled)
+    assert scheduler._service == {}
@@ -0,0 +1,197 @@
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Spans for where one render's time went, kept in-process so a slow request can be looked
+# into without a tracing service. A streamed render is traced as
+#
+#     generate_audio            the request, until its last byte is sent
+#       parse                   normalizing, cast, scenes and chunking
+#       render                  every chunk, from dispatch to the last one done
+#         voices                getting the cast's reference voices, see reference_audio.py
+#         chunk                 one chunk: index, queue_seconds (waiting for a worker),
+#                               cache hit or miss, token counts and retries
+#           api_call            one attempt: wait_seconds for the dispatcher's rate and
+#                               concurrency limits, then the request itself
+#           decode              the response's base64 audio to WAV bytes
+#       stitch                  streaming the chunks' frames out as one WAV
+#
+# Background jobs trace each chunk under the job id. Finished spans are kept in memory
+# (the last TRACE_BUFFER_SPANS of them, served by the backend's /traces routes) and, if
+# TRACE_FILE is set, appended to it as JSON lines.
+
+TRACE_FILE = os.getenv("TRACE_FILE")
+TRACE_BUFFER_SPANS = int(os.getenv("TRACE_BUFFER_SPANS", "20000"))
+
+_current = ContextVar("tracing_span", default=None)
+
+_collector = None
+_collector_lock = threading.Lock()
+
+
+def new_id():
+    return secrets.token_hex(8)
+
+
+class Span:
+    """ One timed step of a request.
+    Args:
+        name (str): What the step is, e.g. "chunk".
+        trace_id (str): Shared by every span of one request.
+        parent_id (str): The enclosing span's id, or None for the root.
+        attributes: Anything worth knowing about the step, e.g. index=3.
+    """
+
+    def __init__(self, name, trace_id=None, parent_id=None, **attributes):
+        self.name = name
+        self.trace_id = trace_id or new_id()
+        self.span_id = new_id()
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.error = None
+        self.start = time.time()
+        self.duration = None
+        self._started = time.perf_counter()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, error=None, **attributes):
+        """ Stop the clock and hand the span to the collector; later calls do nothing. """
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._started
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        self.attributes.update(attributes)
+        get_collector().export(self)
+
+    def to_dict(self):
+        return dict(
+            name=self.name,
+            trace_id=self.trace_id,
+            span_id=self.span_id,
+            parent_id=self.parent_id,
+            start=self.start,
+            duration=self.duration,
+            error=self.error,
+            attributes=self.attributes,
+        )
+
+
+class Collector:
+    """ Finished spans, newest last, grouped by trace. Safe to share between threads.
+    Args:
+        max_spans (int): How many spans are kept; the oldest traces go first.
+        path (str): Also append every span to this file as a JSON line.
+    """
+
+    def __init__(self, max_spans=TRACE_BUFFER_SPANS, path=TRACE_FILE):
+        self.max_spans = max_spans
+        self.path = path
+        self._traces = OrderedDict()
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        record = span.to_dict()
+        with self._lock:
+            spans = self._traces.get(span.trace_id)
+            if spans is None:
+                spans = self._traces[span.trace_id] = deque()
+            spans.append(record)
+            self._count += 1
+            while self._count > self.max_spans and self._traces:
+                _, dropped = self._traces.popitem(last=False)
+                self._count -= len(dropped)
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, default=str) + "\n")
+
+    def trace(self, trace_id):
+        """ The finished spans of one trace, in start order; [] if it is not kept. """
+        with self._lock:
+            spans = list(self._traces.get(trace_id, ()))
+        return sorted(spans, key=lambda span: span["start"])
+
+    def traces(self, limit=50, slowest=False):
+        """ The root span of the latest, or slowest, finished traces. """
+        with self._lock:
+            roots = [span for spans in self._traces.values() for span in spans if span["parent_id"] is None]
+        if slowest:
+            roots.sort(key=lambda span: span["duration"], reverse=True)
+        else:
+            roots.reverse()
+        return roots[:limit]
+
+
+def get_collector():
+    """ The process-wide collector, created on first use. """
+    global _collector
+    if _collector is None:
+        with _collector_lock:
+            if _collector is None:
+                _collector = Collector()
+    return _collector
+
+
+def current_span():
+    return _current.get()
+
+
+def start_span(name, parent=None, trace_id=None, **attributes):
+    """ A span that is ended by hand, for steps that outlive one with block, such as a
+    streamed response. It does not become the current span.
+    Args:
+        parent (Span): Defaults to the current span; with neither, a new trace starts.
+        trace_id (str): Start or join this trace when there is no parent.
+    """
+    parent = parent or _current.get()
+    if parent is not None:
+        return Span(name, parent.trace_id, parent.span_id, **attributes)
+    return Span(name, trace_id, None, **attributes)
+
+
+@contextmanager
+def span(name, parent=None, trace_id=None, **attributes):
+    """ Trace the with block as a child of parent, or of the current span; inside the
+    block the new span is the current one.
+    """
+    s = start_span(name, parent, trace_id, **attributes)
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.end(e)
+        raise
+    finally:
+        _current.reset(token)
+        s.end()
+
+
+def annotate(**attributes):
+    """ Set attributes on the current span, if there is one. """
+    s = _current.get()
+    if s is not None:
+        s.set(**attributes)
+
+
+def bind(fn, parent=None):
+    """ fn, run with parent (default: the current span) as its current span. For work
+    handed to other threads, which do not inherit the caller's context.
+    """
+    parent = parent or _current.get()
+
+    def bound(*args, **kwargs):
+        token = _current.set(parent)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+
+    return bound
@@ -0,0 +1,65 @@
+"""Compare the speaker, word and budget chunk methods by request count and modeled latency.
+
+Latency is modeled, not measured: each request costs a fixed overhead plus its estimated
+audio tokens divided by the decode rate, and requests run one after another.
+
+Run from the repo root:
+
+    python benchmarks/bench_chunking.py --num_turns 400
+"""
+
+import os
+import random
+import sys
+
+import click
+
+CURR_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(CURR_DIR, "..", "backend"))
+
+from chunking import estimate_audio_tokens, prepare_chunk_text  # noqa: E402
+
+WORDS = "tomorrow and creeps in this petty pace from day to the last syllable of recorded time".split()
+
+
+def synthetic_dialogue(num_turns, num_speakers=3, seed=0):
+    """Tagged dialogue: mostly short exchanges with the odd long speech."""
+    rng = random.Random(seed)
+    turns = []
+    for _ in range(num_turns):
+        num_words = rng.randint(3, 30) if rng.random() < 0.9 else rng.randint(100, 600)
+        speech = " ".join(rng.choice(WORDS) for _ in range(num_words))
+        turns.append(f"[SPEAKER{rng.randint(1, num_speakers)}] {speech}")
+    return "\n".join(turns)
+
+
+def summarize(chunks, max_completion_tokens, request_overhead, tokens_per_second):
+    tokens = [estimate_audio_tokens(chunk) for chunk in chunks]
+    truncated = sum(1 for t in tokens if t > max_completion_tokens)
+    latency = sum(request_overhead + min(t, max_completion_tokens) / tokens_per_second for t in tokens)
+    return len(chunks), truncated, latency
+
+
+@click.command()
+@click.option("--num_turns", type=int, multiple=True, default=[50, 400, 2000], help="Dialogue lengths in turns.")
+@click.option("--max_completion_tokens", type=int, default=4096, help="Completion token limit per request.")
+@click.option("--chunk_max_word_num", type=int, default=200, help="Words per chunk for the word method.")
+@click.option("--request_overhead", type=float, default=0.8, help="Fixed cost of one request, in seconds.")
+@click.option("--tokens_per_second", type=float, default=200.0, help="Audio tokens decoded per second.")
+def main(num_turns, max_completion_tokens, chunk_max_word_num, request_overhead, tokens_per_second):
+    methods = {
+        "speaker": dict(chunk_method="speaker"),
+        "word": dict(chunk_method="word", chunk_max_word_num=chunk_max_word_num),
+        "budget": dict(chunk_method="budget", max_completion_tokens=max_completion_tokens),
+    }
+    for n in num_turns:
+        text = synthetic_dialogue(n)
+        print(f"{n} turns")
+        for name, kwargs in methods.items():
+            chunks = prepare_chunk_text(text, **kwargs)
+            requests, truncated, latency = summarize(chunks, max_completion_tokens, request_overhead, tokens_per_second)
+            print(f"  {name:8s} {requests:6d} requests  {truncated:4d} over budget  {latency:9.1f} s modeled")
+
+
+if __name__ == "__main__":
+    main()
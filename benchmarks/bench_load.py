@@ -0,0 +1,261 @@
+"""Load and latency benchmark for the Flask backend's /generate_audio.
+
+Starts the mock Boson server (backend/mock_boson.py) and the Flask backend pointed at it,
+then replays a corpus of scripts at a fixed arrival rate (open loop: requests go out on
+a Poisson schedule whether or not earlier ones have finished) and reports throughput,
+latency percentiles, time to first byte, the backend's peak RSS and the error rate.
+
+The corpus is backend/tomorrow.txt, TestingMultitalk/sample_ft.txt and
+TestingMultitalk/fight.txt, plus each of them repeated --scale times to stand in for
+longer plays. Every upload gets its own closing line unless --no-unique is given, so
+the audio cache and request coalescing do not hide the rendering work.
+
+Run from the repo root:
+
+    python benchmarks/bench_load.py --rate 2 --requests 40 --out load.json
+
+or against servers that are already running:
+
+    python benchmarks/bench_load.py --backend_url http://127.0.0.1:5000 --no-spawn
+"""
+
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import click
+import httpx
+
+CURR_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.join(CURR_DIR, "..")
+BACKEND_DIR = os.path.join(REPO_DIR, "backend")
+
+CORPUS = [
+    os.path.join(BACKEND_DIR, "tomorrow.txt"),
+    os.path.join(REPO_DIR, "TestingMultitalk", "sample_ft.txt"),
+    os.path.join(REPO_DIR, "TestingMultitalk", "fight.txt"),
+]
+
+
+def load_corpus(scales):
+    """(name, text) pairs: every corpus script at every scale."""
+    scripts = []
+    for path in CORPUS:
+        with open(path, encoding="utf-8") as f:
+            text = f.read().strip()
+        name = os.path.splitext(os.path.basename(path))[0]
+        for scale in scales:
+            scripts.append((f"{name}x{scale}", "\n\n".join([text] * scale)))
+    return scripts
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(url, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout} seconds")
+
+
+def peak_rss_bytes(pid):
+    """Peak resident set size of a process, from /proc on Linux; None elsewhere."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def send(client, url, name, text, results):
+    """Upload one script, reading the streamed response as it arrives."""
+    started = time.perf_counter()
+    record = {"script": name, "status": None, "ttfb": None, "latency": None, "bytes": 0, "error": None}
+    try:
+        files = {"file": (f"{name}.txt", text.encode("utf-8"), "text/plain")}
+        with client.stream("POST", f"{url}/generate_audio", files=files) as response:
+            record["status"] = response.status_code
+            for data in response.iter_bytes():
+                if record["ttfb"] is None:
+                    record["ttfb"] = time.perf_counter() - started
+                record["bytes"] += len(data)
+        record["latency"] = time.perf_counter() - started
+    except httpx.HTTPError as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    results.append(record)
+
+
+def summarize(results, wall_time, peak_rss):
+    ok = [r for r in results if r["status"] == 200 and r["error"] is None]
+    latencies = [r["latency"] for r in ok]
+    ttfbs = [r["ttfb"] for r in ok if r["ttfb"] is not None]
+    return dict(
+        requests=len(results),
+        succeeded=len(ok),
+        error_rate=(len(results) - len(ok)) / len(results) if results else 0.0,
+        throughput_rps=len(ok) / wall_time if wall_time else None,
+        audio_bytes_per_second=sum(r["bytes"] for r in ok) / wall_time if wall_time else None,
+        latency_p50=percentile(latencies, 0.5),
+        latency_p95=percentile(latencies, 0.95),
+        latency_p99=percentile(latencies, 0.99),
+        latency_mean=statistics.fmean(latencies) if latencies else None,
+        ttfb_p50=percentile(ttfbs, 0.5),
+        ttfb_p95=percentile(ttfbs, 0.95),
+        ttfb_p99=percentile(ttfbs, 0.99),
+        peak_rss_bytes=peak_rss,
+        wall_time=wall_time,
+    )
+
+
+@click.command()
+@click.option("--rate", type=float, default=1.0, help="Mean arrivals per second.")
+@click.option("--requests", "num_requests", type=int, default=20, help="How many uploads to send.")
+@click.option("--scale", type=int, multiple=True, default=[1, 10], help="Repeat each corpus script this many times.")
+@click.option("--seed", type=int, default=0, help="Seed for arrival times and script choice.")
+@click.option("--unique/--no-unique", default=True, help="Give every upload its own closing line.")
+@click.option("--spawn/--no-spawn", default=True, help="Start the mock server and the backend here.")
+@click.option("--backend_url", type=str, default=None, help="Backend to load when not spawning one.")
+@click.option("--backend_pid", type=int, default=None, help="PID of that backend, for its peak RSS.")
+@click.option("--mock_latency", type=float, default=0.3, help="Mock server: fixed seconds per request.")
+@click.option("--mock_tokens_per_second", type=float, default=400.0, help="Mock server: audio tokens per second.")
+@click.option("--mock_jitter", type=float, default=0.2, help="Mock server: latency jitter fraction.")
+@click.option("--mock_error_rate", type=float, default=0.0, help="Mock server: fraction of 500s.")
+@click.option("--mock_rate_limit", type=float, default=0.0, help="Mock server: requests per second before 429s.")
+@click.option("--timeout", type=float, default=600.0, help="Seconds before an upload is given up on.")
+@click.option("--out", type=str, default=None, help="Write the results as JSON here.")
+def main(rate, num_requests, scale, seed, unique, spawn, backend_url, backend_pid, mock_latency,
+         mock_tokens_per_second, mock_jitter, mock_error_rate, mock_rate_limit, timeout, out):
+    processes = []
+    # The spawned backend keeps its cache, jobs, voices and profiles here, so earlier runs
+    # do not answer for this one and nothing is left behind
+    scratch = tempfile.TemporaryDirectory(prefix="bench_load_")
+    try:
+        if spawn:
+            mock_port, backend_port = free_port(), free_port()
+            processes.append(subprocess.Popen([
+                sys.executable, os.path.join(BACKEND_DIR, "mock_boson.py"), "--port", str(mock_port),
+                "--latency", str(mock_latency), "--tokens_per_second", str(mock_tokens_per_second),
+                "--jitter", str(mock_jitter), "--error_rate", str(mock_error_rate),
+                "--rate_limit", str(mock_rate_limit), "--rate_burst", str(max(1, int(mock_rate_limit))),
+                "--seed", str(seed),
+            ], cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+            wait_until_up(f"http://127.0.0.1:{mock_port}/health")
+
+            env = dict(
+                os.environ,
+                BOSON_BASE_URL=f"http://127.0.0.1:{mock_port}/v1",
+                BOSON_API_KEY=os.getenv("BOSON_API_KEY", "mock"),
+                AUDIO_CACHE_DIR=os.path.join(scratch.name, "audio_cache"),
+                JOB_DIR=os.path.join(scratch.name, "jobs"),
+                VOICE_DIR=os.path.join(scratch.name, "voices"),
+                PROFILE_DIR=os.path.join(scratch.name, "profiles"),
+            )
+            backend = subprocess.Popen([
+                sys.executable, "-m", "flask", "--app", "app", "run",
+                "--port", str(backend_port), "--no-reload", "--no-debugger", "--with-threads",
+            ], cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            processes.append(backend)
+            backend_url, backend_pid = f"http://127.0.0.1:{backend_port}", backend.pid
+            # Any path will do; a 404 still shows the server is up
+            wait_until_up(f"{backend_url}/")
+        elif backend_url is None:
+            raise click.UsageError("--backend_url is required with --no-spawn")
+
+        rng = random.Random(seed)
+        scripts = load_corpus(scale)
+        results = []
+        threads = []
+        limits = httpx.Limits(max_connections=num_requests, max_keepalive_connections=num_requests)
+        with httpx.Client(timeout=timeout, limits=limits) as client:
+            started = time.perf_counter()
+            next_arrival = started
+            for i in range(num_requests):
+                name, text = rng.choice(scripts)
+                if unique:
+                    text = f"{text}\n\nThe end of take {i}."
+                time.sleep(max(0.0, next_arrival - time.perf_counter()))
+                thread = threading.Thread(target=send, args=(client, backend_url, name, text, results))
+                thread.start()
+                threads.append(thread)
+                next_arrival += rng.expovariate(rate)
+            for thread in threads:
+                thread.join()
+            wall_time = time.perf_counter() - started
+
+        peak_rss = peak_rss_bytes(backend_pid) if backend_pid else None
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+        scratch.cleanup()
+
+    summary = summarize(results, wall_time, peak_rss)
+    by_script = {
+        name: summarize([r for r in results if r["script"] == name], wall_time, None)
+        for name in sorted({r["script"] for r in results})
+    }
+
+    print(f"{summary['succeeded']}/{summary['requests']} succeeded in {wall_time:.1f} s "
+          f"({summary['throughput_rps']:.2f} req/s, error rate {summary['error_rate']:.1%})")
+    for label in ("latency", "ttfb"):
+        values = [summary[f"{label}_{p}"] for p in ("p50", "p95", "p99")]
+        print(f"  {label:8s} p50/p95/p99: " + " / ".join("-" if v is None else f"{v:.2f} s" for v in values))
+    if peak_rss is not None:
+        print(f"  backend peak RSS: {peak_rss / 2 ** 20:.1f} MiB")
+    for name, s in by_script.items():
+        p50 = "-" if s["latency_p50"] is None else f"{s['latency_p50']:.2f} s"
+        print(f"  {name:16s} {s['succeeded']:3d}/{s['requests']:<3d} latency p50 {p50}")
+
+    if out:
+        with open(out, "w", encoding="utf-8") as f:
+            json.dump(dict(
+                revision=git_revision(),
+                timestamp=time.time(),
+                config=dict(rate=rate, requests=num_requests, scale=list(scale), seed=seed, unique=unique,
+                            mock_latency=mock_latency, mock_tokens_per_second=mock_tokens_per_second,
+                            mock_jitter=mock_jitter, mock_error_rate=mock_error_rate,
+                            mock_rate_limit=mock_rate_limit),
+                summary=summary,
+                by_script=by_script,
+                requests=results,
+            ), f, indent=2)
+        print(f"Results written to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Benchmark the single-scan transcript normalizer against the old replace chain.
+
+Run from the repo root:
+
+    python benchmarks/bench_normalizer.py --size_mb 8
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from itertools import product
+
+import click
+
+CURR_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(CURR_DIR, "..", "backend"))
+
+from normalizer import iter_file_blocks, normalize_lines, normalize_transcript  # noqa: E402
+
+
+def legacy_normalize(transcript, speaker_id_tags=True):
+    """The replace chain every entry point used before normalizer.py."""
+    transcript = transcript.replace("(", " ")
+    transcript = transcript.replace(")", " ")
+    transcript = transcript.replace("°F", " degrees Fahrenheit")
+    transcript = transcript.replace("°C", " degrees Celsius")
+
+    for tag, replacement in [
+        ("[laugh]", "<SE>[Laughter]</SE>"),
+        ("[humming start]", "<SE_s>[Humming]</SE_s>"),
+        ("[humming end]", "<SE_e>[Humming]</SE_e>"),
+        ("[music start]", "<SE_s>[Music]</SE_s>"),
+        ("[music end]", "<SE_e>[Music]</SE_e>"),
+        ("[music]", "<SE>[Music]</SE>"),
+        ("[sing start]", "<SE_s>[Singing]</SE_s>"),
+        ("[sing end]", "<SE_e>[Singing]</SE_e>"),
+        ("[applause]", "<SE>[Applause]</SE>"),
+        ("[cheering]", "<SE>[Cheering]</SE>"),
+        ("[cough]", "<SE>[Cough]</SE>"),
+    ]:
+        transcript = transcript.replace(tag, replacement)
+
+    if speaker_id_tags:
+        transcript = transcript.replace("[", "<|speaker_id_start|>")
+        transcript = transcript.replace("]", "<|speaker_id_end|>")
+    lines = transcript.split("\n")
+
+    transcript = "\n".join([" ".join(line.split()) for line in lines if line.strip()])
+    transcript = transcript.strip()
+    return transcript
+
+
+WORDS = (
+    "tomorrow and creeps in this petty pace from day to the last syllable of recorded time "
+    "all our yesterdays have lighted fools way dusty death out brief candle life's but a walking shadow"
+).split()
+
+EXTRAS = [
+    "[laugh]", "[music start]", "[music end]", "[music]", "[humming start]", "[humming end]",
+    "[sing start]", "[sing end]", "[applause]", "[cheering]", "[cough]", "(aside)", "72°F", "20°C",
+    "[music(start]", "[SPEAKER1]", "[SPEAKER2]", "\t", "  ", " ",
+]
+
+
+def synthetic_script(size_bytes, tag_density=0.5, seed=0):
+    """A play-shaped script with tags, parentheses and stray whitespace sprinkled in.
+
+    tag_density is the chance that a dialogue line gets one or two extras from EXTRAS.
+    """
+    rng = random.Random(seed)
+    lines = []
+    total = 0
+    while total < size_bytes:
+        if rng.random() < 0.1:
+            line = rng.choice(["", "   ", "Macbeth", "Lady Macbeth", "SETTING:"])
+        else:
+            words = [rng.choice(WORDS) for _ in range(rng.randint(4, 16))]
+            for _ in range(rng.randint(1, 2) if rng.random() < tag_density else 0):
+                words.insert(rng.randint(0, len(words)), rng.choice(EXTRAS))
+            line = " ".join(words)
+        lines.append(line)
+        total += len(line) + 1
+    return "\n".join(lines)
+
+
+def peak_memory(fn, *args):
+    tracemalloc.start()
+    try:
+        fn(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def read_and_normalize(path):
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        return len(normalize_transcript(f.read()))
+
+
+def stream_and_normalize(path):
+    # Consume the lines the way a downstream parser would, without joining them
+    return sum(len(line) + 1 for line in normalize_lines(iter_file_blocks(path)))
+
+
+def bench_streaming(size_mb, repeat):
+    print("streaming from a file (peak traced memory)")
+    for size in size_mb:
+        text = synthetic_script(int(size * 1024 * 1024), 0.05)
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", newline="", suffix=".txt", delete=False) as tmp:
+            tmp.write(text)
+            path = tmp.name
+        del text
+        try:
+            whole = best_of(read_and_normalize, path, repeat)
+            streamed = best_of(stream_and_normalize, path, repeat)
+            whole_mem = peak_memory(read_and_normalize, path)
+            streamed_mem = peak_memory(stream_and_normalize, path)
+            print(f"  {size:6.1f} MB  read+normalize {whole * 1000:8.1f} ms {whole_mem / 2**20:7.1f} MiB  "
+                  f"streamed {streamed * 1000:8.1f} ms {streamed_mem / 2**20:7.1f} MiB")
+        finally:
+            os.remove(path)
+
+
+def best_of(fn, text, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(text)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+@click.command()
+@click.option("--size_mb", type=float, multiple=True, default=[1, 4, 16], help="Script sizes to benchmark, in MB.")
+@click.option("--tag_density", type=float, multiple=True, default=[0.05, 0.5], help="Share of lines carrying tags.")
+@click.option("--repeat", type=int, default=3, help="Runs per measurement; the best one is reported.")
+@click.option("--stream", is_flag=True, default=False, help="Also compare whole-file and streamed normalization.")
+def main(size_mb, tag_density, repeat, stream):
+    for speaker_id_tags, density in product((True, False), tag_density):
+        print(f"speaker_id_tags={speaker_id_tags} tag_density={density}")
+        for size in size_mb:
+            text = synthetic_script(int(size * 1024 * 1024), density)
+            expected = legacy_normalize(text, speaker_id_tags)
+            actual = normalize_transcript(text, speaker_id_tags)
+            assert actual == expected, "normalizer output differs from the legacy replace chain"
+
+            legacy = best_of(lambda t: legacy_normalize(t, speaker_id_tags), text, repeat)
+            single = best_of(lambda t: normalize_transcript(t, speaker_id_tags), text, repeat)
+            print(f"  {size:6.1f} MB  legacy {legacy * 1000:8.1f} ms  single-scan {single * 1000:8.1f} ms  "
+                  f"speedup {legacy / single:5.2f}x")
+    if stream:
+        bench_streaming(size_mb, repeat)
+
+
+if __name__ == "__main__":
+    main()
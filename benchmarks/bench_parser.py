@@ -0,0 +1,161 @@
+"""Benchmark parse_turns and ScriptIndex against the old split-per-stage helpers.
+
+Run from the repo root:
+
+    python benchmarks/bench_parser.py --num_lines 50000
+"""
+
+import os
+import random
+import sys
+import time
+
+import click
+
+CURR_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(CURR_DIR, "..", "backend"))
+
+from script_parser import ScriptIndex, parse_turns  # noqa: E402
+
+WORDS = "tomorrow and creeps in this petty pace from day to the last syllable of recorded time".split()
+
+
+def legacy_extract_dialogue(script, actor_speaker):
+    """extract_dialogue from small.py before script_parser.py."""
+    lines = script.split("\n")
+
+    dialogue = []
+
+    for i in range(len(lines)):
+        if lines[i] in actor_speaker.keys():
+            for j in range(i+1, len(lines)):
+                if lines[j] in actor_speaker.keys() or lines[j] == "":
+                    break
+                cur_tag = actor_speaker[lines[i]]
+                cur_speech = f"[{cur_tag}]{lines[j]}"
+                dialogue.append(cur_speech)
+
+    return "\n".join(dialogue)
+
+
+def legacy_extract_scene_description(full_transcript):
+    """extract_scene_description from small.py before ScriptIndex."""
+    lines = full_transcript.split("\n")
+
+    setting_index = lines.index("SETTING:") if "SETTING:" in lines else -1
+
+    if setting_index == -1:
+        return "", False, full_transcript
+
+    for i in range(setting_index + 1, len(lines)):
+        if lines[i] == "":
+            setting_end_index = i
+            break
+    else:
+        setting_end_index = len(lines)
+
+    scene_prompt = "\n".join(lines[setting_index + 1:setting_end_index]).strip()
+    remaining_transcript = "\n".join(lines[setting_end_index:]).strip()
+    return scene_prompt, True, remaining_transcript
+
+
+def legacy_speaker_chunks(text):
+    """prepare_chunk_text(chunk_method="speaker") before ScriptIndex."""
+    lines = text.split("\n")
+    speaker_chunks = []
+    speaker_utterance = ""
+    for line in lines:
+        line = line.strip()
+        if line.startswith("[SPEAKER") or line.startswith("<|speaker_id_start|>"):
+            if speaker_utterance:
+                speaker_chunks.append(speaker_utterance.strip())
+            speaker_utterance = line
+        else:
+            if speaker_utterance:
+                speaker_utterance += "\n" + line
+            else:
+                speaker_utterance = line
+    if speaker_utterance:
+        speaker_chunks.append(speaker_utterance.strip())
+    return speaker_chunks
+
+
+def legacy_pipeline(script, actor_speaker):
+    scene_prompt, _, remaining_transcript = legacy_extract_scene_description(script)
+    dialogue = legacy_extract_dialogue(remaining_transcript, actor_speaker)
+    return scene_prompt, dialogue, legacy_speaker_chunks(dialogue)
+
+
+def index_pipeline(script, actor_speaker):
+    index = ScriptIndex(script, actor_speaker)
+    scene_prompt, _, _ = index.scene_description()
+    dialogue = index.dialogue(start=index.body_start)
+    return scene_prompt, dialogue, ScriptIndex(dialogue).speaker_chunks()
+
+
+def extract_dialogue(script, actor_speaker):
+    dialogue = []
+    for turn in parse_turns(script, actor_speaker):
+        for line in turn.text(script).split("\n"):
+            dialogue.append(f"[{turn.speaker}]{line}")
+    return "\n".join(dialogue)
+
+
+def synthetic_play(num_lines, num_actors=8, seed=0):
+    """A "name on its own line" script with num_lines lines and its actor_speaker map."""
+    rng = random.Random(seed)
+    actors = [f"Actor {i}" for i in range(num_actors)]
+    actor_speaker = {actor: f"SPEAKER{i + 1}" for i, actor in enumerate(actors)}
+    lines = []
+    while len(lines) < num_lines:
+        lines.append(rng.choice(actors))
+        for _ in range(rng.randint(1, 6)):
+            lines.append(" ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 12))))
+        if rng.random() < 0.5:
+            lines.append("")
+    return "\n".join(lines[:num_lines]), actor_speaker
+
+
+def best_of(fns, repeat):
+    """Best time of each of fns; the runs are interleaved so that machine noise hits them alike."""
+    timings = [[] for _ in fns]
+    for _ in range(repeat):
+        for fn, fn_timings in zip(fns, timings):
+            start = time.perf_counter()
+            fn()
+            fn_timings.append(time.perf_counter() - start)
+    return [min(fn_timings) for fn_timings in timings]
+
+
+@click.command()
+@click.option("--num_lines", type=int, multiple=True, default=[5000, 50000, 500000], help="Script lengths in lines.")
+@click.option("--num_actors", type=int, default=8, help="Cast size of the synthetic script.")
+@click.option("--repeat", type=int, default=5, help="Runs per measurement; the best one is reported.")
+def main(num_lines, num_actors, repeat):
+    for n in num_lines:
+        script, actor_speaker = synthetic_play(n, num_actors)
+        assert extract_dialogue(script, actor_speaker) == legacy_extract_dialogue(script, actor_speaker), \
+            "parse_turns output differs from the legacy extract_dialogue"
+
+        legacy, parsed, rebuilt = best_of([
+            lambda: legacy_extract_dialogue(script, actor_speaker),
+            lambda: parse_turns(script, actor_speaker),
+            lambda: extract_dialogue(script, actor_speaker),
+        ], repeat)
+        print(f"  {n:8d} lines  legacy {legacy * 1000:8.1f} ms  parse_turns {parsed * 1000:8.1f} ms  "
+              f"parse_turns + dialogue text {rebuilt * 1000:8.1f} ms")
+
+        # scene extraction, dialogue extraction and speaker chunking, one after another
+        script = "SETTING:\nA blasted heath. Thunder.\n\n" + script
+        assert index_pipeline(script, actor_speaker) == legacy_pipeline(script, actor_speaker), \
+            "ScriptIndex pipeline differs from the legacy helpers"
+        legacy, indexed = best_of([
+            lambda: legacy_pipeline(script, actor_speaker),
+            lambda: index_pipeline(script, actor_speaker),
+        ], repeat)
+        print(f"  {n:8d} lines  scene + dialogue + chunks: legacy {legacy * 1000:8.1f} ms  "
+              f"ScriptIndex {indexed * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""Time and memory-profile each stage of the text pipeline, and catch regressions.
+
+The stages are the ones the generator scripts run before any request is sent, measured
+through the backend functions they call (the scripts themselves open an API client at
+import):
+
+    formated_script                      normalizer.normalize_transcript
+    actor_speaker_mapping                cast.assign_speakers(cast.discover_cast(...))
+    extract_scene_description            ScriptIndex.scene_description
+    extract_dialogue                     ScriptIndex.dialogue
+    prepare_chunk_text                   chunking.prepare_chunk_text
+    _build_system_message_with_audio_prompt   the helper in gen4/gen4a/gen5, copied below
+
+Each stage runs on the previous stage's output. Time is the best of --repeat runs; peak
+memory comes from a separate tracemalloc run, so tracing does not skew the timings.
+
+Run from the repo root:
+
+    python benchmarks/bench_pipeline.py --size_mb 1 --size_mb 32 --save_baseline baseline.json
+    python benchmarks/bench_pipeline.py --size_mb 1 --size_mb 32 --baseline baseline.json
+
+With --baseline, a stage more than --tolerance slower (or --memory_tolerance bigger)
+than the stored figure for the same script size is flagged, and the exit status is 1.
+"""
+
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import click
+
+CURR_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(CURR_DIR, "..", "backend"))
+sys.path.append(os.path.join(CURR_DIR, "..", "TestingMultitalk"))
+
+from cast import assign_speakers, discover_cast  # noqa: E402
+from chunking import prepare_chunk_text  # noqa: E402
+from data_types import AudioContent, Message, TextContent  # noqa: E402
+from normalizer import normalize_transcript  # noqa: E402
+from script_parser import ScriptIndex  # noqa: E402
+
+WORDS = "tomorrow and creeps in this petty pace from day to the last syllable of recorded time".split()
+NAMES = "ROMEO JULIET MERCUTIO TYBALT BENVOLIO NURSE CAPULET MONTAGUE PARIS FRIAR LAURENCE ESCALUS".split()
+# Markup the normalizer rewrites
+TAGS = ["(aside)", "(laughs)", "72°F", "[laugh]", "[cough]", "<SE>[Thunder]</SE>", "—", "…"]
+
+AUDIO_PLACEHOLDER_TOKEN = "<|__AUDIO_PLACEHOLDER__|>"
+
+# Distinct text is generated up to this size; longer scripts repeat it
+UNIQUE_BYTES = 4 * 2 ** 20
+
+
+def _build_system_message_with_audio_prompt(system_message):
+    """The helper from gen4.py, gen4a.py and gen5.py."""
+    contents = []
+
+    while AUDIO_PLACEHOLDER_TOKEN in system_message:
+        loc = system_message.find(AUDIO_PLACEHOLDER_TOKEN)
+        contents.append(TextContent(system_message[:loc]))
+        contents.append(AudioContent(audio_url=""))
+        system_message = system_message[loc + len(AUDIO_PLACEHOLDER_TOKEN) :]
+
+    if len(system_message) > 0:
+        contents.append(TextContent(system_message))
+    ret = Message(
+        role="system",
+        content=contents,
+    )
+    return ret
+
+
+def cast_names(cast_size):
+    names = NAMES[:cast_size]
+    names += [f"CITIZEN {i}" for i in range(1, cast_size - len(names) + 1)]
+    return names
+
+
+def synthetic_script(cast_size=6, num_turns=None, size_mb=None, tag_density=0.1, seed=0):
+    """A play: a SETTING block, then turns with the speaker's name on its own line.
+    Args:
+        cast_size (int): How many characters speak.
+        num_turns (int): Stop after this many turns.
+        size_mb (float): Or stop at this size. Past UNIQUE_BYTES the turns repeat, which
+            keeps scripts of hundreds of MB quick to build.
+        tag_density (float): Chance that a line of speech carries markup the normalizer
+            has to rewrite.
+        seed (int): For the random choices.
+    """
+    rng = random.Random(seed)
+    names = cast_names(cast_size)
+    target = int(size_mb * 2 ** 20) if size_mb else None
+    turns, size = [], 0
+    while True:
+        if num_turns is not None and len(turns) >= num_turns:
+            break
+        if target is not None and size >= min(target, UNIQUE_BYTES):
+            break
+        lines = [rng.choice(names)]
+        for _ in range(rng.randint(1, 4)):
+            words = [rng.choice(WORDS) for _ in range(rng.randint(4, 14))]
+            if rng.random() < tag_density:
+                words.insert(rng.randrange(len(words) + 1), rng.choice(TAGS))
+            lines.append(" ".join(words) + rng.choice(".!?,"))
+        turn = "\n".join(lines)
+        turns.append(turn)
+        size += len(turn.encode("utf-8")) + 2
+
+    body = "\n\n".join(turns)
+    if target is not None and size < target:
+        body = "\n\n".join([body] * -(-target // size))
+    return "SETTING:\nA public place in Verona. Thunder, distant.\n\n" + body
+
+
+def system_message(cast_size, scene_prompt):
+    speaker_desc = "\n".join(f"SPEAKER{i}: {AUDIO_PLACEHOLDER_TOKEN}" for i in range(cast_size))
+    return ("Generate audio following instruction.\n\n"
+            f"<|scene_desc_start|>\n{scene_prompt}\n\n{speaker_desc}\n<|scene_desc_end|>")
+
+
+def stages(script, cast_size, chunk_method):
+    """(name, fn) pairs; each fn runs one stage on the previous one's output."""
+    state = {}
+
+    def formated_script():
+        state["normalized"] = normalize_transcript(script)
+
+    def actor_speaker_mapping():
+        state["actor_speaker"] = assign_speakers(discover_cast(state["normalized"]))
+
+    def extract_scene_description():
+        index = ScriptIndex(state["normalized"], state["actor_speaker"])
+        state["scene_prompt"] = index.scene_description()[0]
+        state["body_start"] = index.body_start
+
+    def extract_dialogue():
+        index = ScriptIndex(state["normalized"], state["actor_speaker"])
+        state["dialogue"] = index.dialogue(start=state["body_start"])
+
+    def prepare_chunks():
+        state["chunks"] = prepare_chunk_text(state["dialogue"], chunk_method=chunk_method, max_completion_tokens=4096)
+
+    def build_system_message():
+        # Once per chunk, as a script that rebuilds it per request would
+        message = system_message(cast_size, state["scene_prompt"])
+        for _ in range(len(state["chunks"])):
+            _build_system_message_with_audio_prompt(message)
+
+    return [
+        ("formated_script", formated_script),
+        ("actor_speaker_mapping", actor_speaker_mapping),
+        ("extract_scene_description", extract_scene_description),
+        ("extract_dialogue", extract_dialogue),
+        ("prepare_chunk_text", prepare_chunks),
+        ("_build_system_message_with_audio_prompt", build_system_message),
+    ], state
+
+
+def measure(script, cast_size, chunk_method, repeat):
+    """{stage: {"seconds": best time, "peak_bytes": tracemalloc peak}}"""
+    results = {}
+    timed, _ = stages(script, cast_size, chunk_method)
+    for name, fn in timed:
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - start)
+        results[name] = {"seconds": min(timings)}
+
+    traced, _ = stages(script, cast_size, chunk_method)
+    for name, fn in traced:
+        tracemalloc.start()
+        fn()
+        results[name]["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return results
+
+
+def regressions(results, baseline, tolerance, memory_tolerance):
+    """Stages slower or bigger than the baseline allows, as printable lines."""
+    flagged = []
+    for name, now in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if now["seconds"] > before["seconds"] * (1 + tolerance):
+            flagged.append(f"{name}: {before['seconds'] * 1000:.1f} ms -> {now['seconds'] * 1000:.1f} ms")
+        if now["peak_bytes"] > before["peak_bytes"] * (1 + memory_tolerance):
+            flagged.append(f"{name}: peak {before['peak_bytes'] / 2 ** 20:.1f} MiB -> "
+                           f"{now['peak_bytes'] / 2 ** 20:.1f} MiB")
+    return flagged
+
+
+@click.command()
+@click.option("--size_mb", type=float, multiple=True, default=[1, 16], help="Script sizes in MB.")
+@click.option("--num_turns", type=int, default=None, help="Cap every script at this many turns instead.")
+@click.option("--cast_size", type=int, default=6, help="How many characters speak.")
+@click.option("--tag_density", type=float, default=0.1, help="Chance a line carries markup to normalize.")
+@click.option("--chunk_method", type=click.Choice(["speaker", "word", "budget"]), default="budget")
+@click.option("--repeat", type=int, default=3, help="Runs per timing; the best one is reported.")
+@click.option("--seed", type=int, default=0)
+@click.option("--baseline", type=str, default=None, help="Compare against this stored baseline.")
+@click.option("--save_baseline", type=str, default=None, help="Store the results as a baseline here.")
+@click.option("--tolerance", type=float, default=0.25, help="Allowed slowdown before flagging, e.g. 0.25.")
+@click.option("--memory_tolerance", type=float, default=0.25, help="Allowed peak memory growth before flagging.")
+def main(size_mb, num_turns, cast_size, tag_density, chunk_method, repeat, seed, baseline, save_baseline,
+         tolerance, memory_tolerance):
+    stored = {}
+    if baseline:
+        with open(baseline, encoding="utf-8") as f:
+            stored = json.load(f)
+
+    all_results, flagged = {}, []
+    for size in size_mb:
+        script = synthetic_script(cast_size, num_turns, size, tag_density, seed)
+        # Baselines are only comparable for the same script
+        key = f"{len(script.encode('utf-8'))}B/cast{cast_size}/tags{tag_density}/{chunk_method}/seed{seed}"
+        print(f"{len(script.encode('utf-8')) / 2 ** 20:.1f} MB script, cast of {cast_size}")
+        results = all_results[key] = measure(script, cast_size, chunk_method, repeat)
+        for name, r in results.items():
+            print(f"  {name:42s} {r['seconds'] * 1000:10.1f} ms  peak {r['peak_bytes'] / 2 ** 20:8.1f} MiB")
+        if key in stored:
+            flagged += [f"{key} {line}" for line in regressions(results, stored[key], tolerance, memory_tolerance)]
+        elif baseline:
+            print(f"  (no baseline for {key})")
+
+    if save_baseline:
+        with open(save_baseline, "w", encoding="utf-8") as f:
+            json.dump({**stored, **all_results}, f, indent=2)
+        print(f"Baseline written to {save_baseline}")
+
+    if flagged:
+        print("Regressions:")
+        for line in flagged:
+            print(f"  {line}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
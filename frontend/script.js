@@ -59,14 +59,93 @@ form.addEventListener("submit", async (e) => {
     formData.append("numActors", numActors);
 });
 
-// Collect voice descriptions
-const voiceDescriptions = [];
-for (let i = 1; i <= numActors; i++) {
-    const desc = form[`actor${i}`].value || "";
-    voiceDescriptions.push(desc);
+
+
+// Size of the WAV header the backend sends before the PCM frames
+const WAV_HEADER_SIZE = 44;
+
+// Play a streamed 16-bit PCM WAV response while it downloads.
+// Calls onFirstAudio once the first frames are scheduled, and resolves with
+// the whole WAV file, as a list of byte chunks, once the stream ends.
+async function playAudioStream(response, onFirstAudio) {
+  const reader = response.body.getReader();
+  const received = [];
+  const audioContext = new AudioContext();
+
+  let header = new Uint8Array(0);
+  let format = null;
+  let leftover = new Uint8Array(0);
+  let playAt = 0;
+  let started = false;
+  let headerChunks = 0;
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    received.push(value);
+
+    let bytes = value;
+    if (!format) {
+      header = concatBytes(header, bytes);
+      if (header.length < WAV_HEADER_SIZE) continue;
+      const view = new DataView(header.buffer, header.byteOffset, header.length);
+      format = {
+        channels: view.getUint16(22, true),
+        sampleRate: view.getUint32(24, true),
+      };
+      headerChunks = received.length;
+      bytes = header.subarray(WAV_HEADER_SIZE);
+    }
+
+    // Frames can be split across reads; hold back the incomplete one
+    bytes = concatBytes(leftover, bytes);
+    const frameSize = 2 * format.channels;
+    const usable = bytes.length - (bytes.length % frameSize);
+    leftover = bytes.slice(usable);
+    if (!usable) continue;
+
+    const samples = new Int16Array(bytes.buffer.slice(bytes.byteOffset, bytes.byteOffset + usable));
+    const frames = samples.length / format.channels;
+    const buffer = audioContext.createBuffer(format.channels, frames, format.sampleRate);
+    for (let c = 0; c < format.channels; c++) {
+      const channel = buffer.getChannelData(c);
+      for (let i = 0; i < frames; i++) {
+        channel[i] = samples[i * format.channels + c] / 32768;
+      }
+    }
+
+    // Queue the pieces back to back
+    const source = audioContext.createBufferSource();
+    source.buffer = buffer;
+    source.connect(audioContext.destination);
+    if (!started) {
+      started = true;
+      onFirstAudio();
+    }
+    playAt = Math.max(playAt, audioContext.currentTime);
+    source.start(playAt);
+    playAt += buffer.duration;
+  }
+
+  // The streamed header could not know the length; write the real one for replay
+  if (format) {
+    const total = received.reduce((sum, chunk) => sum + chunk.length, 0);
+    const fixed = header.slice(0, WAV_HEADER_SIZE);
+    const view = new DataView(fixed.buffer);
+    view.setUint32(4, total - 8, true);
+    view.setUint32(40, total - WAV_HEADER_SIZE, true);
+    return [fixed, header.subarray(WAV_HEADER_SIZE), ...received.slice(headerChunks)];
+  }
+  return received;
 }
-// formData.append("voiceDescriptions", JSON.stringify(voiceDescriptions));
 
+function concatBytes(a, b) {
+  if (!a.length) return b;
+  const out = new Uint8Array(a.length + b.length);
+  out.set(a);
+  out.set(b, a.length);
+  return out;
+}
 
 // Ensure this script is included with <script src="script.js"></script> in your HTML
 document.getElementById("submit-button").addEventListener("click", async () => {
@@ -84,17 +163,32 @@ document.getElementById("submit-button").addEventListener("click", async () => {
   const formData = new FormData();
   formData.append("file", file);
 
+  // Send the voice descriptions too, e.g. "Juliet : naive female voice"
+  const numActors = parseInt(numActorsInput.value) || 1;
+  for (let i = 1; i <= numActors; i++) {
+    formData.append(`actor${i}`, form[`actor${i}`].value || "");
+  }
+
   try {
     // Send the file to the Flask backend
+    // One key per click: if the request is retried, the backend returns the
+    // render it already started instead of generating the audio again
     const response = await fetch("http://127.0.0.1:5000/generate_audio", {
       method: "POST",
+      headers: { "Idempotency-Key": crypto.randomUUID() },
       body: formData,
     });
 
     if (!response.ok) throw new Error("Request failed");
 
-    // Get the audio as a blob
-    const audioBlob = await response.blob();
+    // The backend streams the audio as it is generated: play it as it arrives,
+    // and keep every byte so the finished file can be replayed afterwards
+    const audioBytes = await playAudioStream(response, () => {
+      document.getElementById("output").style.display = "block";
+      loading_text.style.display = "none";
+    });
+
+    const audioBlob = new Blob(audioBytes, { type: "audio/wav" });
     const audioUrl = URL.createObjectURL(audioBlob);
 
     const audioSource = document.getElementById("audio-output");
@@ -102,11 +196,6 @@ document.getElementById("submit-button").addEventListener("click", async () => {
 
     const audioPlayer = document.getElementById("audioPlayer");
     audioPlayer.load();
-    audioPlayer.play();
-
-    const output = document.getElementById("output");
-    output.style.display = "block";
-    loading_text.style.display = "none";
 
     // Display the uploaded transcript text
     // const textContent = await file.text();